@@ -1,4 +1,11 @@
-from base_imports import *
+from __future__ import annotations
+
+from base_imports import os, np, pd, sparse, LazyModule
+
+pa = LazyModule("pyarrow")
+pa_csv = LazyModule("pyarrow.csv")
+
+graphs_path = "data/graphs/"
 
 
 def get_title_by_index(index):
@@ -33,28 +40,153 @@ def assign_known_title(index, actors_df, names_df):
     return actors_df
 
 
+def resolve_known_titles(actors_df: pd.DataFrame, names_df: pd.DataFrame, nb_titles=4, wide=True,
+                         keep_partial=False, titles_col='knownForTitles') -> pd.DataFrame:
+    """
+    Fetch the names of the first known titles of all actors with a single join,
+    instead of one get_title_by_index/assign_known_title merge per index
+    :param actors_df: actors dataframe
+    :param names_df: movie names dataframe, with 'tconst' and 'primaryTitle' columns
+    :param nb_titles: number of known titles to resolve per actor
+    :param wide: if True, return actors_df extended with knownForTitles0..nb_titles-1 columns,
+                 otherwise a long dataframe with one row per (actor, title position)
+    :param keep_partial: keep actors with at least one resolved title, instead of only those
+                         for which all nb_titles titles are resolved
+    :param titles_col: column of comma separated title ids
+    :return: said dataframe
+    """
+    titles = names_df.drop_duplicates(subset='tconst').set_index('tconst')['primaryTitle']
+
+    known_titles = actors_df[titles_col].astype(str).str.split(',').explode().rename('tconst').to_frame()
+    known_titles['position'] = known_titles.groupby(level=0).cumcount()
+    known_titles = known_titles[known_titles['position'] < nb_titles]
+    known_titles['primaryTitle'] = known_titles['tconst'].map(titles)
+    known_titles = known_titles.dropna(subset=['primaryTitle'])
+
+    nb_resolved = known_titles.groupby(level=0).size()
+    actors_kept = nb_resolved.index if keep_partial else nb_resolved.index[nb_resolved == nb_titles]
+    actors_kept = actors_df.index[actors_df.index.isin(actors_kept)]
+
+    if not wide:
+        return known_titles.loc[known_titles.index.isin(actors_kept)]
+
+    known_titles = known_titles.pivot(columns='position', values='primaryTitle')
+    known_titles = known_titles.reindex(index=actors_kept, columns=range(nb_titles))
+    known_titles.columns = [f"{titles_col}{index}" for index in range(nb_titles)]
+    return actors_df.loc[actors_kept].drop(columns=known_titles.columns, errors='ignore').join(known_titles)
+
+
 def is_actor(professions):
     return str(professions) == "actor" or str(professions) == "actress"
 
 
-def get_max(titles, name_revenue_df):
-    titles = titles.split(',')
+def title_revenue_index(name_revenue_df: pd.DataFrame) -> pd.Series:
+    """
+    Index the maximal revenue of each movie title
+    :param name_revenue_df: movies dataframe with 'primaryTitle' and 'Movie box office revenue' columns
+    :return: Series of revenues indexed by title
+    """
+    return name_revenue_df.groupby('primaryTitle')['Movie box office revenue'].max().dropna()
+
+
+def get_max(titles, name_revenue_df, verbose=False):
+    """
+    Revenue of the most lucrative of the given titles
+    :param titles: comma separated titles
+    :param name_revenue_df: movies dataframe, or its precomputed title_revenue_index
+    :param verbose: print the revenue found for each title
+    :return: said revenue, 0 if no title is found
+    """
+    revenues = name_revenue_df
+    if not isinstance(revenues, pd.Series):
+        revenues = title_revenue_index(name_revenue_df)
+
     max_ = 0.0
-    for title in titles:
+    for title in titles.split(','):
         if "*" in title or "+" in title or "?" in title: continue
-        print(title)
-        #if name_revenue_df['primaryTitle'].str.contains(title).any() :
-        revenue = name_revenue_df.loc[name_revenue_df['primaryTitle'] == title]['Movie box office revenue']
-
-        print(len(revenue))
-        if revenue.empty: continue
-        if len(revenue) > 1: revenue = max(revenue)
+        revenue = revenues.get(title)
+        if verbose:
+            print(title, revenue)
+        if revenue is None: continue
         if int(revenue) > int(max_):
             max_ = int(revenue)
 
     return max_
 
 
+def known_for_max_revenue(actors_df: pd.DataFrame, name_revenue_df, titles_col='knownForTitles', verbose=False) \
+        -> pd.Series:
+    """
+    Vectorized get_max over all actors: revenue of the most lucrative known title of each actor
+    :param actors_df: actors dataframe
+    :param name_revenue_df: movies dataframe, or its precomputed title_revenue_index
+    :param titles_col: column of comma separated titles
+    :param verbose: print the number of titles found
+    :return: Series of revenues aligned on actors_df, 0 for actors without any found title
+    """
+    revenues = name_revenue_df
+    if not isinstance(revenues, pd.Series):
+        revenues = title_revenue_index(name_revenue_df)
+
+    titles = actors_df[titles_col].astype(str).str.split(',').explode()
+    titles = titles[~titles.str.contains(r'[*+?]', regex=True)]
+    titles_revenue = titles.map(revenues).dropna()
+    if verbose:
+        print("Found", len(titles_revenue), "out of", len(titles), "titles")
+
+    max_revenue = titles_revenue.groupby(level=0).max()
+    return max_revenue.reindex(actors_df.index, fill_value=0).astype(np.int64)
+
+
+class ActorRegistry:
+    """
+    Interning table mapping Freebase actor IDs to stable integer codes and actor names.
+    Codes follow the order of first appearance of the actors in the characters dataframe.
+    """
+
+    def __init__(self, char_df: pd.DataFrame):
+        """
+        Build the registry in a single pass over the characters
+        :param char_df: characters dataframe, with 'Freebase actor ID' and 'Actor name' columns
+        """
+        actors = char_df[['Freebase actor ID', 'Actor name']].dropna(subset=['Freebase actor ID'])
+        actors = actors.drop_duplicates(subset='Freebase actor ID')
+        self.actor_ids = pd.Index(actors['Freebase actor ID'].to_numpy(dtype=object), name='Freebase actor ID')
+        self.actor_names = actors['Actor name'].to_numpy(dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.actor_ids)
+
+    def codes(self, actor_ids) -> np.ndarray:
+        """
+        Look up the codes of Freebase actor IDs
+        :param actor_ids: iterable of Freebase actor IDs
+        :return: int32 array of codes, -1 for unknown actors
+        """
+        return self.actor_ids.get_indexer(pd.Index(actor_ids, dtype=object)).astype(np.int32)
+
+    def ids(self, codes) -> np.ndarray:
+        """
+        :param codes: actor codes
+        :return: corresponding Freebase actor IDs
+        """
+        return self.actor_ids.to_numpy()[codes]
+
+    def names(self, codes) -> np.ndarray:
+        """
+        :param codes: actor codes
+        :return: corresponding actor names
+        """
+        return self.actor_names[codes]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: table of actors indexed by code
+        """
+        return pd.DataFrame({'Freebase actor ID': self.actor_ids, 'Actor name': self.actor_names},
+                            index=pd.RangeIndex(len(self), name='Actor code'))
+
+
 def get_metadata_df_from_genre(genre, metadata, do_filter=False, filter_on_revenue=True, n_filter=1000):
     # Returns dataframe of movies' metadata for films assigned to the given genre
     df = metadata[metadata["genre: " + genre] == 1][['Wikipedia movie ID', 'primaryTitle', 'originalTitle',
@@ -75,12 +207,16 @@ def get_metadata_df_from_genre(genre, metadata, do_filter=False, filter_on_reven
     return df
 
 
-def merge_characters_films(characters, movies):
+def merge_characters_films(characters, movies, registry: ActorRegistry = None):
     # Merge character dataframe with movies' metadata dataframe
     df = characters.merge(movies, left_on='Wikipedia movie ID', right_on='Wikipedia movie ID', how='inner')
 
     print("After merging, number of characters:", df.shape[0])
 
+    # Actor codes are shared with the graph built from the merged dataframe
+    if registry is not None:
+        df['Actor code'] = registry.codes(df['Freebase actor ID'])
+
     nb_actors = df['Freebase actor ID'].nunique()
     print("After merging, number of actors:", nb_actors)
 
@@ -90,76 +226,186 @@ def merge_characters_films(characters, movies):
     return df, nb_actors
 
 
-def create_graph(char_df, genre, nb_actors, weight_on_revenue=True):
+def film_actor_pairs(film_codes: np.ndarray, actor_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Enumerate every pair of distinct actors that have played in the same film
+    :param film_codes: integer film identifier of each character
+    :param actor_codes: integer actor identifier of each character
+    :return: (from actors, to actors, films) arrays, one entry per pair with from actor < to actor
+    """
+    # Actors playing several characters in a same film are only counted once
+    pairs = np.unique(np.stack([film_codes, actor_codes]), axis=1)
+    films, actors = pairs[0], pairs[1]
 
-    # Array that maps an index (identifier) to an actor ID and actor name
-    array_actors = char_df['Freebase actor ID'].unique()
-    for idx, actor_id in enumerate(array_actors):
-        array_actors[idx] = (actor_id, char_df[char_df['Freebase actor ID'] == actor_id].iloc[0]['Actor name'])
+    # Characters are now sorted by film then actor, so each actor is paired with
+    # all the actors following it within the same film
+    _, film_starts, film_sizes = np.unique(films, return_index=True, return_counts=True)
+    positions = np.arange(len(actors)) - np.repeat(film_starts, film_sizes)
+    nb_following = np.repeat(film_sizes, film_sizes) - positions - 1
 
-    # dict_actors maps an actor ID to the index in array_actors
-    dict_actors = {}
-    for idx, actor in enumerate(array_actors):
-        dict_actors[actor[0]] = idx
+    from_rows = np.repeat(np.arange(len(actors)), nb_following)
+    group_starts = np.cumsum(nb_following) - nb_following
+    to_rows = from_rows + np.arange(len(from_rows)) - np.repeat(group_starts, nb_following) + 1
 
-    print("Created array and dictionary of actors. First 5 entries of array_actors:")
-    print(array_actors[:5])
+    return actors[from_rows], actors[to_rows], films[from_rows]
 
-    # Initialize the adjacency matrix for the graph
-    adjacency_matrix = np.zeros(shape=(nb_actors, nb_actors))
 
-    # Pandas groupby object of characters grouped by film
-    characters_by_film_df = char_df.groupby(["Wikipedia movie ID"])
-    print("Grouped characters by film")
+def build_adjacency_matrix(char_df: pd.DataFrame, registry: ActorRegistry, weight_on_revenue=True) \
+        -> sparse.csr_matrix:
+    """
+    Build the upper triangular, weighted adjacency matrix of the co-acting graph
+    :param char_df: characters merged with the movies' metadata
+    :param registry: actors registry, its codes index the rows and columns of the matrix
+    :param weight_on_revenue: weight edges by revenue (in millions) if True, by rating otherwise
+    :return: sparse adjacency matrix, from actor code < to actor code
+    """
+    nb_actors = len(registry)
+    char_df = char_df.dropna(subset=['Wikipedia movie ID', 'Freebase actor ID'])
+    film_codes, _ = pd.factorize(char_df['Wikipedia movie ID'], sort=True)
+    actor_codes = registry.codes(char_df['Freebase actor ID']).astype(np.int64)
 
-    # We add an edge or increase its weight if the edge already exists
-    # between two distinct actors that have played in the same film.
     # Having worked on the same film contributes to the weight between two actors
     # by the revenue (in millions) or rating of the film.
-    for film in characters_by_film_df.groups.keys():
-        characters = characters_by_film_df.get_group(film)
-
-        # Prevents from counting multiple times actors that contribute
-        # as different characters in a same film
-        set_pair_actors = set()
-
-        for i, character_i in characters.iterrows():
-            for j, character_j in characters.iterrows():
-
-                from_index = dict_actors[character_i['Freebase actor ID']] # (from) actor idx in array_actors
-                to_index = dict_actors[character_j['Freebase actor ID']] # (to) actor idx in array_actors
-                hash_couple_actors = str(from_index)+"-"+str(to_index)
-                if hash_couple_actors in set_pair_actors:
-                    continue
-                else:
-                    set_pair_actors.add(hash_couple_actors)
-
-                if from_index < to_index:
-                    if weight_on_revenue:
-                        adjacency_matrix[from_index][to_index] += character_i['Movie box office revenue']/1000000.
-                    else:
-                        adjacency_matrix[from_index][to_index] += character_i['averageRating']
+    # Computed on all the characters, so that film codes keep indexing the weights
+    if weight_on_revenue:
+        film_weights = char_df.groupby(film_codes)['Movie box office revenue'].first() / 1000000.
+    else:
+        film_weights = char_df.groupby(film_codes)['averageRating'].first()
 
-    print("Populated adjacency matrix")
+    # Actors unknown to the registry are left out of the graph
+    known_actors = actor_codes >= 0
+    film_codes, actor_codes = film_codes[known_actors], actor_codes[known_actors]
+
+    from_index, to_index, film_index = film_actor_pairs(film_codes, actor_codes)
+    weights = film_weights.to_numpy(dtype=np.float64)[film_index]
+
+    # Sum the contributions of each pair of actors, film after film
+    pair_keys, pair_index = np.unique(from_index * nb_actors + to_index, return_inverse=True)
+    pair_weights = np.bincount(pair_index.ravel(), weights=weights, minlength=len(pair_keys))
+    from_index, to_index = np.divmod(pair_keys, nb_actors)
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(from_index, minlength=nb_actors))])
+    adjacency_matrix = sparse.csr_matrix((pair_weights, to_index, indptr), shape=(nb_actors, nb_actors))
+    adjacency_matrix.eliminate_zeros()
+    return adjacency_matrix
+
+
+def graph_name(genre: str, weight_on_revenue=True) -> str:
+    """
+    :param genre: genre of the movies of the graph
+    :param weight_on_revenue: whether edges are weighted by revenue or by rating
+    :return: name of the graph, e.g. 'graph_Romance_Film_revenue'
+    """
+    genre = "".join(char if char.isalnum() else "_" for char in genre)
+    return f"graph_{genre}_{'revenue' if weight_on_revenue else 'rating'}"
 
-    # Open graph csv file and write column headers
-    # TODO
-    with open("data/graphs/graph_" + "action_adventure" + ".csv", 'w', encoding='utf-8') as csvfile:
-        csv_writer = csv.writer(csvfile, delimiter=',')
-        csv_writer.writerow(["Source", "Target", "Weight"])
 
-        nb_edges = 0
+def save_graph(adjacency_matrix: sparse.csr_matrix, registry: ActorRegistry, directory: str) -> None:
+    """
+    Save a graph as its CSR arrays (indptr.npy, indices.npy, weights.npy) and a nodes.csv table
+    of the actor code, Freebase actor ID and name of every node
+    :param adjacency_matrix: adjacency matrix, indexed by actor codes
+    :param registry: actors registry
+    :param directory: str, created if needed
+    """
+    os.makedirs(directory, exist_ok=True)
+    adjacency_matrix = adjacency_matrix.tocsr()
+    # Indices are stored with the dtype scipy uses, so that loaded arrays are not converted
+    index_dtype = np.int32 if max(adjacency_matrix.nnz, adjacency_matrix.shape[0]) < np.iinfo(np.int32).max \
+        else np.int64
+    np.save(os.path.join(directory, "indptr.npy"), adjacency_matrix.indptr.astype(index_dtype))
+    np.save(os.path.join(directory, "indices.npy"), adjacency_matrix.indices.astype(index_dtype))
+    np.save(os.path.join(directory, "weights.npy"), adjacency_matrix.data.astype(np.float64))
+    registry.to_frame().to_csv(os.path.join(directory, "nodes.csv"))
+
+
+def load_graph(directory: str, mmap=True) -> tuple[sparse.csr_matrix, ActorRegistry]:
+    """
+    Load a graph saved by save_graph
+    :param directory: str
+    :param mmap: memory-map the arrays instead of reading them
+    :return: tuple of the adjacency matrix and the actors registry indexing it
+    """
+    mmap_mode = 'r' if mmap else None
+    indptr = np.load(os.path.join(directory, "indptr.npy"), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(directory, "indices.npy"), mmap_mode=mmap_mode)
+    weights = np.load(os.path.join(directory, "weights.npy"), mmap_mode=mmap_mode)
+    nodes = pd.read_csv(os.path.join(directory, "nodes.csv"), index_col='Actor code', keep_default_na=False,
+                        dtype={'Freebase actor ID': str, 'Actor name': str})
+    nb_actors = len(indptr) - 1
+    adjacency_matrix = sparse.csr_matrix((weights, indices, indptr), shape=(nb_actors, nb_actors), copy=False)
+    return adjacency_matrix, ActorRegistry(nodes)
+
+
+def write_graph_csv(adjacency_matrix: sparse.csr_matrix, registry: ActorRegistry, path: str,
+                    chunk_size=1000000) -> int:
+    """
+    Stream the graph edges to a Source,Target,Weight csv file keyed by Freebase actor ID,
+    along with a Gephi Id,Label node table mapping these IDs to actor names
+    :param adjacency_matrix: upper triangular adjacency matrix, indexed by actor codes, possibly memory-mapped
+    :param registry: actors registry
+    :param path: path of the edges csv file, the nodes are written next to it
+    :param chunk_size: number of edges converted and written at once
+    :return: number of edges
+    """
+    adjacency_matrix = adjacency_matrix.tocsr()
+    indptr, indices, weights = adjacency_matrix.indptr, adjacency_matrix.indices, adjacency_matrix.data
+    actor_ids = pa.array(registry.actor_ids.to_numpy(), type=pa.string())
+    write_options = pa_csv.WriteOptions(quoting_style='needed')
+
+    schema = pa.schema([("Source", pa.string()), ("Target", pa.string()), ("Weight", pa.float64())])
+    with pa_csv.CSVWriter(path, schema, write_options=write_options) as writer:
+        for start in range(0, adjacency_matrix.nnz, chunk_size):
+            end = min(start + chunk_size, adjacency_matrix.nnz)
+            rows = np.searchsorted(indptr, np.arange(start, end), side='right') - 1
+            writer.write_table(pa.table([actor_ids.take(rows), actor_ids.take(np.asarray(indices[start:end])),
+                                         pa.array(weights[start:end])], schema=schema))
+
+    # Only actors having at least one edge are written
+    has_edges = np.diff(indptr) > 0
+    has_edges[indices] = True
+    codes = np.flatnonzero(has_edges)
+    nodes = pa.table({"Id": actor_ids.take(codes), "Label": pa.array(registry.names(codes), type=pa.string())})
+    pa_csv.write_csv(nodes, path[:-len(".csv")] + "_nodes.csv", write_options=write_options)
+
+    return adjacency_matrix.nnz
+
+
+def create_graph(char_df, genre, nb_actors=None, weight_on_revenue=True, registry: ActorRegistry = None,
+                 gephi_csv=False) -> str:
+    """
+    Build the co-acting graph of a genre and save it under graphs_path
+    :param char_df: characters merged with the movies' metadata, e.g. from merge_characters_films
+    :param genre: genre of the movies, names the graph
+    :param nb_actors: legacy parameter, unused: the number of actors in the graph is computed from char_df
+    :param weight_on_revenue: weight edges by revenue (in millions) if True, by rating otherwise
+    :param registry: actors registry shared between graphs, built from char_df if None
+    :param gephi_csv: if True, also export the graph as a Gephi edge list
+    :return: directory of the saved graph
+    """
+
+    # Registry that maps an actor ID to an index (identifier) and actor name
+    if registry is None:
+        registry = ActorRegistry(char_df)
+
+    actor_codes = registry.codes(char_df['Freebase actor ID'].dropna())
+    print("Created registry of actors. First 5 entries:")
+    print(registry.to_frame().head(5))
+    print("Number of actors in the registry:", len(registry), "of which", len(np.unique(actor_codes[actor_codes >= 0])),
+          "in the graph")
+
+    adjacency_matrix = build_adjacency_matrix(char_df, registry, weight_on_revenue)
+
+    print("Populated adjacency matrix")
+
+    # Save the graph under a name given by the genre and weighting, and export it for Gephi if asked
+    directory = graphs_path + graph_name(genre, weight_on_revenue)
+    save_graph(adjacency_matrix, registry, directory)
 
-        # Add edges to the file
-        for from_ in range(nb_actors):
-            for to_ in range(from_+1, nb_actors):
-                # nodes in graph are represented by actor names
-                from_name = array_actors[from_][1]
-                to_name = array_actors[to_][1]
+    print("Saved graph to", directory, "number of edges:", adjacency_matrix.nnz)
 
-                weight = adjacency_matrix[from_][to_]
-                if weight != 0:
-                    csv_writer.writerow([from_name, to_name, weight]) # WE HAVE DUPLICATES IN THE NAMES!
-                    nb_edges += 1
+    if gephi_csv:
+        write_graph_csv(adjacency_matrix, registry, directory + ".csv")
+        print("Created graph csv file", directory + ".csv")
 
-    print("Created graph csv file, number of edges:", nb_edges)
+    return directory
@@ -4,31 +4,98 @@ import os
 
 import math
 import json
-import nltk
 import gzip
 import pickle
-import requests
 import csv
+import weakref
+import hashlib
+import importlib
+import inspect
+import time
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
 
-import scipy.stats as stats
-#import kaleido
-import plotly.express as px
-import matplotlib.pyplot as plt
-
-from bs4 import BeautifulSoup
 from collections import Counter
+from itertools import chain, repeat
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from functools import cmp_to_key
 
-from nltk.sentiment import SentimentIntensityAnalyzer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import TruncatedSVD
-from plotly.graph_objs import Figure
-
-import patsy.builtins as pat
 import xml.etree.ElementTree as ET
-import statsmodels.formula.api as smf
 
+
+class LazyModule:
+    """
+    Stand-in for a module, imported on first attribute access.
+    Heavy dependencies are declared as lazy modules so that importing the analysis modules
+    (e.g. in the worker processes of a pool) only pays for what is actually used.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'{'' if self._module is None else ' (loaded)'}>"
+
+
+class LazyAttribute:
+    """
+    Stand-in for an attribute of a module (typically a class), imported on first use
+    """
+
+    def __init__(self, module_name: str, name: str):
+        self._module_name = module_name
+        self._name = name
+        self._value = None
+
+    def _load(self):
+        if self._value is None:
+            self._value = getattr(importlib.import_module(self._module_name), self._name)
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __instancecheck__(self, instance) -> bool:
+        return isinstance(instance, self._load())
+
+    def __repr__(self) -> str:
+        return f"<lazy attribute '{self._module_name}.{self._name}'>"
+
+
+nltk = LazyModule("nltk")
+requests = LazyModule("requests")
+sns = LazyModule("seaborn")
+
+stats = LazyModule("scipy.stats")
+sparse = LazyModule("scipy.sparse")
+#import kaleido
+px = LazyModule("plotly.express")
+plt = LazyModule("matplotlib.pyplot")
+
+BeautifulSoup = LazyAttribute("bs4", "BeautifulSoup")
+
+SentimentIntensityAnalyzer = LazyAttribute("nltk.sentiment", "SentimentIntensityAnalyzer")
+TfidfVectorizer = LazyAttribute("sklearn.feature_extraction.text", "TfidfVectorizer")
+TfidfTransformer = LazyAttribute("sklearn.feature_extraction.text", "TfidfTransformer")
+TruncatedSVD = LazyAttribute("sklearn.decomposition", "TruncatedSVD")
+KMeans = LazyAttribute("sklearn.cluster", "KMeans")
+Figure = LazyAttribute("plotly.graph_objs", "Figure")
+
+pat = LazyModule("patsy.builtins")
+smf = LazyModule("statsmodels.formula.api")
@@ -0,0 +1,261 @@
+"""
+Hot path benchmark: time and peak memory of the main analysis functions on synthetic data (see synthetic_data.py)
+at several scales. Results are written as json, and can be compared with the results of a previous run to catch
+regressions: the script exits with status 1 if a benchmark got slower than the threshold.
+Run from the repository root: python benchmarks/bench_hot_paths.py --scales 1000 10000 --compare previous.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import actors_analysis  # noqa: E402
+import metadata_analysis  # noqa: E402
+import plots_analysis  # noqa: E402
+from synthetic_data import generate_characters, generate_lemmas, generate_metadata, write_corenlp_files  # noqa: E402
+
+results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+class SyntheticData:
+    """
+    Synthetic datasets of one scale, generated on first use
+    """
+
+    def __init__(self, scale: int, directory: str, seed: int, max_files: int, max_plots: int):
+        """
+        :param scale: number of movies
+        :param directory: working directory, the CoreNLP files are shared by all scales
+        :param seed: int
+        :param max_files: maximal number of CoreNLP files
+        :param max_plots: maximal number of plots for LSA
+        """
+        self.scale = scale
+        self.directory = directory
+        self.seed = seed
+        self.max_files = max_files
+        self.max_plots = max_plots
+        self._cache = {}
+
+    def get(self, name: str, generate):
+        if name not in self._cache:
+            self._cache[name] = generate()
+        return self._cache[name]
+
+    def metadata(self) -> pd.DataFrame:
+        return self.get("metadata", lambda: generate_metadata(self.scale, self.seed))
+
+    def processed_metadata(self) -> pd.DataFrame:
+        def generate():
+            df = self.metadata().copy()
+            metadata_analysis.append_processed_columns(df, "Movie genres")
+            return df
+        return self.get("processed metadata", generate)
+
+    def characters(self) -> pd.DataFrame:
+        return self.get("characters", lambda: generate_characters(self.metadata(), seed=self.seed))
+
+    def plots(self) -> pd.DataFrame:
+        def generate():
+            nb_plots = min(self.scale, self.max_plots)
+            return pd.DataFrame({"Wikipedia movie ID": self.metadata()["Wikipedia movie ID"].iloc[:nb_plots],
+                                 "important_lemmas": generate_lemmas(nb_plots, seed=self.seed)})
+        return self.get("plots", generate)
+
+    def corenlp_files(self) -> list:
+        def generate():
+            wiki_ids = list(range(1, min(self.scale, self.max_files) + 1))
+            write_corenlp_files(os.path.join(self.directory, "corenlp"), wiki_ids, seed=self.seed)
+            return wiki_ids
+        return self.get("corenlp files", generate)
+
+
+def setup_separate_ids_from_list_data(data: SyntheticData):
+    column = data.metadata()["Movie genres"]
+    return lambda: column.map(metadata_analysis.separate_ids_from_list_data), len(column)
+
+
+def setup_append_processed_columns(data: SyntheticData):
+    df = data.metadata()[["Movie genres"]].copy()
+    return lambda: metadata_analysis.append_processed_columns(df, "Movie genres"), len(df)
+
+
+def setup_append_indicator_columns(data: SyntheticData):
+    df = data.processed_metadata()
+    all_values = metadata_analysis.distinct_values(df, "Movie genres")
+    return lambda: metadata_analysis.append_indicator_columns(df, all_values, "Movie genres", "genre"), len(df)
+
+
+def setup_find_correlated_metadata(data: SyntheticData, nb_values=50):
+    df = data.processed_metadata()
+    indicators = metadata_analysis.build_indicator_matrix(df, "Movie genres", "genre")
+    frequent = indicators.frequencies().sort_values(ascending=False).index[:nb_values].tolist()
+    df = pd.concat([df, indicators.to_dataframe(frequent)], axis=1)
+    return lambda: metadata_analysis.find_correlated_metadata(df, frequent, "averageRating", "genre"), len(df)
+
+
+def setup_create_graph(data: SyntheticData):
+    char_df = data.characters()
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(data.directory)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                actors_analysis.create_graph(char_df, "Drama")
+        finally:
+            os.chdir(cwd)
+    return run, len(char_df["Wikipedia movie ID"].unique())
+
+
+def setup_get_term_topic_matrix(data: SyntheticData):
+    plots = data.plots()
+    return lambda: plots_analysis.get_term_topic_matrix(plots, nbr_topics=5), len(plots)
+
+
+def setup_get_important_lemmas(data: SyntheticData):
+    wiki_ids = data.corenlp_files()
+
+    def run():
+        plots_analysis.subpath = os.path.join(data.directory, "corenlp", "")
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [plots_analysis.get_important_lemmas(wiki_id) for wiki_id in wiki_ids]
+    return run, len(wiki_ids)
+
+
+def setup_get_important_lemmas_batch(data: SyntheticData):
+    wiki_ids = data.corenlp_files()
+
+    def run():
+        plots_analysis.subpath = os.path.join(data.directory, "corenlp", "")
+        return plots_analysis.get_important_lemmas_batch(wiki_ids, cache_file=None, verbose=False)
+    return run, len(wiki_ids)
+
+
+benchmarks = {
+    "separate_ids_from_list_data": setup_separate_ids_from_list_data,
+    "append_processed_columns": setup_append_processed_columns,
+    "append_indicator_columns": setup_append_indicator_columns,
+    "find_correlated_metadata": setup_find_correlated_metadata,
+    "create_graph": setup_create_graph,
+    "get_term_topic_matrix": setup_get_term_topic_matrix,
+    "get_important_lemmas": setup_get_important_lemmas,
+    "get_important_lemmas_batch": setup_get_important_lemmas_batch,
+}
+
+
+def measure(run, repeat: int) -> tuple[float, float]:
+    """
+    :param run: function without argument
+    :param repeat: number of timed runs
+    :return: tuple of the best wall-clock time in seconds and of the peak memory allocated during a run, in MB,
+             as seen by tracemalloc (python objects and numpy arrays), measured in a separate run
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak / 2 ** 20
+
+
+def environment() -> dict:
+    """
+    :return: versions of python and of the main libraries, machine and git commit of the run
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results: list, previous_path: str, threshold: float) -> list:
+    """
+    Print the ratios of the times of this run to those of a previous run
+    :param results: results of this run
+    :param previous_path: json file written by a previous run
+    :param threshold: relative slowdown above which a benchmark is reported as a regression
+    :return: list of the regressed (benchmark, scale)
+    """
+    with open(previous_path) as file:
+        previous = {(result["benchmark"], result["scale"]): result for result in json.load(file)["results"]}
+
+    regressions = []
+    print(f"\n{'benchmark':<30}{'scale':>10}{'before':>10}{'after':>10}{'ratio':>8}")
+    for result in results:
+        before = previous.get((result["benchmark"], result["scale"]))
+        if before is None:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append((result["benchmark"], result["scale"]))
+        print(f"{result['benchmark']:<30}{result['scale']:>10}{before['seconds']:>10.3f}{result['seconds']:>10.3f}"
+              f"{ratio:>8.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of movies, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(benchmarks), default=list(benchmarks))
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-files", type=int, default=2000, help="maximal number of CoreNLP files")
+    parser.add_argument("--max-plots", type=int, default=100000, help="maximal number of plots for LSA")
+    parser.add_argument("--output", default=None, help="json file of the results, in benchmarks/results by default")
+    parser.add_argument("--compare", default=None, help="json file of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'benchmark':<30}{'scale':>10}{'items':>10}{'seconds':>10}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            data = SyntheticData(scale, directory, args.seed, args.max_files, args.max_plots)
+            for name in args.benchmarks:
+                run, nb_items = benchmarks[name](data)
+                seconds, peak = measure(run, args.repeat)
+                results.append({"benchmark": name, "scale": scale, "items": nb_items, "seconds": seconds,
+                                "peak_mb": peak})
+                print(f"{name:<30}{scale:>10}{nb_items:>10}{seconds:>10.3f}{peak:>10.1f}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(results_path, exist_ok=True)
+        output = os.path.join(results_path, f"hot_paths-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as file:
+        json.dump({"environment": environment(), "seed": args.seed, "results": results}, file, indent=1)
+    print(f"\nResults written to {output}")
+
+    if args.compare is not None and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
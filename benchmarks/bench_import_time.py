@@ -0,0 +1,49 @@
+"""
+Cold start benchmark: time, in fresh interpreters, the import of the analysis modules and the startup
+of a lemma extraction worker (importing plots_analysis and parsing one CoreNLP file).
+Run from the repository root: python benchmarks/bench_import_time.py
+"""
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+statements = {
+    "python startup": "pass",
+    "import base_imports": "import base_imports",
+    "import actors_analysis": "import actors_analysis",
+    "import metadata_analysis": "import metadata_analysis",
+    "import plots_analysis": "import plots_analysis",
+    "import imports": "import imports",
+    "lemmas worker": "import plots_analysis; plots_analysis.parse_important_lemmas({path!r})",
+}
+
+sample_xml = ('<?xml version="1.0"?><root><document><sentences><sentence id="1"><tokens>'
+              '<token id="1"><word>Heroes</word><lemma>hero</lemma><POS>NNS</POS></token>'
+              '<token id="2"><word>save</word><lemma>save</lemma><POS>VBP</POS></token>'
+              '</tokens></sentence></sentences></document></root>')
+
+
+def time_statement(statement: str, repeat=5) -> float:
+    """
+    :param statement: python code run in a fresh interpreter
+    :param repeat: number of runs
+    :return: best wall-clock time in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "1.xml.gz")
+        with gzip.open(path, "wt") as file:
+            file.write(sample_xml)
+        for label, statement in statements.items():
+            print(f"{label:<26}{time_statement(statement.format(path=path)):.3f}s")
@@ -0,0 +1,188 @@
+"""
+Seeded generators of synthetic data shaped like the project's datasets: CMU movie metadata with Freebase
+{id: name} columns, character tables and gzipped CoreNLP plot summaries. Popularity of genres, countries,
+languages, actors and words follows Zipf-like laws, so value frequencies resemble the real data.
+"""
+import gzip
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Sizes of the pools of values of the Freebase columns, roughly those of the CMU dataset
+pool_sizes = {"Movie genres": 363, "Movie countries": 147, "Movie languages": 206}
+value_names = {"Movie genres": "Genre", "Movie countries": "Country", "Movie languages": "Language"}
+# Mean number of values per movie, and mean number of characters per movie
+mean_values = {"Movie genres": 3.5, "Movie countries": 1.2, "Movie languages": 1.2}
+mean_cast = 8
+
+pos_tags = ["NN", "NNS", "NNP", "VB", "VBD", "VBZ", "VBG", "RB", "PRP", "DT", "IN", "JJ", "CC", "PP"]
+pos_weights = [0.16, 0.07, 0.1, 0.06, 0.07, 0.05, 0.03, 0.05, 0.06, 0.12, 0.1, 0.07, 0.04, 0.02]
+ner_tags = ["O", "O", "O", "O", "O", "PERSON", "LOCATION", "ORGANIZATION"]
+
+
+def zipf_choice(rng: np.random.Generator, nb_values: int, size, exponent=1.1) -> np.ndarray:
+    """
+    :param rng: random generator
+    :param nb_values: number of distinct values
+    :param size: output shape
+    :param exponent: exponent of the Zipf law, higher means a more skewed popularity
+    :return: codes in [0, nb_values), code 0 being the most frequent
+    """
+    weights = 1. / np.arange(1, nb_values + 1) ** exponent
+    return rng.choice(nb_values, size=size, p=weights / weights.sum())
+
+
+def freebase_ids(prefix: str, nb_values: int) -> np.ndarray:
+    """
+    :param prefix: distinguishes the ids of the different pools
+    :param nb_values: number of ids
+    :return: Freebase-like ids, e.g. '/m/0g0a1'
+    """
+    return np.array([f"/m/0{prefix}{code:x}" for code in range(nb_values)], dtype=object)
+
+
+def freebase_strings(rng: np.random.Generator, nb_movies: int, ids: np.ndarray, names: np.ndarray,
+                     mean_length: float) -> list[str]:
+    """
+    Freebase {id: name} strings as found in the CMU metadata, e.g. '{"/m/07s9rl0": "Drama"}'
+    :param rng: random generator
+    :param nb_movies: number of strings
+    :param ids: Freebase ids of the pool of values
+    :param names: names of the pool of values
+    :param mean_length: mean number of pairs per string, some strings are empty ('{}')
+    :return: list of strings
+    """
+    lengths = rng.poisson(mean_length, nb_movies)
+    codes = zipf_choice(rng, len(ids), lengths.sum())
+    pairs = np.char.add(np.char.add(np.char.add('"', ids[codes].astype(str)), '": "'),
+                        np.char.add(names[codes].astype(str), '"'))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    # A value is listed at most once per movie
+    return ["{" + ", ".join(dict.fromkeys(pairs[start:end])) + "}" for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def generate_metadata(nb_movies: int, seed=0) -> pd.DataFrame:
+    """
+    CMU-shaped movie metadata merged with IMDb ratings
+    :param nb_movies: number of movies
+    :param seed: int
+    :return: dataframe with the columns of movie.metadata.tsv, 'averageRating' and 'numVotes'
+    """
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1910, 2015, nb_movies)
+    dates = pd.Series(years.astype(str))
+    with_day = rng.random(nb_movies) < 0.6
+    months = pd.Series(rng.integers(1, 13, nb_movies), dtype=str).str.zfill(2)
+    dates[with_day] = dates[with_day] + "-" + months[with_day] + "-15"
+    dates[rng.random(nb_movies) < 0.08] = None
+
+    revenue = np.exp(rng.normal(16, 2, nb_movies)).round()
+    revenue[rng.random(nb_movies) < 0.9] = np.nan
+    df = pd.DataFrame({
+        "Wikipedia movie ID": rng.permutation(np.arange(330, 330 + 50 * nb_movies, 50)),
+        "Freebase movie ID": freebase_ids("m", nb_movies),
+        "Movie name": [f"Movie {code}" for code in range(nb_movies)],
+        "Movie release date": dates.to_numpy(dtype=object),
+        "Movie box office revenue": revenue,
+        "Movie runtime": rng.normal(95, 20, nb_movies).round(),
+    })
+    for col, nb_values in pool_sizes.items():
+        names = np.array([f"{value_names[col]} {code}" for code in range(nb_values)], dtype=object)
+        df[col] = freebase_strings(rng, nb_movies, freebase_ids(col[6], nb_values), names, mean_values[col])
+    df["averageRating"] = np.clip(rng.normal(6.3, 1.1, nb_movies), 1, 10).round(1)
+    df["numVotes"] = np.exp(rng.normal(7, 2, nb_movies)).astype(np.int64)
+    return df
+
+
+def generate_characters(metadata: pd.DataFrame, nb_actors: int = None, seed=0) -> pd.DataFrame:
+    """
+    Character table merged with the metadata of the movies, as expected by create_graph
+    :param metadata: output of generate_metadata
+    :param nb_actors: size of the pool of actors, defaults to half the number of movies
+    :param seed: int
+    :return: dataframe with 'Wikipedia movie ID', 'Freebase actor ID', 'Actor name',
+             'Movie box office revenue' and 'averageRating' columns
+    """
+    rng = np.random.default_rng(seed)
+    nb_actors = max(10, len(metadata) // 2) if nb_actors is None else nb_actors
+    cast_sizes = rng.poisson(mean_cast, len(metadata))
+    movies = np.repeat(np.arange(len(metadata)), cast_sizes)
+    actors = zipf_choice(rng, nb_actors, len(movies), exponent=0.8)
+    chars = metadata[["Wikipedia movie ID", "Movie box office revenue", "averageRating"]].iloc[movies]
+    chars.insert(1, "Freebase actor ID", freebase_ids("a", nb_actors)[actors])
+    chars.insert(2, "Actor name", np.array([f"Actor {code}" for code in range(nb_actors)], dtype=object)[actors])
+    return chars.reset_index(drop=True)
+
+
+def generate_lemmas(nb_movies: int, vocabulary_size=20000, mean_length=120, seed=0) -> list[list[str]]:
+    """
+    :param nb_movies: number of plot summaries
+    :param vocabulary_size: number of distinct lemmas
+    :param mean_length: mean number of important lemmas per summary
+    :param seed: int
+    :return: list of lemmas of each summary, as the 'important_lemmas' column
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"lemma{code}" for code in range(vocabulary_size)], dtype=object)
+    lengths = rng.poisson(mean_length, nb_movies)
+    words = vocabulary[zipf_choice(rng, vocabulary_size, lengths.sum())]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [words[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def corenlp_xml(rng: np.random.Generator, nb_sentences: int, vocabulary_size=20000) -> str:
+    """
+    :param rng: random generator
+    :param nb_sentences: number of sentences
+    :param vocabulary_size: number of distinct words
+    :return: CoreNLP-style xml of a plot summary, with tokens, parse trees and dependencies
+    """
+    sentences = []
+    for sentence_id in range(1, nb_sentences + 1):
+        nb_tokens = rng.integers(8, 30)
+        words = zipf_choice(rng, vocabulary_size, nb_tokens)
+        tags = rng.choice(len(pos_tags), nb_tokens, p=pos_weights)
+        tokens = "".join(
+            f'<token id="{i + 1}"><word>Word{word}</word><lemma>lemma{word}</lemma>'
+            f'<CharacterOffsetBegin>{8 * i}</CharacterOffsetBegin><CharacterOffsetEnd>{8 * i + 7}'
+            f'</CharacterOffsetEnd><POS>{pos_tags[tag]}</POS><NER>{ner_tags[word % len(ner_tags)]}</NER></token>'
+            for i, (word, tag) in enumerate(zip(words, tags)))
+        dependencies = "".join(f'<dep type="dep"><governor idx="{i}">Word{words[i - 1]}</governor>'
+                               f'<dependent idx="{i + 1}">Word{words[i]}</dependent></dep>'
+                               for i in range(1, nb_tokens))
+        parse = "(ROOT (S " + " ".join(f"({pos_tags[tag]} Word{word})" for word, tag in zip(words, tags)) + "))"
+        sentences.append(f'<sentence id="{sentence_id}"><tokens>{tokens}</tokens><parse>{parse}</parse>'
+                         f'<basic-dependencies>{dependencies}</basic-dependencies></sentence>')
+    return ('<?xml version="1.0" encoding="UTF-8"?><root><document><sentences>' + "".join(sentences)
+            + '</sentences><coreference></coreference></document></root>')
+
+
+def write_corenlp_files(directory: str, wiki_ids, mean_sentences=20, seed=0) -> list[str]:
+    """
+    Write gzipped CoreNLP-style plot summaries named as in corenlp_plot_summaries. Each file only depends
+    on the seed and its id, so files already present are kept and directories can be shared between runs.
+    :param directory: str, created if needed
+    :param wiki_ids: wikipedia movie ids
+    :param mean_sentences: mean number of sentences per summary
+    :param seed: int
+    :return: list of the paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for wiki_id in wiki_ids:
+        path = os.path.join(directory, f"{wiki_id}.xml.gz")
+        if not os.path.isfile(path):
+            rng = np.random.default_rng([seed, wiki_id])
+            with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=1) as file:
+                file.write(corenlp_xml(rng, max(1, rng.poisson(mean_sentences))))
+            os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    sample = generate_metadata(5)
+    print(sample.to_string())
+    print(json.dumps(generate_lemmas(1, mean_length=10)))
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from base_imports import hashlib, json, os, ProcessPoolExecutor, LazyModule
+
+plotly = LazyModule("plotly")
+pio = LazyModule("plotly.io")
+plotly_offline = LazyModule("plotly.offline")
+
+plotlyjs_file = "plotly.min.js"
+manifest_file = ".figures.json"
+
+
+def write_plotlyjs(directory: str) -> str:
+    """
+    Write the plotly.js bundle shared by all html figures of a directory, unless already there
+    :param directory: output directory
+    :return: path of the bundle
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, plotlyjs_file)
+    version_path = path + ".version"
+    version = None
+    if os.path.isfile(path) and os.path.isfile(version_path):
+        with open(version_path) as f:
+            version = f.read()
+    if version != plotly.__version__:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(plotly_offline.get_plotlyjs())
+        with open(version_path, "w") as f:
+            f.write(plotly.__version__)
+    return path
+
+
+def figure_hash(fig_json: str, fmt: str) -> str:
+    """
+    :param fig_json: figure spec as json
+    :param fmt: 'html' or 'json'
+    :return: content hash of the exported figure
+    """
+    return hashlib.sha256(f"{fmt}:{plotly.__version__}:{fig_json}".encode("utf-8")).hexdigest()
+
+
+def render_figure(path: str, fig_json: str, fmt: str, content_hash: str) -> str:
+    """
+    Write a figure, as an html page loading the shared plotly.js bundle or as a json spec
+    :param path: output path
+    :param fig_json: figure spec as json
+    :param fmt: 'html' or 'json'
+    :param content_hash: used as a deterministic div id
+    :return: path
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "json":
+            f.write(fig_json)
+        else:
+            f.write(pio.to_html(json.loads(fig_json), include_plotlyjs=plotlyjs_file, div_id=content_hash[:16],
+                                validate=False))
+    return path
+
+
+def export_figures(figures: dict, fmt="html", n_workers=None, force=False) -> list:
+    """
+    Export many plotly figures at once. Html figures reference a plotly.js bundle written once per output
+    directory instead of embedding it. A figure is only rendered again when the hash of its spec differs
+    from the one recorded in the directory's manifest; rendering happens in a process pool.
+    :param figures: dict mapping output paths to Figure objects
+    :param fmt: 'html' or 'json'
+    :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to render in the current process
+    :param force: render all figures even if unchanged
+    :return: list of the written paths
+    """
+    by_directory = {}
+    for path, fig in figures.items():
+        by_directory.setdefault(os.path.dirname(path) or ".", {})[path] = fig
+
+    to_render, manifests = [], {}
+    for directory, directory_figures in by_directory.items():
+        if fmt == "html":
+            write_plotlyjs(directory)
+        manifest_path = os.path.join(directory, manifest_file)
+        manifest = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        manifests[manifest_path] = manifest
+
+        for path, fig in directory_figures.items():
+            fig_json = fig.to_json()
+            content_hash = figure_hash(fig_json, fmt)
+            name = os.path.basename(path)
+            if force or manifest.get(name) != content_hash or not os.path.isfile(path):
+                to_render.append((path, fig_json, fmt, content_hash))
+                manifest[name] = content_hash
+
+    if n_workers == 0 or len(to_render) <= 1:
+        written = [render_figure(*args) for args in to_render]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            written = list(executor.map(render_figure, *zip(*to_render)))
+
+    for manifest_path, manifest in manifests.items():
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    print(f"Exported {len(written)} figures, {len(figures) - len(written)} unchanged")
+    return written
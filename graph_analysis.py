@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+from base_imports import os, np, pd, sparse, KMeans, LazyModule
+from actors_analysis import ActorRegistry, load_graph
+from metadata_analysis import IndicatorMatrix
+
+csgraph = LazyModule("scipy.sparse.csgraph")
+sparse_linalg = LazyModule("scipy.sparse.linalg")
+
+
+class ActorGraph:
+    """
+    Undirected weighted co-acting graph stored as a symmetric CSR adjacency matrix.
+    Nodes are identified by the keys of the edge list (Freebase actor IDs, or actor names for older graphs).
+    """
+
+    def __init__(self, adjacency: sparse.csr_matrix, node_ids, labels=None):
+        """
+        :param adjacency: symmetric adjacency matrix
+        :param node_ids: identifier of each node
+        :param labels: name of each node, defaults to the identifiers
+        """
+        self.adjacency = adjacency.tocsr()
+        self.node_ids = pd.Index(node_ids, name='Id')
+        self.labels = self.node_ids.to_numpy() if labels is None else np.asarray(labels, dtype=object)
+
+    @classmethod
+    def from_adjacency(cls, adjacency_matrix: sparse.csr_matrix, registry: ActorRegistry) -> "ActorGraph":
+        """
+        :param adjacency_matrix: upper triangular adjacency matrix, as returned by build_adjacency_matrix
+        :param registry: actors registry indexing the matrix
+        :return: said graph, including actors without edge
+        """
+        return cls((adjacency_matrix + adjacency_matrix.T).tocsr(), registry.actor_ids, registry.actor_names)
+
+    @classmethod
+    def load(cls, directory: str, mmap=True) -> "ActorGraph":
+        """
+        :param directory: graph saved by save_graph (e.g. by create_graph)
+        :param mmap: memory-map the saved arrays instead of reading them
+        :return: said graph
+        """
+        return cls.from_adjacency(*load_graph(directory, mmap))
+
+    @classmethod
+    def from_csv(cls, path: str) -> "ActorGraph":
+        """
+        Load a Source,Target,Weight edge list written by create_graph. Actor names are read from
+        the Id,Label node table written next to it, if any.
+        :param path: path of the edges csv file
+        :return: said graph, duplicate edges being summed
+        """
+        edges = pd.read_csv(path, dtype={'Source': str, 'Target': str, 'Weight': np.float64},
+                            float_precision='round_trip')
+        codes, node_ids = pd.factorize(pd.concat([edges['Source'], edges['Target']], ignore_index=True))
+        nb_nodes, nb_edges = len(node_ids), len(edges)
+        rows, cols = codes[:nb_edges], codes[nb_edges:]
+        weights = edges['Weight'].to_numpy()
+        adjacency = sparse.csr_matrix((np.concatenate([weights, weights]),
+                                       (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                                      shape=(nb_nodes, nb_nodes))
+
+        labels = None
+        nodes_path = path[:-len(".csv")] + "_nodes.csv"
+        if os.path.isfile(nodes_path):
+            nodes = pd.read_csv(nodes_path, dtype=str, keep_default_na=False)
+            nodes = nodes.drop_duplicates(subset='Id').set_index('Id')['Label']
+            labels = nodes.reindex(node_ids).fillna(pd.Series(node_ids, index=node_ids)).to_numpy(dtype=object)
+        return cls(adjacency, node_ids, labels)
+
+    def __len__(self) -> int:
+        return self.adjacency.shape[0]
+
+    def degrees(self) -> np.ndarray:
+        """
+        :return: number of neighbours of each node
+        """
+        return np.diff(self.adjacency.indptr)
+
+    def weighted_degrees(self) -> np.ndarray:
+        """
+        :return: sum of the weights of the edges of each node
+        """
+        return np.asarray(self.adjacency.sum(axis=1)).ravel()
+
+    def connected_components(self) -> np.ndarray:
+        """
+        :return: component label of each node
+        """
+        return csgraph.connected_components(self.adjacency, directed=False)[1]
+
+    def pagerank(self, damping=0.85, tol=1e-10, max_iter=1000) -> np.ndarray:
+        """
+        Weighted PageRank by power iteration, the random walk jumping from nodes without edge to a uniform node
+        :param damping: probability of following an edge
+        :param tol: convergence tolerance on the L1 norm of the update
+        :param max_iter: maximal number of iterations
+        :return: PageRank of each node, summing to 1
+        """
+        nb_nodes = len(self)
+        out_weights = self.weighted_degrees()
+        dangling = out_weights == 0
+        with np.errstate(divide='ignore'):
+            inverse_weights = np.where(dangling, 0., 1. / out_weights)
+        transition_T = (sparse.diags(inverse_weights) @ self.adjacency).T.tocsr()
+
+        ranks = np.full(nb_nodes, 1. / nb_nodes)
+        for _ in range(max_iter):
+            updated = damping * (transition_T @ ranks + ranks[dangling].sum() / nb_nodes) + (1 - damping) / nb_nodes
+            delta = np.abs(updated - ranks).sum()
+            ranks = updated
+            if delta < tol:
+                break
+        return ranks / ranks.sum()
+
+    def modularity(self, communities: np.ndarray, resolution=1.) -> float:
+        """
+        :param communities: community label of each node
+        :param resolution: resolution parameter, higher values favour smaller communities
+        :return: modularity of the partition
+        """
+        return modularity(self.adjacency, communities, resolution)
+
+    def louvain(self, resolution=1., seed=0, max_levels=20, max_sweeps=100) -> np.ndarray:
+        """
+        Louvain-style modularity clustering: see louvain_communities
+        :return: community label of each node, communities being numbered by decreasing size
+        """
+        return louvain_communities(self.adjacency, resolution, seed, max_levels, max_sweeps)
+
+    def spectral_clustering(self, n_clusters=8, seed=0) -> np.ndarray:
+        """
+        Spectral clustering of the nodes having edges: k-means on the rows of the leading eigenvectors of the
+        normalized adjacency matrix D^-1/2 A D^-1/2, computed with a sparse eigensolver
+        :param n_clusters: number of clusters
+        :param seed: int, for reproducibility
+        :return: cluster label of each node, -1 for nodes without edge
+        """
+        weights = self.weighted_degrees()
+        connected = weights > 0
+        adjacency = self.adjacency[connected][:, connected]
+        inverse_sqrt = sparse.diags(1. / np.sqrt(weights[connected]))
+        normalized = inverse_sqrt @ adjacency @ inverse_sqrt
+
+        # The spectrum of the normalized adjacency lies in [-1, 1]: shifting it makes the wanted eigenvalues
+        # the largest in magnitude, where the Lanczos solver converges fastest
+        shifted = normalized + sparse.identity(normalized.shape[0], format='csr')
+        v0 = np.random.default_rng(seed).random(normalized.shape[0])
+        _, vectors = sparse_linalg.eigsh(shifted, k=n_clusters, which='LM', v0=v0)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        labels = np.full(len(self), -1)
+        labels[connected] = KMeans(n_clusters=n_clusters, n_init=10, random_state=seed).fit_predict(vectors)
+        return labels
+
+    def node_features(self, resolution=1., n_clusters=8, seed=0, spectral=True) -> pd.DataFrame:
+        """
+        Centralities and clusters of every node
+        :param resolution: resolution of the Louvain clustering
+        :param n_clusters: number of spectral clusters
+        :param seed: int, for reproducibility
+        :param spectral: compute the spectral clusters
+        :return: dataframe indexed by node id with 'Actor name', 'degree', 'weighted degree', 'pagerank',
+                 'component', 'community' and 'spectral cluster' columns
+        """
+        features = pd.DataFrame({'Actor name': self.labels, 'degree': self.degrees(),
+                                 'weighted degree': self.weighted_degrees(), 'pagerank': self.pagerank(),
+                                 'component': self.connected_components(),
+                                 'community': self.louvain(resolution, seed)}, index=self.node_ids)
+        if spectral:
+            features['spectral cluster'] = self.spectral_clustering(n_clusters, seed)
+        return features
+
+
+def modularity(adjacency: sparse.csr_matrix, communities: np.ndarray, resolution=1.) -> float:
+    """
+    :param adjacency: symmetric adjacency matrix, diagonal entries counting twice the weight inside a node
+    :param communities: community label of each node
+    :param resolution: resolution parameter
+    :return: modularity of the partition
+    """
+    adjacency = adjacency.tocsr()
+    total_weight = adjacency.sum()
+    rows = np.repeat(np.arange(adjacency.shape[0]), np.diff(adjacency.indptr))
+    inside = adjacency.data[communities[rows] == communities[adjacency.indices]].sum()
+    community_weights = np.bincount(communities, weights=np.asarray(adjacency.sum(axis=1)).ravel())
+    return inside / total_weight - resolution * (community_weights ** 2).sum() / total_weight ** 2
+
+
+def move_nodes(adjacency: sparse.csr_matrix, resolution: float, rng: np.random.Generator,
+               max_sweeps: int) -> np.ndarray:
+    """
+    Local moving phase of the Louvain method, vectorized: at each sweep, the gain of moving every node to
+    each neighbouring community is computed with one sparse product, and a random half of the nodes having
+    a positive gain move to their best community. The share of moving nodes is halved whenever a sweep
+    does not increase modularity, which prevents nodes from swapping communities back and forth.
+    :param adjacency: symmetric adjacency matrix of the (aggregated) graph
+    :param resolution: resolution parameter
+    :param rng: random generator
+    :param max_sweeps: maximal number of sweeps
+    :return: community of each node
+    """
+    nb_nodes = adjacency.shape[0]
+    total_weight = adjacency.sum()
+    node_weights = np.asarray(adjacency.sum(axis=1)).ravel()
+    self_loops = adjacency.diagonal()
+    neighbours = (adjacency - sparse.diags(self_loops)).tocsr()
+    neighbours.eliminate_zeros()
+
+    communities = np.arange(nb_nodes)
+    if total_weight == 0:
+        return communities
+    best_modularity = modularity(adjacency, communities, resolution)
+    move_probability = 0.5
+    for _ in range(max_sweeps):
+        community_weights = np.bincount(communities, weights=node_weights, minlength=nb_nodes)
+        membership = sparse.csr_matrix((np.ones(nb_nodes), (np.arange(nb_nodes), communities)),
+                                       shape=(nb_nodes, nb_nodes))
+        links = (neighbours @ membership).tocsr()
+        links.sum_duplicates()
+        link_rows = np.repeat(np.arange(nb_nodes), np.diff(links.indptr))
+
+        # Gain (up to a constant factor) of each node joining each neighbouring community, and of staying
+        scores = links.data - resolution * node_weights[link_rows] * community_weights[links.indices] / total_weight
+        own = links.indices == communities[link_rows]
+        scores[own] += resolution * node_weights[link_rows[own]] ** 2 / total_weight
+        stay_scores = -resolution * node_weights * (community_weights[communities] - node_weights) / total_weight
+        stay_scores[link_rows[own]] = scores[own]
+
+        order = np.lexsort((-scores, link_rows))
+        has_links = np.diff(links.indptr) > 0
+        firsts = order[links.indptr[:-1][has_links]]
+        best_communities, best_scores = communities.copy(), stay_scores.copy()
+        best_communities[has_links], best_scores[has_links] = links.indices[firsts], scores[firsts]
+
+        movers = (best_scores > stay_scores + 1e-12 * np.abs(stay_scores)) & (best_communities != communities)
+        if not movers.any():
+            break
+        movers &= rng.random(nb_nodes) < move_probability
+        candidates = np.where(movers, best_communities, communities)
+        candidate_modularity = modularity(adjacency, candidates, resolution)
+        if candidate_modularity > best_modularity:
+            communities, best_modularity = candidates, candidate_modularity
+        else:
+            move_probability /= 2
+            if move_probability < 1e-3:
+                break
+    return communities
+
+
+def louvain_communities(adjacency: sparse.csr_matrix, resolution=1., seed=0, max_levels=20,
+                        max_sweeps=100) -> np.ndarray:
+    """
+    Louvain-style modularity clustering on a sparse graph: nodes are moved between communities
+    (see move_nodes), then communities are aggregated into the nodes of a smaller graph with a sparse
+    product P^T A P, until modularity stops increasing
+    :param adjacency: symmetric adjacency matrix
+    :param resolution: resolution parameter, higher values favour smaller communities
+    :param seed: int, for reproducibility
+    :param max_levels: maximal number of aggregations
+    :param max_sweeps: maximal number of sweeps of each local moving phase
+    :return: community label of each node, communities being numbered by decreasing size
+    """
+    rng = np.random.default_rng(seed)
+    graph = adjacency.tocsr().astype(np.float64)
+    labels = np.arange(graph.shape[0])
+    for _ in range(max_levels):
+        communities = move_nodes(graph, resolution, rng, max_sweeps)
+        communities = np.unique(communities, return_inverse=True)[1]
+        nb_communities = communities.max() + 1 if len(communities) else 0
+        if nb_communities == graph.shape[0]:
+            break
+        labels = communities[labels]
+        membership = sparse.csr_matrix((np.ones(len(communities)), (np.arange(len(communities)), communities)),
+                                       shape=(len(communities), nb_communities))
+        graph = (membership.T @ graph @ membership).tocsr()
+
+    sizes = np.bincount(labels)
+    ranks = np.empty(len(sizes), dtype=np.int64)
+    ranks[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+    return ranks[labels]
+
+
+def movie_graph_features(char_df: pd.DataFrame, node_features: pd.DataFrame, id_col='Freebase actor ID',
+                         movie_col='Wikipedia movie ID') -> pd.DataFrame:
+    """
+    Aggregate the graph features of the actors of each movie
+    :param char_df: characters, with movie and actor columns
+    :param node_features: output of ActorGraph.node_features, indexed by the same actor ids as char_df
+    :param id_col: actor column of char_df
+    :param movie_col: movie column of char_df
+    :return: dataframe indexed by movie with the mean and max pagerank and weighted degree of its actors,
+             the number of its actors in the graph and of distinct communities among them
+    """
+    cast = char_df[[movie_col, id_col]].dropna().drop_duplicates()
+    cast = cast.join(node_features[['weighted degree', 'pagerank', 'community']], on=id_col, how='inner')
+    grouped = cast.groupby(movie_col)
+    features = grouped[['pagerank', 'weighted degree']].agg(['mean', 'max'])
+    features.columns = [f"{statistic} actor {feature}" for feature, statistic in features.columns]
+    features['actors in graph'] = grouped.size()
+    features['actor communities'] = grouped['community'].nunique()
+    return features
+
+
+def community_indicators(char_df: pd.DataFrame, movies: pd.DataFrame, node_features: pd.DataFrame,
+                         cluster_col='community', prefix='community', nb_clusters: int = None,
+                         id_col='Freebase actor ID', movie_col='Wikipedia movie ID') -> IndicatorMatrix:
+    """
+    Indicator matrix of the communities (or clusters) of the actors of each movie, usable as regression features,
+    e.g. fast_linear_reg(movies, metrics, prefix, values, indicators=community_indicators(...))
+    :param char_df: characters, with movie and actor columns
+    :param movies: movies, the rows of the matrix
+    :param node_features: output of ActorGraph.node_features, indexed by the same actor ids as char_df
+    :param cluster_col: column of node_features to encode, 'community' or 'spectral cluster'
+    :param prefix: prefix of the values
+    :param nb_clusters: only encode the nb_clusters largest clusters, all of them if None
+    :param id_col: actor column of char_df
+    :param movie_col: movie column of char_df and movies
+    :return: said indicator matrix, indexed as movies
+    """
+    cast = char_df[[movie_col, id_col]].dropna().drop_duplicates()
+    clusters = node_features[cluster_col].reindex(cast[id_col]).to_numpy()
+    rows = pd.Index(movies[movie_col]).get_indexer(cast[movie_col])
+
+    values = pd.Series(node_features[cluster_col]).value_counts().index
+    values = values[values >= 0]
+    if nb_clusters is not None:
+        values = values[:nb_clusters]
+    cols = values.get_indexer(clusters)
+    kept = (rows >= 0) & (cols >= 0)
+
+    matrix = sparse.csr_matrix((np.ones(kept.sum(), dtype=np.uint8), (rows[kept], cols[kept])),
+                               shape=(len(movies), len(values)))
+    matrix.data[:] = 1
+    return IndicatorMatrix(matrix, list(values), prefix, movies.index)
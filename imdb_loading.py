@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from base_imports import csv, os, np, pd
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+data_path = "data/"
+cache_path = "data/cache/"
+
+# Schema of the IMDb datasets: arrow type of every column. Dictionary encoded columns are
+# loaded as pandas categoricals, integer columns are nullable since IMDb writes NaNs as \N
+imdb_schemas = {
+    "imdb_title_basics": {
+        "tconst": pa.string(),
+        "titleType": pa.dictionary(pa.int32(), pa.string()),
+        "primaryTitle": pa.string(),
+        "originalTitle": pa.string(),
+        "isAdult": pa.int8(),
+        "startYear": pa.int16(),
+        "endYear": pa.int16(),
+        "runtimeMinutes": pa.int32(),
+        "genres": pa.dictionary(pa.int32(), pa.string()),
+    },
+    "imdb_title_ratings": {
+        "tconst": pa.string(),
+        "averageRating": pa.float32(),
+        "numVotes": pa.int32(),
+    },
+    "imdb_name_basics": {
+        "nconst": pa.string(),
+        "primaryName": pa.string(),
+        "birthYear": pa.int16(),
+        "deathYear": pa.int16(),
+        "primaryProfession": pa.dictionary(pa.int32(), pa.string()),
+        "knownForTitles": pa.string(),
+    },
+    "imdb_title_principals": {
+        "tconst": pa.string(),
+        "ordering": pa.int16(),
+        "nconst": pa.string(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+        "job": pa.dictionary(pa.int32(), pa.string()),
+        "characters": pa.string(),
+    },
+}
+
+
+def imdb_source_path(name: str) -> str:
+    """
+    :param name: dataset name, key of imdb_schemas
+    :return: path of the original tsv file
+    """
+    return f"{data_path}{name}.tsv"
+
+
+def imdb_cache_path(name: str) -> str:
+    """
+    Path of the parquet cache of a dataset, keyed on the size and modification time of its source
+    :param name: dataset name, key of imdb_schemas
+    :return: said path
+    """
+    source_stat = os.stat(imdb_source_path(name))
+    return f"{cache_path}{name}-{source_stat.st_size}-{source_stat.st_mtime_ns}.parquet"
+
+
+def build_imdb_cache(name: str, chunksize=1000000) -> str:
+    """
+    Convert an IMDb tsv file into a typed and compressed parquet file, chunk by chunk.
+    Previous caches of the same dataset are removed.
+    :param name: dataset name, key of imdb_schemas
+    :param chunksize: number of rows parsed at once
+    :return: path of the cache
+    """
+    columns = imdb_schemas[name]
+    schema = pa.schema([(col, pa_type.value_type if pa.types.is_dictionary(pa_type) else pa_type)
+                        for col, pa_type in columns.items()])
+    path = imdb_cache_path(name)
+    os.makedirs(cache_path, exist_ok=True)
+
+    chunks = pd.read_csv(imdb_source_path(name), sep='\t', na_values='\\N', keep_default_na=False,
+                         quoting=csv.QUOTE_NONE, dtype=str, usecols=list(columns), chunksize=chunksize)
+    with pq.ParquetWriter(path + ".tmp", schema, compression='zstd') as writer:
+        for chunk in chunks:
+            for col, pa_type in columns.items():
+                if pa.types.is_integer(pa_type) or pa.types.is_floating(pa_type):
+                    # Some rows are malformed, anything that does not parse is a NaN
+                    values = pd.to_numeric(chunk[col], errors='coerce')
+                    if pa.types.is_integer(pa_type):
+                        # as are numbers that do not fit the column type, e.g. an isAdult of 1981
+                        limits = np.iinfo(pa_type.to_pandas_dtype())
+                        values = values.where((values >= limits.min) & (values <= limits.max) & (values % 1 == 0))
+                    chunk[col] = values
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(path + ".tmp", path)
+
+    for file_name in os.listdir(cache_path):
+        if file_name.startswith(name + "-") and cache_path + file_name != path:
+            os.remove(cache_path + file_name)
+
+    print(f"Cached {name} into {path}")
+    return path
+
+
+def load_imdb(name: str, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """
+    Load an IMDb dataset from its parquet cache, building it first if missing or outdated.
+    Only the selected columns and the rows satisfying the filters are read from disk.
+    :param name: dataset name, key of imdb_schemas
+    :param columns: columns to load, all of them if None
+    :param filters: pyarrow predicates, e.g. [('titleType', '==', 'movie')]
+                    or [('category', 'in', {'actor', 'actress'})]
+    :return: said dataframe
+    """
+    path = imdb_cache_path(name)
+    if not os.path.isfile(path):
+        build_imdb_cache(name)
+
+    categorical = [col for col, pa_type in imdb_schemas[name].items() if pa.types.is_dictionary(pa_type)]
+    table = pq.read_table(path, columns=columns, filters=filters, read_dictionary=categorical)
+    return table.to_pandas(types_mapper={pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(),
+                                         pa.int32(): pd.Int32Dtype()}.get)
+
+
+def load_imdb_movies(columns: list = None) -> pd.DataFrame:
+    """
+    :param columns: columns to load, all of them if None
+    :return: IMDb titles that are movies
+    """
+    return load_imdb("imdb_title_basics", columns=columns, filters=[('titleType', '==', 'movie')])
+
+
+def load_imdb_actors_principals(columns: list = None) -> pd.DataFrame:
+    """
+    :param columns: columns to load, all of them if None
+    :return: IMDb casting data restricted to actors and actresses
+    """
+    return load_imdb("imdb_title_principals", columns=columns,
+                     filters=[('category', 'in', {'actor', 'actress'})])
@@ -2,3 +2,9 @@ from base_imports import *
 from metadata_analysis import *
 from actors_analysis import *
 from plots_analysis import *
+from imdb_loading import *
+from resampling import *
+from figure_export import *
+from pipeline import *
+from title_matching import *
+from graph_analysis import *
@@ -1,15 +1,20 @@
-from base_imports import *
+from __future__ import annotations
+
+from base_imports import chain, hashlib, json, math, np, pd, plt, px, sns, sparse, stats, weakref, Figure, smf
+# pat is looked up by patsy when evaluating the formulas of linear_reg
+from base_imports import pat  # noqa: F401
+from figure_export import export_figures
 
 
 def extract_release_year(df):
     """
-    Extracts the release year from the release date as a new column
+    Extracts the release year from the release date as a new column, movies without release date are dropped
     :param df: the dataframe
     :return: The extended dataframe
     """
-    df['Movie release year'] = df['Movie release date'].astype(str).str[:4]
-    df = df[df["Movie release year"].str.contains("nan") == False].copy()
-    df['Movie release year'] = df['Movie release year'].apply(lambda x: int(x))
+    years = pd.to_numeric(df['Movie release date'].astype(str).str[:4], errors='coerce')
+    df = df[years.notna()].copy()
+    df['Movie release year'] = years[years.notna()].astype(np.int64)
     return df
 
 
@@ -83,6 +88,100 @@ def separate_ids_from_list_data(list_paired_string: str) -> (list, list):
     return [p[0] for p in tupled_pairs], [p[1] for p in tupled_pairs]
 
 
+def parse_freebase_pairs(paired_string: str) -> dict:
+    """
+    Parse a "{"FreebaseID1": "some string 1", ...}" string with a JSON decoder,
+    falling back on separate_ids_from_list_data for malformed strings
+    :param paired_string: input list of pairs as string
+    :return: dict mapping Freebase IDs to values
+    """
+    try:
+        pairs = json.loads(paired_string)
+        if isinstance(pairs, dict):
+            return pairs
+    except ValueError:
+        pass
+    ids, values = separate_ids_from_list_data(paired_string)
+    return {freebase_id: value for freebase_id, value in zip(ids, values) if freebase_id is not None}
+
+
+class FreebasePairs:
+    """
+    Ragged storage of a column of {Freebase ID: value} pairs: the pairs of the i-th row are
+    (ids[id_codes[k]], values[value_codes[k]]) for offsets[i] <= k < offsets[i + 1].
+    Missing values, such as JSON nulls, have code -1.
+    """
+
+    def __init__(self, offsets: np.ndarray, id_codes: np.ndarray, value_codes: np.ndarray, ids: pd.Index,
+                 values: pd.Index, index: pd.Index):
+        self.offsets = offsets
+        self.id_codes = id_codes
+        self.value_codes = value_codes
+        self.ids = ids
+        self.values = values
+        self.index = index
+
+    @classmethod
+    def from_column(cls, column: pd.Series) -> "FreebasePairs":
+        """
+        Parse a whole column at once: rows are decoded as a single JSON array, row by row
+        parsing only happens if some row is malformed
+        :param column: column of "{"FreebaseID": "some string", ...}" strings
+        :return: said ragged pairs
+        """
+        texts = column.fillna("{}").astype(str).tolist()
+        try:
+            rows = json.loads("[" + ",".join(texts) + "]")
+            if len(rows) != len(texts) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError("Rows are not all JSON objects")
+        except ValueError:
+            rows = [parse_freebase_pairs(text) for text in texts]
+
+        lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        id_codes, ids = pd.factorize(np.fromiter(chain.from_iterable(rows), dtype=object, count=lengths.sum()))
+        value_codes, values = pd.factorize(np.fromiter(chain.from_iterable(row.values() for row in rows),
+                                                       dtype=object, count=lengths.sum()))
+        return cls(np.concatenate([[0], np.cumsum(lengths)]), id_codes.astype(np.int32),
+                   value_codes.astype(np.int32), pd.Index(ids), pd.Index(values), column.index)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> np.ndarray:
+        """
+        :return: number of pairs of each row
+        """
+        return np.diff(self.offsets)
+
+    def rows(self) -> np.ndarray:
+        """
+        :return: row position of each pair
+        """
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def to_lists(self, codes: np.ndarray, categories: pd.Index) -> list[list[str]]:
+        """
+        :param codes: id_codes or value_codes
+        :param categories: ids or values
+        :return: list of the decoded codes of each row
+        """
+        # Missing values (e.g. JSON null) have code -1 and are decoded as None
+        decoded = np.append(categories.to_numpy(dtype=object), None)[codes]
+        return [decoded[self.offsets[i]:self.offsets[i + 1]].tolist() for i in range(len(self))]
+
+    def id_lists(self) -> list[list[str]]:
+        """
+        :return: list of Freebase IDs of each row
+        """
+        return self.to_lists(self.id_codes, self.ids)
+
+    def value_lists(self) -> list[list[str]]:
+        """
+        :return: list of values of each row
+        """
+        return self.to_lists(self.value_codes, self.values)
+
+
 def col_to_col_values(column_name: str) -> str:
     """
     String formatting for value column names
@@ -92,15 +191,19 @@ def col_to_col_values(column_name: str) -> str:
     return f"{column_name}: values"
 
 
-def append_processed_columns(df: pd.DataFrame, column_name: str):
+def append_processed_columns(df: pd.DataFrame, column_name: str, as_lists=True) -> FreebasePairs:
     """
     Separate Freebase IDs from values
     :param df: data, modified in place
     :param column_name: name of column where to separate {Freebase ID: value} pairs
+    :param as_lists: if True, append the IDs and values as columns of lists
+    :return: the pairs, as ragged arrays of codes
     """
-    vals = df[column_name].apply(separate_ids_from_list_data).values.copy()
-    df[f"{column_name}: Freebase IDs"] = [vals[i][0] for i in range(len(vals))]
-    df[col_to_col_values(column_name)] = [vals[i][1] for i in range(len(vals))]
+    pairs = FreebasePairs.from_column(df[column_name])
+    if as_lists:
+        df[f"{column_name}: Freebase IDs"] = pairs.id_lists()
+        df[col_to_col_values(column_name)] = pairs.value_lists()
+    return pairs
 
 
 def distinct_values(df: pd.DataFrame, column_name: str, raw_name: bool = False) -> set:
@@ -123,6 +226,154 @@ def name_appended_column(prefix: str, val: str) -> str:
     return f"{prefix}: {val}"
 
 
+class IndicatorMatrix:
+    """
+    Sparse multi-hot encoding of a column listing values of the same family (genres, countries, languages):
+    entry (i, j) is 1 iff the i-th movie lists the j-th value. Rows follow the rows of the encoded dataframe.
+    """
+
+    def __init__(self, matrix: sparse.csr_matrix, values, prefix: str, index: pd.Index):
+        self.matrix = matrix
+        self.values = pd.Index(values)
+        self.prefix = prefix
+        self.index = index
+        self._csc = None
+
+    @classmethod
+    def from_columns(cls, df: pd.DataFrame, all_vals: list, prefix: str) -> "IndicatorMatrix":
+        """
+        Encode the legacy dense indicator columns of a dataframe
+        :param df: data with 'prefix: value' columns
+        :param all_vals: values
+        :param prefix: str
+        :return: said indicator matrix
+        """
+        block = df[map_to_col_names(all_vals, prefix)].to_numpy() == 1
+        return cls(sparse.csr_matrix(block.astype(np.uint8)), all_vals, prefix, df.index)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def __contains__(self, val) -> bool:
+        return val in self.values
+
+    def positions(self, vals) -> np.ndarray:
+        """
+        :param vals: values
+        :return: column positions of the values, KeyError if any is unknown
+        """
+        positions = self.values.get_indexer(list(vals))
+        if (positions < 0).any():
+            raise KeyError(f"Unknown values: {[v for v, p in zip(vals, positions) if p < 0]}")
+        return positions
+
+    def csc(self) -> sparse.csc_matrix:
+        """
+        :return: column-compressed copy of the matrix, cached
+        """
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._csc
+
+    def column(self, val) -> np.ndarray:
+        """
+        :param val: value
+        :return: dense 0/1 indicator of the value
+        """
+        return self.csc()[:, self.positions([val])[0]].toarray().ravel()
+
+    def select(self, vals) -> "IndicatorMatrix":
+        """
+        :param vals: values
+        :return: indicator matrix restricted to these values, in that order
+        """
+        return IndicatorMatrix(self.csc()[:, self.positions(vals)].tocsr(), vals, self.prefix, self.index)
+
+    def nonzero(self, vals=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param vals: values, all of them if None
+        :return: (value codes, rows) of all ones, sorted by value code in the order of vals then by row
+        """
+        csc = self.csc() if vals is None else self.csc()[:, self.positions(vals)]
+        csc.sort_indices()
+        codes = np.repeat(np.arange(csc.shape[1]), np.diff(csc.indptr))
+        return codes, csc.indices.astype(np.int64)
+
+    def counts(self) -> np.ndarray:
+        """
+        :return: number of movies listing each value
+        """
+        return np.diff(self.csc().indptr)
+
+    def frequencies(self) -> pd.Series:
+        """
+        :return: share of movies listing each value, indexed by value
+        """
+        return pd.Series(self.counts() / len(self), index=self.values)
+
+    def to_dataframe(self, vals=None, dtype=np.uint8) -> pd.DataFrame:
+        """
+        Compatibility view: the legacy dense 'prefix: value' indicator columns
+        :param vals: values, all of them if None
+        :param dtype: dtype of the columns
+        :return: said dataframe, indexed as the encoded dataframe
+        """
+        selected = self if vals is None else self.select(vals)
+        return pd.DataFrame(selected.matrix.toarray().astype(dtype), index=self.index,
+                            columns=map_to_col_names(selected.values, self.prefix))
+
+
+def stack_indicator_matrices(indicator_matrices: list) -> IndicatorMatrix:
+    """
+    Concatenate indicator matrices of different families (e.g. genres, countries and languages) of the same rows.
+    Values of the result are the 'prefix: value' column names.
+    :param indicator_matrices: list of IndicatorMatrix
+    :return: said indicator matrix, with an empty prefix
+    """
+    values = list(chain.from_iterable(map_to_col_names(indicators.values, indicators.prefix)
+                                      for indicators in indicator_matrices))
+    matrix = sparse.hstack([indicators.matrix for indicators in indicator_matrices], format='csr')
+    return IndicatorMatrix(matrix, values, "", indicator_matrices[0].index)
+
+
+def build_indicator_matrix(df: pd.DataFrame, column_name: str, prefix: str, all_values=None,
+                           pairs: FreebasePairs = None) -> IndicatorMatrix:
+    """
+    Encode a column of value lists into a sparse indicator matrix, in one vectorized pass
+    :param df: data (not modified)
+    :param column_name: column to inspect
+    :param prefix: str
+    :param all_values: all possible values, defaults to the values found in the column
+    :param pairs: parsed pairs of column_name, as returned by append_processed_columns,
+                  to encode instead of the column of value lists
+    :return: said indicator matrix
+    """
+    if pairs is not None:
+        rows = pairs.rows()
+        codes, found_values = pairs.value_codes, pairs.values
+    else:
+        lists = df[col_to_col_values(column_name)].to_numpy()
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        rows = np.repeat(np.arange(len(lists)), lengths)
+        codes, found_values = pd.factorize(np.fromiter(chain.from_iterable(lists), dtype=object,
+                                                       count=lengths.sum()))
+
+    if all_values is None:
+        all_values = found_values
+    else:
+        all_values = list(all_values)
+        # Missing values keep the code -1 of factorize, as do values not in all_values
+        codes = np.append(pd.Index(all_values).get_indexer(found_values), -1)[codes]
+    known = codes >= 0
+
+    matrix = sparse.csr_matrix((np.ones(known.sum(), dtype=np.uint8), (rows[known], codes[known])),
+                               shape=(len(df), len(all_values)))
+    # A value listed twice for a same movie is indicated once
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return IndicatorMatrix(matrix, all_values, prefix, df.index)
+
+
 def append_indicator_columns(df: pd.DataFrame, all_values: set, column_name: str, prefix: str) -> pd.DataFrame:
     """
     Add columns to the right of a dataframe indicating whether a particular value is present or not
@@ -133,15 +384,65 @@ def append_indicator_columns(df: pd.DataFrame, all_values: set, column_name: str
     :param prefix: str
     :return: Dataframe with added columns
     """
-    cols = [df[col_to_col_values(column_name)]
-            .apply(lambda x: 1 if val in x else 0)
-            .rename(name_appended_column(prefix, val))
-            for val in all_values]
-    cols.insert(0, df)
-    return pd.concat(cols, axis=1)
+    indicators = build_indicator_matrix(df, column_name, prefix, all_values)
+    return pd.concat([df, indicators.to_dataframe(dtype=np.int64)], axis=1)
+
+
+# Cached frequency tables, keyed by id of the indicator matrix they were computed from
+frequency_tables = {}
+
+
+def frequency_table(df: pd.DataFrame, all_vals: list, prefix: str, metrics: list = (),
+                    indicators: IndicatorMatrix = None, refresh=False) -> pd.DataFrame:
+    """
+    Statistics of genres, languages or countries computed with a single sum over the indicator block:
+    number and share of movies listing each value and, for each success metric, mean and median
+    of the metric among these movies.
+    Tables computed from an indicator matrix, which is never modified in place, are cached until the content
+    of the metric columns changes. Tables computed from the indicator columns of df are not cached.
+    :param df: data
+    :param all_vals: all possible values
+    :param prefix: str
+    :param metrics: success metrics, columns of df
+    :param indicators: indicator matrix of the rows of df, to read the values from instead of the columns of df
+    :param refresh: recompute the table even if cached
+    :return: dataframe indexed by value with 'count', 'share', 'mean <metric>' and 'median <metric>' columns
+    """
+    all_vals, metrics = list(all_vals), list(metrics)
+    if indicators is not None:
+        key = (id(indicators), prefix, tuple(metrics))
+        metric_hashes = pd.util.hash_pandas_object(df[metrics], index=False).to_numpy() if metrics else None
+        fingerprint = (tuple(all_vals), None if metric_hashes is None else
+                       hashlib.sha256(metric_hashes.tobytes()).hexdigest())
+        cached = frequency_tables.get(key)
+        if not refresh and cached is not None and cached[0]() is indicators and cached[1] == fingerprint:
+            return cached[2]
+
+    if indicators is not None:
+        codes, rows = indicators.nonzero(all_vals)
+        nb_rows = len(indicators)
+    else:
+        codes, rows = np.nonzero(df[map_to_col_names(all_vals, prefix)].to_numpy().T == 1)
+        nb_rows = len(df)
 
+    counts = np.bincount(codes, minlength=len(all_vals))
+    table = pd.DataFrame({"count": counts, "share": counts / nb_rows}, index=pd.Index(all_vals, name=prefix))
+    for metric in metrics:
+        metric_values = df[metric].to_numpy(dtype=np.float64)[rows]
+        not_nan = ~np.isnan(metric_values)
+        sums = np.bincount(codes[not_nan], weights=metric_values[not_nan], minlength=len(all_vals))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table[f"mean {metric}"] = sums / np.bincount(codes[not_nan], minlength=len(all_vals))
+        table[f"median {metric}"] = grouped_quantiles(codes, metric_values, len(all_vals), 0.5)
 
-def retrieve_n_most_frequent(df: pd.DataFrame, n: int, all_vals: list[str], prefix: str) -> list:
+    if indicators is not None:
+        frequency_tables[key] = (weakref.ref(indicators, lambda _: frequency_tables.pop(key, None)), fingerprint,
+                                 table)
+    return table
+
+
+def retrieve_n_most_frequent(df: pd.DataFrame, n: int, all_vals: list[str], prefix: str,
+                             indicators: IndicatorMatrix = None) -> list:
     """
     Retrieve the n most frequent genres, languages or countries, sorted in descending order
     of frequency
@@ -149,32 +450,44 @@ def retrieve_n_most_frequent(df: pd.DataFrame, n: int, all_vals: list[str], pref
     :param n: integer, max number of values to retrieve
     :param all_vals: all possible values
     :param prefix: str
+    :param indicators: indicator matrix to read the values from instead of the columns of df
     :return: said list
     """
-
-    def comparator(val1, val2):
-        mean_val1 = df[name_appended_column(prefix, val1)].mean()
-        mean_val2 = df[name_appended_column(prefix, val2)].mean()
-        return mean_val1 - mean_val2
-
-    return sorted(all_vals, key=cmp_to_key(comparator), reverse=True)[:n]
+    table = frequency_table(df, all_vals, prefix, indicators=indicators)
+    return table["share"].sort_values(ascending=False, kind='stable').index[:n].tolist()
 
 
-def retrieve_frequent(df: pd.DataFrame, all_vals: list, prefix: str, freq_threshold=0.05) -> list:
+def retrieve_frequent(df: pd.DataFrame, all_vals: list, prefix: str, freq_threshold=0.05,
+                      indicators: IndicatorMatrix = None) -> list:
     """
     Filter the values with a sufficiently high frequency
     :param df: data
     :param all_vals: all possible values
     :param prefix: str
     :param freq_threshold: float
+    :param indicators: indicator matrix to read the values from instead of the columns of df
     :return: list of sufficiently frequent values
     """
-    return list(
-        filter(
-            lambda val: df[name_appended_column(prefix, val)].mean() > freq_threshold,
-            all_vals
-        )
-    )
+    table = frequency_table(df, all_vals, prefix, indicators=indicators)
+    return table.index[table["share"] > freq_threshold].tolist()
+
+
+def rank_values(df: pd.DataFrame, all_vals: list, prefix: str, by: str, ascending=False, min_share=0.,
+                metrics: list = (), indicators: IndicatorMatrix = None) -> pd.DataFrame:
+    """
+    Rank genres, languages or countries by a column of their frequency table
+    :param df: data
+    :param all_vals: all possible values
+    :param prefix: str
+    :param by: column of the frequency table, e.g. 'share' or 'median averageRating'
+    :param ascending: bool
+    :param min_share: only rank values listed by more than this share of movies
+    :param metrics: success metrics, columns of df
+    :param indicators: indicator matrix to read the values from instead of the columns of df
+    :return: frequency table of the ranked values
+    """
+    table = frequency_table(df, all_vals, prefix, metrics, indicators)
+    return table[table["share"] > min_share].sort_values(by, ascending=ascending, kind='stable')
 
 
 def map_to_col_names(data_names: list, prefix: str) -> list:
@@ -188,8 +501,109 @@ def map_to_col_names(data_names: list, prefix: str) -> list:
     return list(map(f, data_names))
 
 
-def find_correlated_metadata(df: pd.DataFrame, freq_data: list, success_metric: str, prefix: str, sig_level=0.05) \
-        -> list:
+def adjust_pvalues(pvalues: np.ndarray, correction: str = None) -> np.ndarray:
+    """
+    Correct p-values for multiple testing, NaNs are left out
+    :param pvalues: array of p-values
+    :param correction: None, 'bonferroni' or 'fdr_bh' (Benjamini-Hochberg)
+    :return: corrected p-values
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    if correction is None:
+        return pvalues
+    adjusted = np.full(len(pvalues), np.nan)
+    tested = ~np.isnan(pvalues)
+    nb_tests = tested.sum()
+    if correction == 'bonferroni':
+        adjusted[tested] = np.minimum(pvalues[tested] * nb_tests, 1.)
+    elif correction == 'fdr_bh':
+        order = np.argsort(pvalues[tested])
+        scaled = pvalues[tested][order] * nb_tests / np.arange(1, nb_tests + 1)
+        corrected = np.empty(nb_tests)
+        corrected[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.)
+        adjusted[tested] = corrected
+    else:
+        raise ValueError(f"Unknown correction {correction}")
+    return adjusted
+
+
+def indicator_rank_correlation(rank_sums, support, rank_total, rank_std, nb_movies):
+    """
+    Spearman correlation between a metric and binary indicators, from the ranks of the metric:
+    the point-biserial correlation of the ranks.
+    :param rank_sums: sum of the ranks of the movies listing each value
+    :param support: number of movies listing each value
+    :param rank_total: sum of all ranks
+    :param rank_std: (population) standard deviation of the ranks
+    :param nb_movies: number of movies
+    :return: correlations, NaN for values listed by no movie or by all of them
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_difference = rank_sums / support - (rank_total - rank_sums) / (nb_movies - support)
+        rho = mean_difference * np.sqrt(support * (nb_movies - support)) / (nb_movies * rank_std)
+    return np.clip(rho, -1., 1.)
+
+
+def spearman_correlations(df: pd.DataFrame, success_metrics: list, indicators: IndicatorMatrix, pairwise=False,
+                          correction: str = None, nan_policy='omit') -> pd.DataFrame:
+    """
+    Spearman correlations between success metrics and all columns of an indicator matrix at once.
+    The metric is ranked once: the ranks of a binary indicator only take two values, so its rank
+    correlation is the point-biserial correlation of the metric ranks, obtained from the sum of
+    the ranks of the movies listing the value. P-values use the same t-test as scipy.stats.spearmanr.
+    :param df: data, with the success metrics as columns
+    :param success_metrics: list of column names
+    :param indicators: indicator matrix of the rows of df, possibly stacked from several families
+    :param pairwise: test the combinations of two values (movies listing both) instead of single values,
+                     pairs that no movie lists together are left out
+    :param correction: multiple testing correction over the whole table, None, 'bonferroni' or 'fdr_bh'
+    :param nan_policy: 'omit' to drop movies without metric, 'propagate' to return NaNs as spearmanr does
+    :return: dataframe with 'metric', 'value', 'other value' (for pairs), 'rho', 'pvalue' and 'support' columns
+    """
+    tables = []
+    matrix = indicators.matrix.astype(np.float64)
+    for metric in success_metrics:
+        metric_values = df[metric].to_numpy(dtype=np.float64)
+        has_metric = ~np.isnan(metric_values)
+        if nan_policy == 'omit':
+            metric_matrix, metric_values = matrix[has_metric], metric_values[has_metric]
+        else:
+            metric_matrix = matrix
+        nb_movies = len(metric_values)
+        ranks = stats.rankdata(metric_values)
+
+        if pairwise:
+            # Counts and rank sums of the movies listing both values, upper triangle only
+            support = sparse.triu(metric_matrix.T @ metric_matrix, k=1).tocoo()
+            rank_sums = sparse.triu(metric_matrix.T @ sparse.diags(ranks) @ metric_matrix, k=1).tocsr()
+            first, second = support.row, support.col
+            support, rank_sums = support.data, np.asarray(rank_sums[first, second]).ravel()
+            table = pd.DataFrame({"value": indicators.values[first], "other value": indicators.values[second]})
+        else:
+            support = np.asarray(metric_matrix.sum(axis=0)).ravel()
+            rank_sums = metric_matrix.T @ ranks
+            table = pd.DataFrame({"value": indicators.values, "other value": None})
+
+        rho = indicator_rank_correlation(rank_sums, support, ranks.sum(), ranks.std(), nb_movies)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dof = nb_movies - 2
+            t = rho * np.sqrt((dof / ((rho + 1.0) * (1.0 - rho))).clip(0))
+        pvalue = stats.t.sf(np.abs(t), dof) * 2
+        if nan_policy == 'propagate' and not has_metric.all():
+            rho, pvalue = np.full(len(table), np.nan), np.full(len(table), np.nan)
+
+        table.insert(0, "metric", metric)
+        table["rho"], table["pvalue"], table["support"] = rho, pvalue, support.astype(np.int64)
+        tables.append(table)
+
+    table = pd.concat(tables, ignore_index=True)
+    if correction is not None:
+        table["corrected pvalue"] = adjust_pvalues(table["pvalue"], correction)
+    return table
+
+
+def find_correlated_metadata(df: pd.DataFrame, freq_data: list, success_metric: str, prefix: str, sig_level=0.05,
+                             indicators: IndicatorMatrix = None) -> list:
     """
     Among a list of sufficiently frequent data taken from the metadata dataframe,
     find the values such that they are correlated to a movie's success metric with
@@ -199,27 +613,110 @@ def find_correlated_metadata(df: pd.DataFrame, freq_data: list, success_metric:
     :param success_metric: str, name of column in df
     :param prefix: str
     :param sig_level: significance level, defaults to 5%
+    :param indicators: indicator matrix of the rows of df, to read the values from instead of the columns of df
     :return: described list
     """
-    correlated_data = []
+    if indicators is not None:
+        indicators = indicators.select(freq_data)
+    else:
+        indicators = IndicatorMatrix.from_columns(df, freq_data, prefix)
+
+    correlations = spearman_correlations(df, [success_metric], indicators, nan_policy='propagate')
+    return correlations.loc[correlations["pvalue"] < sig_level, "value"].tolist()
+
+
+def grouped_quantiles(group_codes: np.ndarray, values: np.ndarray, nb_groups: int, q: float) -> np.ndarray:
+    """
+    Quantiles of many groups of values at once, with linear interpolation as in pd.Series.quantile
+    :param group_codes: integer group of each value
+    :param values: values, NaNs are ignored
+    :param nb_groups: number of groups
+    :param q: quantile
+    :return: array of the quantile of each group, NaN for empty groups
+    """
+    not_nan = ~np.isnan(values)
+    group_codes, values = group_codes[not_nan], values[not_nan]
+    order = np.lexsort((values, group_codes))
+    sorted_values = values[order]
+
+    sizes = np.bincount(group_codes, minlength=nb_groups)
+    starts = np.cumsum(sizes) - sizes
+    non_empty = sizes > 0
+
+    # Same interpolation between the two closest ranks as numpy's linear method
+    positions = (sizes[non_empty] - 1) * q
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, sizes[non_empty] - 1)
+    t = positions - below
+    a = sorted_values[starts[non_empty] + below]
+    b = sorted_values[starts[non_empty] + above]
+    diff_b_a = b - a
+    interpolated = np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+
+    quantiles = np.full(nb_groups, np.nan)
+    quantiles[non_empty] = interpolated
+    return quantiles
+
+
+def metadata_histograms(df: pd.DataFrame, prefix: str, titled_data: list, success_metric: str, bins=30,
+                        log_scale=True, indicators: IndicatorMatrix = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Histograms of a success metric among the movies listing each value, all sharing the same bin edges.
+    Movies are binned once, then counted per value with a single bincount.
+    :param df: data
+    :param prefix: str
+    :param titled_data: titles of data, to be converted to column names
+    :param success_metric: measured column name
+    :param bins: number of bins
+    :param log_scale: logarithmically spaced bins if True (non-positive values are left out), linear otherwise
+    :param indicators: indicator matrix of the rows of df, to read the values from instead of the columns of df
+    :return: tuple containing the bin edges and the values x bins array of counts, all zero when no movie
+             of the values has a usable metric
+    """
+    titled_data = list(titled_data)
+    if indicators is not None:
+        codes, rows = indicators.nonzero(titled_data)
+    else:
+        codes, rows = np.nonzero(df[map_to_col_names(titled_data, prefix)].to_numpy().T == 1)
+    metric_values = df[success_metric].to_numpy(dtype=np.float64)
+    binned = ~np.isnan(metric_values) & ((metric_values > 0) if log_scale else True)
+
+    selected = np.zeros(len(metric_values), dtype=bool)
+    selected[rows] = True
+    if (selected & binned).any():
+        low, high = metric_values[selected & binned].min(), metric_values[selected & binned].max()
+    else:
+        # No usable metric: default edges, as np.histogram, and zero counts
+        low, high = (1., 10.) if log_scale else (0., 1.)
+    if low == high:
+        # Single value: padded range, as in np.histogram (by half a decade on a log scale)
+        low, high = (low / 10 ** 0.5, high * 10 ** 0.5) if log_scale else (low - 0.5, high + 0.5)
+    if log_scale:
+        edges = np.logspace(np.log10(low), np.log10(high), bins + 1)
+    else:
+        edges = np.linspace(low, high, bins + 1)
 
-    for value in freq_data:
-        res = stats.spearmanr(df[success_metric], df[name_appended_column(prefix, value)])
-        if res.pvalue < sig_level:
-            correlated_data.append(value)
-    return correlated_data
+    # The last bin is closed, as in np.histogram
+    movie_bins = np.clip(np.searchsorted(edges, metric_values, side='right') - 1, 0, bins - 1)
+    counted = binned[rows]
+    counts = np.bincount(codes[counted] * bins + movie_bins[rows[counted]], minlength=len(titled_data) * bins)
+    return edges, counts.reshape(len(titled_data), bins)
 
 
 def plot_metadata_frequency_against_metric(df: pd.DataFrame, prefix: str, titled_data: list, success_metric: str,
-                                           title: str, log_scale=True):
+                                           title: str, log_scale=True, bins=30, indicators: IndicatorMatrix = None,
+                                           path: str = None):
     """
-    Generating a grid of histograms
+    Generating a grid of histograms, rendered from precomputed metadata_histograms
     :param df: data
     :param prefix: str
     :param titled_data: titles of data, to be converted to column names
     :param success_metric: measured column name
     :param title: str, figure title
     :param log_scale: determines the scale of the axes
+    :param bins: number of bins shared by all histograms
+    :param indicators: indicator matrix of the rows of df, to read the values from instead of the columns of df
+    :param path: if given, save the figure there (png, svg, ...) and close it instead of leaving it displayed
     """
 
     # Making the data fit into a square grid...
@@ -227,17 +724,230 @@ def plot_metadata_frequency_against_metric(df: pd.DataFrame, prefix: str, titled
     shifted_squares = squares - len(titled_data)
     smallest_big_enough_square = squares[np.argmax(shifted_squares > 0) - 1]
 
-    tested_data = map_to_col_names(titled_data, prefix)[:smallest_big_enough_square]
+    tested_data = list(titled_data)[:smallest_big_enough_square]
     size = int(np.sqrt(smallest_big_enough_square))
+    edges, counts = metadata_histograms(df, prefix, tested_data, success_metric, bins, log_scale, indicators)
 
     fig, ax = plt.subplots(size, size, figsize=(11, 11), sharex=True)
     for i in range(smallest_big_enough_square):
         sbplt = ax[i % size, math.floor(i / size)]
-        sns.histplot(ax=sbplt, data=df[df[tested_data[i]] == 1][success_metric], log_scale=log_scale)
+        sbplt.stairs(counts[i], edges, fill=True, alpha=0.75)
+        if log_scale:
+            sbplt.set_xscale("log")
+        sbplt.set_xlabel(success_metric)
+        sbplt.set_ylabel("Count")
         sbplt.set_title(titled_data[i])
 
     fig.suptitle(title, fontsize=18)
     fig.tight_layout()
+    if path is not None:
+        fig.savefig(path)
+        plt.close(fig)
+
+
+def save_metadata_frequency_grids(df: pd.DataFrame, grids: dict, log_scale=True, bins=30) -> None:
+    """
+    Headless batch rendering of many grids of histograms, e.g. for every family of values and success metric
+    :param df: data
+    :param grids: dict of format path: (prefix, titled_data, success_metric, title, indicators or None)
+    :param log_scale: determines the scale of the axes
+    :param bins: number of bins shared by all histograms of a grid
+    """
+    for path, (prefix, titled_data, success_metric, title, indicators) in grids.items():
+        plot_metadata_frequency_against_metric(df, prefix, titled_data, success_metric, title, log_scale, bins,
+                                               indicators, path)
+    print(f"Saved {len(grids)} grids of histograms")
+
+
+class YearValueCube:
+    """
+    Aggregates of success metrics by (release year, value, metric): number of movies, sum and sum of squares
+    of the metric, and a histogram sketch over shared bins to approximate quantiles. The last value column
+    aggregates all movies. Aggregates are additive, so year ranges and rolling windows are sums over years.
+    """
+
+    def __init__(self, df: pd.DataFrame, indicators: IndicatorMatrix, metrics: list, year_col='Movie release year',
+                 nb_bins=32, all_label="All"):
+        """
+        Build the cube in one vectorized pass over the indicator matrix
+        :param df: data, with year_col and the metrics as columns
+        :param indicators: indicator matrix of the rows of df
+        :param metrics: success metrics
+        :param year_col: column of release years, e.g. from extract_release_year
+        :param nb_bins: number of bins of the quantile sketches, bin edges are quantiles of each metric
+        :param all_label: name of the value aggregating all movies
+        """
+        year_values = pd.to_numeric(df[year_col], errors='coerce').to_numpy(dtype=np.float64)
+        has_year = ~np.isnan(year_values)
+        self.years = np.unique(year_values[has_year]).astype(np.int64)
+        self.values = pd.Index(list(indicators.values) + [all_label])
+        self.metrics = list(metrics)
+
+        year_codes = np.searchsorted(self.years, year_values)
+        codes, rows = indicators.nonzero()
+        codes = np.concatenate([codes, np.full(len(df), len(indicators.values))])
+        rows = np.concatenate([rows, np.arange(len(df))])
+        codes, rows = codes[has_year[rows]], rows[has_year[rows]]
+        cells = year_codes[rows] * len(self.values) + codes
+        nb_cells = len(self.years) * len(self.values)
+        shape = (len(self.years), len(self.values))
+
+        self.movies = np.bincount(cells, minlength=nb_cells).reshape(shape)
+        self.count, self.sum, self.sum_sq, self.sketch, self.edges = {}, {}, {}, {}, {}
+        for metric in self.metrics:
+            metric_values = df[metric].to_numpy(dtype=np.float64)
+            has_metric = ~np.isnan(metric_values)
+            edges = np.unique(np.quantile(metric_values[has_metric], np.linspace(0, 1, nb_bins + 1))) \
+                if has_metric.any() else np.zeros(1)
+            if len(edges) < 2:
+                # Constant (or missing) metric: a single bin around the value, as np.histogram
+                edges = np.array([edges[0] - 0.5, edges[0] + 0.5])
+            bins = np.clip(np.searchsorted(edges, metric_values, side='right') - 1, 0, len(edges) - 2)
+
+            valid = has_metric[rows]
+            metric_cells, metric_rows = cells[valid], rows[valid]
+            self.count[metric] = np.bincount(metric_cells, minlength=nb_cells).reshape(shape)
+            self.sum[metric] = np.bincount(metric_cells, weights=metric_values[metric_rows],
+                                           minlength=nb_cells).reshape(shape)
+            self.sum_sq[metric] = np.bincount(metric_cells, weights=metric_values[metric_rows] ** 2,
+                                              minlength=nb_cells).reshape(shape)
+            self.sketch[metric] = np.bincount(metric_cells * (len(edges) - 1) + bins[metric_rows],
+                                              minlength=nb_cells * (len(edges) - 1)
+                                              ).reshape(shape + (len(edges) - 1,)).astype(np.int32)
+            self.edges[metric] = edges
+
+    def columns(self, vals: list = None):
+        """
+        :param vals: values, all of them if None
+        :return: column positions of the values, KeyError if any is unknown
+        """
+        if vals is None:
+            return slice(None)
+        positions = self.values.get_indexer(list(vals))
+        if (positions < 0).any():
+            raise KeyError(f"Unknown values: {[v for v, p in zip(vals, positions) if p < 0]}")
+        return positions
+
+    def year_mask(self, start: int = None, end: int = None) -> np.ndarray:
+        """
+        :param start: first year included, None for no bound
+        :param end: last year included, None for no bound
+        :return: boolean mask over the years of the cube
+        """
+        mask = np.ones(len(self.years), dtype=bool)
+        if start is not None:
+            mask &= self.years >= start
+        if end is not None:
+            mask &= self.years <= end
+        return mask
+
+    def statistic(self, metric: str, stat: str, count, total, total_sq, sketch) -> np.ndarray:
+        """
+        Statistic from (summed) aggregates, the last axis of sketch being the bins
+        :param metric: success metric
+        :param stat: 'count', 'sum', 'mean', 'std' or a quantile as a float between 0 and 1
+        :return: array of the statistic
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if stat == 'count':
+                return count
+            if stat == 'sum':
+                return total
+            mean = total / count
+            if stat == 'mean':
+                return mean
+            if stat == 'std':
+                # Sample standard deviation, as pd.Series.std
+                return np.sqrt(np.maximum(total_sq - count * mean ** 2, 0) / (count - 1))
+            return self.sketch_quantile(metric, sketch, float(stat))
+
+    def sketch_quantile(self, metric: str, sketch: np.ndarray, q: float) -> np.ndarray:
+        """
+        Approximate quantiles from histogram sketches, interpolating linearly within bins
+        :param metric: success metric
+        :param sketch: array of bin counts, the last axis being the bins
+        :param q: quantile
+        :return: array of quantiles, NaN where the sketch is empty
+        """
+        edges = self.edges[metric]
+        cumulative = np.cumsum(sketch, axis=-1)
+        target = q * cumulative[..., -1:]
+        bins = np.minimum((cumulative < target).sum(axis=-1), sketch.shape[-1] - 1)
+        below = np.take_along_axis(cumulative, bins[..., None], axis=-1)[..., 0] - \
+            np.take_along_axis(sketch, bins[..., None], axis=-1)[..., 0]
+        in_bin = np.take_along_axis(sketch, bins[..., None], axis=-1)[..., 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.clip((target[..., 0] - below) / in_bin, 0, 1)
+        quantiles = edges[bins] + fraction * (edges[bins + 1] - edges[bins])
+        return np.where(cumulative[..., -1] > 0, quantiles, np.nan)
+
+    def frame(self, metric: str, stat='mean', vals: list = None, start: int = None, end: int = None) -> pd.DataFrame:
+        """
+        Time series of a statistic, e.g. to be plotted with plot_by_year
+        :param metric: success metric
+        :param stat: 'count', 'sum', 'mean', 'std' or a quantile as a float between 0 and 1
+        :param vals: values, all of them if None
+        :param start: first year included
+        :param end: last year included
+        :return: dataframe indexed by year with one column per value
+        """
+        columns = self.columns(vals)
+        years = self.year_mask(start, end)
+        aggregates = [aggregate[metric][years][:, columns]
+                      for aggregate in [self.count, self.sum, self.sum_sq, self.sketch]]
+        values = self.statistic(metric, stat, *aggregates)
+        return pd.DataFrame(values, index=pd.Index(self.years[years], name="Movie release year"),
+                            columns=self.values[columns])
+
+    def rolling(self, metric: str, window: int, stat='mean', vals: list = None, start: int = None, end: int = None) \
+            -> pd.DataFrame:
+        """
+        Statistic over rolling windows of consecutive years (missing years count as empty)
+        :param metric: success metric
+        :param window: number of years of a window, ending at the year of the index, at least 1
+        :param stat: 'count', 'sum', 'mean', 'std' or a quantile as a float between 0 and 1
+        :param vals: values, all of them if None
+        :param start: first year included
+        :param end: last year included
+        :return: dataframe indexed by year with one column per value
+        """
+        if window < 1:
+            raise ValueError(f"Rolling windows span at least one year, got {window}")
+        columns = self.columns(vals)
+        all_years = np.arange(self.years[0], self.years[-1] + 1)
+        positions = self.years - self.years[0]
+
+        def windowed(aggregate):
+            dense = np.zeros((len(all_years),) + aggregate.shape[1:], dtype=np.float64)
+            dense[positions] = aggregate
+            cumulative = np.cumsum(dense, axis=0)
+            cumulative[window:] = cumulative[window:] - cumulative[:-window]
+            return cumulative
+
+        values = self.statistic(metric, stat, windowed(self.count[metric][:, columns]),
+                                windowed(self.sum[metric][:, columns]), windowed(self.sum_sq[metric][:, columns]),
+                                windowed(self.sketch[metric][:, columns]))
+        years = (all_years >= (start if start is not None else all_years[0])) & \
+                (all_years <= (end if end is not None else all_years[-1]))
+        return pd.DataFrame(values[years], index=pd.Index(all_years[years], name="Movie release year"),
+                            columns=self.values[columns])
+
+    def summary(self, metric: str, start: int = None, end: int = None, quantiles=(0.5,)) -> pd.DataFrame:
+        """
+        Statistics of every value over a range of years
+        :param metric: success metric
+        :param start: first year included
+        :param end: last year included
+        :param quantiles: approximate quantiles to compute
+        :return: dataframe indexed by value with 'movies', 'count', 'mean', 'std' and quantile columns
+        """
+        years = self.year_mask(start, end)
+        aggregates = (self.count[metric][years].sum(axis=0), self.sum[metric][years].sum(axis=0),
+                      self.sum_sq[metric][years].sum(axis=0), self.sketch[metric][years].sum(axis=0))
+        table = pd.DataFrame({"movies": self.movies[years].sum(axis=0)}, index=self.values)
+        for stat in ['count', 'mean', 'std'] + list(quantiles):
+            table[stat if isinstance(stat, str) else f"quantile {stat}"] = self.statistic(metric, stat, *aggregates)
+        return table
 
 
 def mapmaker(df: pd.DataFrame, target_col: str, title:str, color_continuous_scale="Greens", width=800, height=500) -> Figure:
@@ -264,31 +974,95 @@ def mapmaker(df: pd.DataFrame, target_col: str, title:str, color_continuous_scal
     return cntries_map
 
 
-def savemap(fig: Figure, path: str) -> None:
+def savemap(fig: Figure, path: str, shared_plotlyjs=False) -> None:
     """
     Save given map to memory
     :param fig: map as Figure plotly object
     :param path: str
+    :param shared_plotlyjs: if True, reference the plotly.js bundle shared by the directory instead of embedding it,
+                            and only rewrite the file if the map changed (see export_figures)
     """
+    if shared_plotlyjs:
+        export_figures({path: fig})
+        return
     with open(path, "w") as f:
         f.write(fig.to_html())
 
 
-def linear_reg(df, success_metric, prefix_var, list_vars):
+def linear_reg(df, success_metric, prefix_var, list_vars, indicators: IndicatorMatrix = None):
     """
     Perform linear regression over the given list of features and response variable.
     :param df: data
     :param success_metric: response variable
     :param prefix_var: str
     :param list_vars: str
+    :param indicators: indicator matrix of the rows of df, to read the features from instead of the columns of df
     :return:
     """
     def formula_rhs_string(prefix, list_all_vars):
         return " + ".join(list(map(lambda x: f'C(pat.Q("{name_appended_column(prefix, x)}"))', list_all_vars)))
 
+    if indicators is not None:
+        df = df[[success_metric]].join(indicators.to_dataframe(list_vars))
+
     return smf.ols(formula=success_metric + ' ~ ' + formula_rhs_string(prefix_var, list_vars), data=df).fit()
 
 
+def fast_linear_reg(df: pd.DataFrame, success_metrics: list, prefix_var: str, list_vars: list,
+                    indicators: IndicatorMatrix = None, intercept_name="Mean") -> dict:
+    """
+    Perform the linear regressions of several response variables over the same indicator features,
+    without building a formula. The design matrix is taken directly from the (sparse) indicator block,
+    its Gram matrix is inverted once per set of movies having all responses, as missing values
+    are dropped like in linear_reg.
+    :param df: data
+    :param success_metrics: list of response variables, e.g. rating, revenue and log revenue columns
+    :param prefix_var: str
+    :param list_vars: list of values whose indicators are the features
+    :param indicators: indicator matrix of the rows of df, to read the features from instead of the columns of df
+    :param intercept_name: label of the intercept, as expected by add_mean_to_series
+    :return: dict mapping each response variable to a dataframe indexed by intercept_name then values,
+             with 'coef', 'std err', 't' and 'pvalue' columns
+    """
+    if indicators is not None:
+        features = indicators.select(list_vars).matrix
+    else:
+        features = sparse.csr_matrix(df[map_to_col_names(list_vars, prefix_var)].to_numpy(dtype=np.float64))
+    design = sparse.hstack([np.ones((features.shape[0], 1)), features], format='csr', dtype=np.float64)
+    labels = np.array([intercept_name] + list(list_vars), dtype=object)
+
+    responses = df[list(success_metrics)].to_numpy(dtype=np.float64)
+    masks = {}
+    for i, metric in enumerate(success_metrics):
+        masks.setdefault(np.isnan(responses[:, i]).tobytes(), []).append(i)
+
+    results = {}
+    for mask_bytes, metric_indices in masks.items():
+        has_response = ~np.frombuffer(mask_bytes, dtype=bool)
+        movies_design = design[has_response]
+        ys = responses[has_response][:, metric_indices]
+
+        # Features without variation among these movies cannot be estimated
+        counts = np.asarray(movies_design.sum(axis=0)).ravel()
+        estimable = (counts > 0) & ((counts < movies_design.shape[0]) | (np.arange(len(counts)) == 0))
+        movies_design = movies_design[:, estimable]
+
+        gram = (movies_design.T @ movies_design).toarray()
+        gram_inverse = np.linalg.pinv(gram, hermitian=True)
+        df_resid = movies_design.shape[0] - np.linalg.matrix_rank(gram, hermitian=True)
+        coefs = gram_inverse @ (movies_design.T @ ys)
+        residuals = ys - movies_design @ coefs
+        sigma2 = (residuals ** 2).sum(axis=0) / df_resid
+
+        for j, i in enumerate(metric_indices):
+            std_err = np.sqrt(np.diag(gram_inverse) * sigma2[j])
+            t = coefs[:, j] / std_err
+            results[success_metrics[i]] = pd.DataFrame({"coef": coefs[:, j], "std err": std_err, "t": t,
+                                                        "pvalue": 2 * stats.t.sf(np.abs(t), df_resid)},
+                                                       index=labels[estimable])
+    return results
+
+
 def add_mean_to_series(ser: pd.Series, idx_name="Mean") -> pd.Series:
     """
     Find the mean val in a series and add it to all other values
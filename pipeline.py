@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+from base_imports import hashlib, inspect, os, pickle, time, FIRST_COMPLETED, np, pd, ProcessPoolExecutor, wait, \
+    LazyModule
+
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+
+pipeline_cache_path = "data/cache/pipeline/"
+
+# Directory of the analysis modules: functions defined there are part of the code fingerprint of a stage
+project_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def canonical_repr(value) -> str:
+    """
+    Representation of a stage parameter that does not depend on the session: sets and dicts are sorted,
+    arrays and dataframes are hashed by content
+    :param value: parameter
+    :return: said representation
+    """
+    if isinstance(value, dict):
+        return "{" + ", ".join(sorted(f"{canonical_repr(k)}: {canonical_repr(v)}" for k, v in value.items())) + "}"
+    if isinstance(value, (set, frozenset)):
+        return "{" + ", ".join(sorted(canonical_repr(v) for v in value)) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(canonical_repr(v) for v in value) + "]"
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        hashes = pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index))
+        return f"{type(value).__name__}({hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()})"
+    if isinstance(value, np.ndarray):
+        return f"ndarray({value.dtype}, {value.shape}, {hashlib.sha256(value.tobytes()).hexdigest()})"
+    if callable(value) and hasattr(value, "__qualname__"):
+        return f"{value.__module__}.{value.__qualname__}"
+    return repr(value)
+
+
+def referenced_names(code) -> set:
+    """
+    :param code: code object
+    :return: global names used by the code object and the functions or comprehensions nested in it
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= referenced_names(const)
+    return names
+
+
+def code_fingerprint(function) -> str:
+    """
+    Hash of the source code of a function and of all the project functions and classes it uses, directly or not,
+    so that editing a helper invalidates the stages depending on it
+    :param function: function or class
+    :return: said hash
+    """
+    sources, seen, to_visit = [], set(), [function]
+    while to_visit:
+        obj = to_visit.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        try:
+            sources.append(f"{obj.__module__}.{obj.__qualname__}\n{inspect.getsource(obj)}")
+        except (OSError, TypeError):
+            sources.append(f"{obj.__module__}.{obj.__qualname__}")
+
+        if inspect.isclass(obj):
+            members = [member for member in vars(obj).values() if inspect.isfunction(member)]
+        else:
+            members = [obj]
+        for member in members:
+            module_globals = member.__globals__
+            for name in referenced_names(member.__code__):
+                dependency = module_globals.get(name)
+                if (inspect.isfunction(dependency) or inspect.isclass(dependency)) and is_project_object(dependency):
+                    to_visit.append(dependency)
+
+    return hashlib.sha256("\n".join(sorted(sources)).encode("utf-8")).hexdigest()
+
+
+def is_project_object(obj) -> bool:
+    """
+    :param obj: function or class
+    :return: whether it is defined in one of the analysis modules, rather than in a library
+    """
+    try:
+        return os.path.dirname(os.path.abspath(inspect.getfile(obj))) == project_path
+    except TypeError:
+        return False
+
+
+def save_output(output, path: str) -> str:
+    """
+    Store the output of a stage: dataframes as parquet, anything else (or dataframes that arrow cannot encode)
+    pickled. The file is written under a temporary name then renamed, so the cache never holds partial outputs.
+    :param output: output of the stage
+    :param path: path without extension
+    :return: path of the written file
+    """
+    if isinstance(output, pd.DataFrame):
+        try:
+            table = pa.Table.from_pandas(output)
+            pq.write_table(table, path + ".parquet.tmp", compression='zstd')
+            os.replace(path + ".parquet.tmp", path + ".parquet")
+            return path + ".parquet"
+        except (ValueError, TypeError, NotImplementedError):
+            if os.path.isfile(path + ".parquet.tmp"):
+                os.remove(path + ".parquet.tmp")
+
+    with open(path + ".pkl.tmp", "wb") as file:
+        pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".pkl.tmp", path + ".pkl")
+    return path + ".pkl"
+
+
+def load_output(path: str):
+    """
+    :param path: path of a file written by save_output
+    :return: the stored output, list columns of dataframes are read back as lists
+    """
+    if not path.endswith(".parquet"):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    table = pq.read_table(path)
+    df = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            df[field.name] = table.column(field.name).to_pylist()
+    return df
+
+
+def execute_stage(function, input_paths: list, params: dict, in_place: bool, output_path: str) -> tuple[str, float]:
+    """
+    Run a stage on its cached inputs and cache its output. Runs in a worker process.
+    :param function: stage function
+    :param input_paths: paths of the cached outputs of the input stages
+    :param params: keyword arguments of the function
+    :param in_place: if True, the function modifies its first input, which is the output of the stage
+    :param output_path: path of the output, without extension
+    :return: tuple of the path of the output and the run time in seconds
+    """
+    start = time.perf_counter()
+    inputs = [load_output(path) for path in input_paths]
+    output = function(*inputs, **params)
+    if in_place:
+        output = inputs[0]
+    return save_output(output, output_path), time.perf_counter() - start
+
+
+class Stage:
+    """
+    Step of a pipeline: a function called with the outputs of other stages as positional arguments
+    and fixed keyword parameters
+    """
+
+    def __init__(self, name: str, function, inputs=(), params: dict = None, files=(), in_place=False):
+        """
+        :param name: str, unique in the pipeline
+        :param function: module-level function (it is sent to worker processes)
+        :param inputs: names of the stages whose outputs are passed to the function, in order
+        :param params: keyword arguments of the function
+        :param files: paths of files read by the function, the stage runs again when one of them changes
+        :param in_place: if True, the function modifies its first input (e.g. append_processed_columns),
+                         which is then the output of the stage instead of the returned value
+        """
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = {} if params is None else dict(params)
+        self.files = list(files)
+        self.in_place = in_place
+
+    def key(self, input_keys: list) -> str:
+        """
+        Content address of the output of the stage
+        :param input_keys: keys of the input stages
+        :return: hash of the code, parameters, read files and inputs of the stage
+        """
+        files = []
+        for path in self.files:
+            file_stat = os.stat(path)
+            files.append(f"{path}:{file_stat.st_size}:{file_stat.st_mtime_ns}")
+        description = "\n".join([code_fingerprint(self.function), canonical_repr(self.params), str(self.in_place),
+                                 canonical_repr(files), canonical_repr(input_keys)])
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """
+    Incremental runner of analysis stages. The output of every stage is persisted in a content-addressed cache
+    (parquet for dataframes): its key hashes the code of the stage, its parameters and the keys of its inputs,
+    so a stage only runs again when one of them changed. Stages that do not depend on each other, such as the
+    actor graphs of several genres, run in parallel worker processes.
+
+    Example:
+        pipeline = Pipeline()
+        pipeline.add("movies", pd.read_csv, params=dict(filepath_or_buffer=path, sep='\\t'), files=[path])
+        pipeline.add("movies with years", extract_release_year, inputs=["movies"])
+        pipeline.add("genres", append_processed_columns, inputs=["movies with years"],
+                     params=dict(column_name="Movie genres"), in_place=True)
+        for genre in genres:
+            pipeline.add(f"graph {genre}", create_graph, inputs=[f"characters {genre}"], params=dict(genre=genre))
+        movies = pipeline.run(["genres"])["genres"]
+    """
+
+    def __init__(self, cache_dir=pipeline_cache_path):
+        """
+        :param cache_dir: directory of the cached outputs
+        """
+        self.cache_dir = cache_dir
+        self.stages = {}
+
+    def add(self, name: str, function, inputs=(), params: dict = None, files=(), in_place=False) -> Stage:
+        """
+        Declare a stage, replacing any stage of the same name. See Stage for the parameters.
+        :return: the stage
+        """
+        unknown = [input_name for input_name in inputs if input_name not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undeclared stages {unknown}")
+        self.stages[name] = Stage(name, function, inputs, params, files, in_place)
+        return self.stages[name]
+
+    def dependencies(self, targets=None) -> list:
+        """
+        :param targets: names of stages, all stages if None
+        :return: names of the targets and of all the stages they depend on, inputs first
+        """
+        ordered, seen = [], set()
+
+        def visit(name):
+            if name not in seen:
+                seen.add(name)
+                for input_name in self.stages[name].inputs:
+                    visit(input_name)
+                ordered.append(name)
+
+        for target in self.stages if targets is None else targets:
+            visit(target)
+        return ordered
+
+    def keys(self, targets=None) -> dict:
+        """
+        :param targets: names of stages, all stages if None
+        :return: dict mapping the targets and their dependencies to their keys
+        """
+        keys = {}
+        for name in self.dependencies(targets):
+            stage = self.stages[name]
+            keys[name] = stage.key([keys[input_name] for input_name in stage.inputs])
+        return keys
+
+    def cached_path(self, key: str) -> str | None:
+        """
+        :param key: key of a stage
+        :return: path of its cached output, None if not cached
+        """
+        for extension in [".parquet", ".pkl"]:
+            path = os.path.join(self.cache_dir, key + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def run(self, targets=None, n_workers=None, force=False, load=True) -> dict:
+        """
+        Bring the outputs of the targets up to date, running only the stages whose output is not cached.
+        A stage is submitted as soon as all its inputs are available.
+        :param targets: names of stages, all stages if None
+        :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to run in the current process
+        :param force: run the targets and their dependencies even if cached
+        :param load: if True, return the outputs of the targets, else their cache paths
+        :return: dict mapping each target to its output
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        keys = self.keys(targets)
+        paths = {} if force else {name: self.cached_path(key) for name, key in keys.items()}
+        paths = {name: path for name, path in paths.items() if path is not None}
+        pending = [name for name in keys if name not in paths]
+        print(f"Pipeline: {len(keys) - len(pending)} stages cached, {len(pending)} to run")
+
+        def stage_args(name):
+            stage = self.stages[name]
+            return (stage.function, [paths[input_name] for input_name in stage.inputs], stage.params, stage.in_place,
+                    os.path.join(self.cache_dir, keys[name]))
+
+        def ready():
+            return [name for name in pending if all(input_name in paths for input_name in self.stages[name].inputs)]
+
+        if n_workers == 0 or len(pending) <= 1:
+            for name in pending:
+                paths[name], elapsed = execute_stage(*stage_args(name))
+                print(f"Ran stage {name} in {elapsed:.2f}s")
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                running = {}
+                while pending or running:
+                    for name in ready():
+                        pending.remove(name)
+                        running[executor.submit(execute_stage, *stage_args(name))] = name
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            paths[name], elapsed = future.result()
+                        except Exception as error:
+                            raise RuntimeError(f"Stage {name} failed") from error
+                        print(f"Ran stage {name} in {elapsed:.2f}s")
+
+        names = list(keys) if targets is None else list(targets)
+        return {name: load_output(paths[name]) if load else paths[name] for name in names}
+
+    def load(self, name: str):
+        """
+        :param name: name of a stage
+        :return: its cached output, running the stage first if needed
+        """
+        return self.run([name], n_workers=0)[name]
+
+    def prune(self) -> int:
+        """
+        Remove the cached outputs that no declared stage currently maps to
+        :return: number of removed files
+        """
+        current = set(self.keys().values())
+        removed = 0
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.split(".")[0] not in current:
+                os.remove(os.path.join(self.cache_dir, file_name))
+                removed += 1
+        return removed
@@ -1,62 +1,261 @@
-from base_imports import *
-from metadata_analysis import *
+from __future__ import annotations
+
+from base_imports import chain, gzip, json, os, pickle, repeat, ET, ProcessPoolExecutor, np, pd, plt, px, sns, \
+    sparse, TfidfTransformer, TfidfVectorizer, TruncatedSVD, Figure
+from metadata_analysis import IndicatorMatrix, export_figures, grouped_quantiles, map_to_col_names
 
 subpath = "data/corenlp_plot_summaries/"
+lemmas_cache_file = "data/pickled_data/lemmas_cache.pkl"
 starting_positions = {"VB", "NN", "NP", "PP", "RB"}
 
 
+def parse_important_lemmas(path: str) -> list[str]:
+    """
+    Stream a gzipped CoreNLP xml file and retrieve the lemmas of its important words
+    (verbs, nouns, pronouns and adverbs). Elements are cleared as soon as they are read,
+    so that the whole tree is never held in memory.
+    :param path: path of the xml.gz file
+    :return: list of lemmas of important words
+    """
+    lemmas = []
+    with gzip.open(path, 'r') as file:
+        for _, element in ET.iterparse(file, events=("end",)):
+            if element.tag == "token":
+                pos = element.findtext("POS", default="")
+                if pos.startswith(tuple(starting_positions)):
+                    lemmas.append(element.findtext("lemma"))
+                element.clear()
+            elif element.tag == "sentence":
+                element.clear()
+    return lemmas
+
+
 def get_important_lemmas(wiki_id: int) -> list[str]:
     """
     Retrieve important lemmas from
     :param wiki_id: wikipedia movie id
     :return: list of lemmas of important words
     """
-
-    def is_important(token):
-        tok = token.find("POS").text
-        for pos in starting_positions:
-            if tok.startswith(pos):
-                return True
-        return False
-
-    def to_lemma(token):
-        return token.find("lemma").text
-
     zip_name = str(wiki_id) + ".xml.gz"
 
     if not os.path.isfile(subpath + zip_name):
         print(f"Missing file with id {wiki_id}")
         return []
 
-    with gzip.open(subpath + zip_name, 'r') as file:
-        xmltree = ET.ElementTree(ET.fromstring(file.read())).getroot()
+    return parse_important_lemmas(subpath + zip_name)
 
-    return list(map(to_lemma, filter(is_important, xmltree.iter("token"))))
 
+def get_important_lemmas_batch(wiki_ids, n_workers=None, cache_file=lemmas_cache_file, verbose=True) \
+        -> dict[int, list[str]]:
+    """
+    Retrieve important lemmas of many movies. Files are parsed in parallel worker processes and
+    the results are kept in an on-disk cache keyed by wikipedia id and file modification time,
+    so that only new or modified files are parsed again.
+    :param wiki_ids: iterable of wikipedia movie ids
+    :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to parse in the current process
+    :param cache_file: path of the pickled cache, None to disable caching
+    :param verbose: print a summary of the missing, cached and parsed files
+    :return: dict mapping each wikipedia id to its list of lemmas, empty for missing files
+    """
+    cache = {}
+    if cache_file is not None and os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as file:
+            cache = pickle.load(file)
+
+    lemmas, to_parse, nb_missing = {}, {}, 0
+    for wiki_id in wiki_ids:
+        path = subpath + str(wiki_id) + ".xml.gz"
+        if not os.path.isfile(path):
+            lemmas[wiki_id] = []
+            nb_missing += 1
+            continue
+        mtime = os.stat(path).st_mtime_ns
+        if wiki_id in cache and cache[wiki_id][0] == mtime:
+            lemmas[wiki_id] = cache[wiki_id][1]
+        else:
+            to_parse[wiki_id] = (path, mtime)
+
+    if to_parse:
+        paths = [path for path, _ in to_parse.values()]
+        if n_workers == 0:
+            parsed = list(map(parse_important_lemmas, paths))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                parsed = list(executor.map(parse_important_lemmas, paths, chunksize=max(1, len(paths) // 256)))
+        for (wiki_id, (_, mtime)), wiki_lemmas in zip(to_parse.items(), parsed):
+            lemmas[wiki_id] = wiki_lemmas
+            cache[wiki_id] = (mtime, wiki_lemmas)
+
+        if cache_file is not None:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file + ".tmp", 'wb') as file:
+                pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file + ".tmp", cache_file)
+
+    if verbose:
+        print(f"Lemmas of {len(lemmas)} movies: {nb_missing} missing files, "
+              f"{len(lemmas) - nb_missing - len(to_parse)} cached, {len(to_parse)} parsed")
+    return lemmas
+
+
+class LemmaCorpus:
+    """
+    Compact store of the important lemmas of many movies: a global vocabulary and CSR-like arrays,
+    the lemmas of the i-th movie being vocabulary[token_ids[offsets[i]:offsets[i + 1]]].
+    A corpus may be a subset of another one, in which case it shares its arrays and only keeps
+    the positions (rows) of its movies.
+    """
 
-def find_more_or_less_successful_wrt(df, metric, values, value_prefix, q_low=0.1, q_high=0.9) -> dict:
+    def __init__(self, movie_ids: np.ndarray, vocabulary: np.ndarray, offsets: np.ndarray, token_ids: np.ndarray,
+                 rows: np.ndarray = None):
+        self.movie_ids = movie_ids
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.token_ids = token_ids
+        self.rows = rows
+
+    @classmethod
+    def from_lemmas(cls, movie_ids, lemmas) -> "LemmaCorpus":
+        """
+        Encode lists of lemmas
+        :param movie_ids: wikipedia movie ids
+        :param lemmas: list of lemmas of each movie, e.g. the 'important_lemmas' column
+        :return: said corpus
+        """
+        lemmas = list(lemmas)
+        lengths = np.fromiter(map(len, lemmas), dtype=np.int64, count=len(lemmas))
+        token_ids, vocabulary = pd.factorize(np.fromiter(chain.from_iterable(lemmas), dtype=object,
+                                                         count=lengths.sum()))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(np.asarray(movie_ids, dtype=np.int64), np.asarray(vocabulary, dtype=object), offsets,
+                   token_ids.astype(np.int32))
+
+    def save(self, directory: str) -> None:
+        """
+        Save the corpus as numpy arrays and a json vocabulary
+        :param directory: str, created if needed
+        """
+        os.makedirs(directory, exist_ok=True)
+        corpus = self if self.rows is None else self.compact()
+        np.save(os.path.join(directory, "movie_ids.npy"), corpus.movie_ids)
+        np.save(os.path.join(directory, "offsets.npy"), corpus.offsets)
+        np.save(os.path.join(directory, "token_ids.npy"), corpus.token_ids)
+        with open(os.path.join(directory, "vocabulary.json"), 'w', encoding='utf-8') as file:
+            json.dump(corpus.vocabulary.tolist(), file)
+
+    @classmethod
+    def load(cls, directory: str, mmap=True) -> "LemmaCorpus":
+        """
+        Load a saved corpus
+        :param directory: str
+        :param mmap: memory-map the arrays instead of reading them
+        :return: said corpus
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, "vocabulary.json"), encoding='utf-8') as file:
+            vocabulary = np.array(json.load(file), dtype=object)
+        return cls(np.load(os.path.join(directory, "movie_ids.npy"), mmap_mode=mmap_mode), vocabulary,
+                   np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, "token_ids.npy"), mmap_mode=mmap_mode))
+
+    def __len__(self) -> int:
+        return len(self.movie_ids) if self.rows is None else len(self.rows)
+
+    def ids(self) -> np.ndarray:
+        """
+        :return: wikipedia ids of the movies of the corpus
+        """
+        return self.movie_ids if self.rows is None else self.movie_ids[self.rows]
+
+    def subset(self, movie_ids) -> "LemmaCorpus":
+        """
+        Select movies without copying the lemmas
+        :param movie_ids: wikipedia ids of the selected movies, unknown ones are ignored
+        :return: corpus sharing the arrays of this one
+        """
+        rows = pd.Index(self.movie_ids).get_indexer(np.asarray(movie_ids, dtype=np.int64))
+        rows = rows[rows >= 0]
+        if self.rows is not None:
+            rows = rows[np.isin(rows, self.rows)]
+        return LemmaCorpus(self.movie_ids, self.vocabulary, self.offsets, self.token_ids, rows)
+
+    def indptr_and_tokens(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (offsets, token ids) of the movies of the corpus only
+        """
+        if self.rows is None:
+            return np.asarray(self.offsets), np.asarray(self.token_ids)
+        starts = self.offsets[self.rows]
+        lengths = self.offsets[self.rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(indptr[-1]) + np.repeat(starts - indptr[:-1], lengths)
+        return indptr, self.token_ids[positions]
+
+    def compact(self) -> "LemmaCorpus":
+        """
+        :return: copy of the corpus holding only its own movies
+        """
+        indptr, token_ids = self.indptr_and_tokens()
+        return LemmaCorpus(np.array(self.ids()), self.vocabulary, indptr, np.array(token_ids))
+
+    def count_matrix(self) -> sparse.csr_matrix:
+        """
+        :return: movies x vocabulary matrix of lemma counts
+        """
+        indptr, token_ids = self.indptr_and_tokens()
+        # sum_duplicates sorts the indices in place: work on copies, the arrays of the corpus may be its own
+        # or read-only memory maps
+        counts = sparse.csr_matrix((np.ones(len(token_ids), dtype=np.float64), np.array(token_ids), np.array(indptr)),
+                                   shape=(len(self), len(self.vocabulary)))
+        counts.sum_duplicates()
+        return counts
+
+    def to_lemma_lists(self) -> list[list[str]]:
+        """
+        :return: list of lemmas of each movie, as in the 'important_lemmas' column
+        """
+        indptr, token_ids = self.indptr_and_tokens()
+        lemmas = self.vocabulary[token_ids]
+        return [lemmas[indptr[i]:indptr[i + 1]].tolist() for i in range(len(self))]
+
+
+def find_more_or_less_successful_wrt(df, metric, values, value_prefix, q_low=0.1, q_high=0.9,
+                                     as_dataframes=False, indicators: IndicatorMatrix = None) -> dict:
     """
-    Outputs a dictionary of format: 'value': (least successful movies, most successful movies)
+    Outputs a dictionary of format: 'value': (least successful movies, most successful movies).
+    Quantiles of all values are computed in a single grouped pass over the indicator columns.
 
     :param metric: success metric
     :param values: values to consider (genre, lang, country)
     :param value_prefix: str
     :param q_low: quantile below which a movie is among the least successful
     :param q_high: similar to q_high for most successful
+    :param as_dataframes: if True, movies are given as dataframes, otherwise as arrays of row positions in df
+    :param indicators: indicator matrix of the rows of df, to read the values from instead of the columns of df
     :return: said dict
     """
+    values = list(values)
+    if indicators is not None:
+        codes, rows = indicators.nonzero(values)
+    else:
+        codes, rows = np.nonzero(df[map_to_col_names(values, value_prefix)].to_numpy().T == 1)
+    metric_values = df[metric].to_numpy(dtype=np.float64)[rows]
+
+    lo_q = grouped_quantiles(codes, metric_values, len(values), q_low)
+    hi_q = grouped_quantiles(codes, metric_values, len(values), q_high)
+
+    less_success = metric_values <= lo_q[codes]
+    more_success = metric_values >= hi_q[codes]
+    less_bounds = np.searchsorted(codes[less_success], np.arange(len(values) + 1))
+    more_bounds = np.searchsorted(codes[more_success], np.arange(len(values) + 1))
+    less_rows, more_rows = rows[less_success], rows[more_success]
 
     values_dfs = {}
-    for val in values:
-        contains_val = df[name_appended_column(value_prefix, val)] == 1
-        df_contains_val = df[contains_val]
-
-        lo_q = df_contains_val[metric].quantile(q=q_low)
-        hi_q = df_contains_val[metric].quantile(q=q_high)
-
-        val_less_success = df_contains_val[df_contains_val[metric] <= lo_q]
-        val_more_success = df_contains_val[df_contains_val[metric] >= hi_q]
-
+    for code, val in enumerate(values):
+        val_less_success = less_rows[less_bounds[code]:less_bounds[code + 1]]
+        val_more_success = more_rows[more_bounds[code]:more_bounds[code + 1]]
+        if as_dataframes:
+            val_less_success, val_more_success = df.iloc[val_less_success], df.iloc[val_more_success]
         values_dfs[val] = (val_less_success, val_more_success)
 
     return values_dfs
@@ -70,26 +269,146 @@ def get_unsuccessful(x):
     return x[0]
 
 
-def get_term_topic_matrix(df: pd.DataFrame, nbr_topics=5, lemmas_col='important_lemmas') -> \
-        tuple[pd.DataFrame, list[float]]:
+def tfidf_matrix(df: pd.DataFrame | LemmaCorpus, lemmas_col='important_lemmas') \
+        -> tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Compute the sparse TF-IDF matrix of given data
+    :param df: pd.Dataframe, data with lemmas, or directly a LemmaCorpus
+    :param lemmas_col: str, column where to find lemmas
+    :return: tuple containing the movies x terms TF-IDF matrix and the terms
+    """
+    if isinstance(df, LemmaCorpus):
+        counts = df.count_matrix()
+        used_terms = counts.getnnz(axis=0) > 0
+        return TfidfTransformer().fit_transform(counts[:, used_terms]), df.vocabulary[used_terms]
+
+    tfidf_vectorizer = TfidfVectorizer(tokenizer=lambda x: x, lowercase=False, token_pattern=None)
+    tfidf = tfidf_vectorizer.fit_transform(df[lemmas_col])
+    return tfidf, tfidf_vectorizer.get_feature_names_out()
+
+
+def fit_lsa(tfidf: sparse.csr_matrix, nbr_topics=5, algorithm='randomized', n_iter=100, tol=0.) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a truncated SVD on a sparse TF-IDF matrix
+    :param tfidf: movies x terms matrix
+    :param nbr_topics: int, number of latent topics
+    :param algorithm: SVD solver, 'randomized' or 'arpack'
+    :param n_iter: number of power iterations of the randomized solver
+    :param tol: convergence tolerance of the arpack solver, 0 for machine precision
+    :return: tuple containing V^T as a terms x topics array and S
+    """
+    lsa = TruncatedSVD(n_components=nbr_topics, algorithm=algorithm, n_iter=n_iter, tol=tol, random_state=42)
+    lsa.fit(tfidf)
+    return lsa.components_.T, lsa.singular_values_
+
+
+def to_term_topic_matrix(v_T: np.ndarray, terms: np.ndarray) -> pd.DataFrame:
+    """
+    :param v_T: terms x topics array
+    :param terms: terms of the rows
+    :return: V^T as a dataframe with columns corresponding to latent topics and rows as words
+    """
+    return pd.DataFrame(data=v_T, index=pd.Index(terms), columns=[f'topic {i}' for i in range(0, v_T.shape[1])])
+
+
+def get_term_topic_matrix(df: pd.DataFrame | LemmaCorpus, nbr_topics=5, lemmas_col='important_lemmas',
+                          algorithm='randomized', n_iter=100, tol=0.) -> tuple[pd.DataFrame, list[float]]:
     """
-    Compute LSA of given data: SVD (tfidf(data) = USV^T) then return V^T and S
+    Compute LSA of given data: SVD (tfidf(data) = USV^T) then return V^T and S.
+    The TF-IDF matrix is kept sparse, TruncatedSVD works on it directly.
 
-    :param df: pd.Dataframe, data with lemmas to be TF-IDF then LSA processed
+    :param df: pd.Dataframe, data with lemmas to be TF-IDF then LSA processed, or directly a LemmaCorpus
     :param nbr_topics: int, number of latent topics to be
     :param lemmas_col: str, column where to find lemmas
+    :param algorithm: SVD solver, 'randomized' or 'arpack'
+    :param n_iter: number of power iterations of the randomized solver
+    :param tol: convergence tolerance of the arpack solver, 0 for machine precision
     :return: tuple containing V^T as a dataframe with columns corresponding to latent topics and rows as words,
              and S containing singular values
     """
-    tfidf_vectorizer = TfidfVectorizer(tokenizer=lambda x: x, lowercase=False)
-    tfidf_df = pd.DataFrame(tfidf_vectorizer.fit_transform(df[lemmas_col]).toarray(),
-                            columns=tfidf_vectorizer.get_feature_names_out())
-    lsa = TruncatedSVD(n_components=nbr_topics, n_iter=100, random_state=42)
-    lsa.fit_transform(tfidf_df)
-    v_T = lsa.components_.T
-    term_topic_matrix = pd.DataFrame(data=v_T, index=tfidf_df.columns,
-                                     columns=[f'topic {i}' for i in range(0, v_T.shape[1])])
-    return term_topic_matrix, lsa.singular_values_
+    tfidf, terms = tfidf_matrix(df, lemmas_col)
+    v_T, singular_values = fit_lsa(tfidf, nbr_topics, algorithm, n_iter, tol)
+    return to_term_topic_matrix(v_T, terms), singular_values
+
+
+def successful_segments(values_dfs: dict, metric: str, df: pd.DataFrame = None, id_col='Wikipedia movie ID') \
+        -> dict:
+    """
+    Flatten the output of find_more_or_less_successful_wrt into topic modelling segments
+    :param values_dfs: dict of format 'value': (least successful movies, most successful movies)
+    :param metric: str, name of the success metric in the segment keys
+    :param df: data the movies were found in, needed when they are given as row positions
+    :param id_col: str, column where to find movie ids
+    :return: dict of format (value, metric, 'succ' or 'fail'): movies
+    """
+    def to_movies(movies):
+        if isinstance(movies, pd.DataFrame) or df is None:
+            return movies
+        return df[id_col].to_numpy()[movies]
+
+    segments = {}
+    for val, movies in values_dfs.items():
+        segments[(val, metric, 'fail')] = to_movies(get_unsuccessful(movies))
+        segments[(val, metric, 'succ')] = to_movies(get_successful(movies))
+    return segments
+
+
+def get_segments_term_topic_matrices(df: pd.DataFrame | LemmaCorpus, segments: dict, nbr_topics=3, m_words=10,
+                                     lemmas_col='important_lemmas', id_col='Wikipedia movie ID',
+                                     algorithm='randomized', n_iter=100, tol=0., n_workers=None) -> dict:
+    """
+    LSA of many segments of movies at once. The vocabulary and document frequencies are fitted once
+    over the union of all segments, then the SVD of each segment's rows is fitted in a process pool.
+
+    :param df: pd.Dataframe, data with lemmas and movie ids, or directly a LemmaCorpus
+    :param segments: dict of format key: movies, movies being a dataframe with an id_col column or ids,
+                     e.g. the output of successful_segments
+    :param nbr_topics: int, number of latent topics per segment
+    :param m_words: number of top words retrieved per topic
+    :param lemmas_col: str, column where to find lemmas
+    :param id_col: str, column where to find movie ids
+    :param algorithm: SVD solver, 'randomized' or 'arpack'
+    :param n_iter: number of power iterations of the randomized solver
+    :param tol: convergence tolerance of the arpack solver, 0 for machine precision
+    :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to fit in the current process
+    :return: dict of format key: (term topic matrix, singular values, list of top m words Series per topic)
+    """
+    segments_ids = {key: np.asarray(movies[id_col] if isinstance(movies, pd.DataFrame) else movies)
+                    for key, movies in segments.items()}
+    union_ids = pd.unique(np.concatenate(list(segments_ids.values())))
+
+    if isinstance(df, LemmaCorpus):
+        union = df.subset(union_ids)
+        union_ids = union.ids()
+    else:
+        union = df[df[id_col].isin(union_ids)].drop_duplicates(subset=id_col)
+        union_ids = union[id_col].to_numpy()
+    tfidf, terms = tfidf_matrix(union, lemmas_col)
+    union_rows = pd.Index(union_ids)
+
+    segments_tfidf, segments_terms = {}, {}
+    for key, ids in segments_ids.items():
+        rows = union_rows.get_indexer(ids)
+        segment_tfidf = tfidf[rows[rows >= 0]]
+        used_terms = segment_tfidf.getnnz(axis=0) > 0
+        segments_tfidf[key] = segment_tfidf[:, used_terms]
+        segments_terms[key] = terms[used_terms]
+
+    fit_args = (segments_tfidf.values(), repeat(nbr_topics), repeat(algorithm), repeat(n_iter), repeat(tol))
+    if n_workers == 0:
+        fits = list(map(fit_lsa, *fit_args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            fits = list(executor.map(fit_lsa, *fit_args))
+
+    results = {}
+    for key, (v_T, singular_values) in zip(segments_tfidf.keys(), fits):
+        term_topic_matrix = to_term_topic_matrix(v_T, segments_terms[key])
+        top_words = [top_m_words_nth_topic(term_topic_matrix, n, str(key), m_words, plot=False)
+                     for n in range(v_T.shape[1])]
+        results[key] = (term_topic_matrix, singular_values, top_words)
+    return results
 
 
 def top_m_words_nth_topic(term_topic_matrix: pd.DataFrame, nth_topic: int, suffix: str, m_words=10,
@@ -114,14 +433,16 @@ def top_m_words_nth_topic(term_topic_matrix: pd.DataFrame, nth_topic: int, suffi
     return top_m_terms
 
 
-def topic_piemaker(importance_ser: pd.Series, title: str, colors=px.colors.sequential.Greens_r) -> Figure:
+def topic_piemaker(importance_ser: pd.Series, title: str, colors=None) -> Figure:
     """
     Create pie of words for a topic
     :param importance_ser: importance series corresponding to words
     :param title: pie title
-    :param colors: color palette
+    :param colors: color palette, defaults to px.colors.sequential.Greens_r
     :return: Figure object, to be converted to html
     """
+    if colors is None:
+        colors = px.colors.sequential.Greens_r
     temp_df = pd.DataFrame(data={"Importance": importance_ser})
     temp_df["Word"] = temp_df.index
 
@@ -139,7 +460,20 @@ def topic_piemaker(importance_ser: pd.Series, title: str, colors=px.colors.seque
     return fig
 
 
-def savepie(fig: Figure, genre: str, metric: str, successful: int, idx_topic: int) -> None:
+def pie_path(genre: str, metric: str, successful: int, idx_topic: int) -> str:
+    """
+    Path of a topic pie
+    :param genre: str
+    :param metric: str
+    :param successful: 1 if topic is a successful one, anything else otherwise
+    :param idx_topic: int
+    :return: said path
+    """
+    successfulness_string = 'succ' if successful == 1 else 'fail'
+    return f"outputs/plot_analysis/{genre[:4]}_{metric}_{successfulness_string}_topic_{idx_topic + 1}.html"
+
+
+def savepie(fig: Figure, genre: str, metric: str, successful: int, idx_topic: int, shared_plotlyjs=False) -> None:
     """
     Save topic pie to disk
     :param fig: Figure object
@@ -147,8 +481,22 @@ def savepie(fig: Figure, genre: str, metric: str, successful: int, idx_topic: in
     :param metric: str
     :param successful: 1 if topic is a successful one, anything else otherwise
     :param idx_topic: int
+    :param shared_plotlyjs: if True, reference the plotly.js bundle shared by the directory instead of embedding it,
+                            and only rewrite the file if the pie changed (see export_figures)
     """
-    successfulness_string = 'succ' if successful == 1 else 'fail'
-    with open(f"outputs/plot_analysis/{genre[:4]}_{metric}_{successfulness_string}_topic_{idx_topic + 1}.html",
-              "w") as f:
+    path = pie_path(genre, metric, successful, idx_topic)
+    if shared_plotlyjs:
+        export_figures({path: fig})
+        return
+    with open(path, "w") as f:
         f.write(fig.to_html())
+
+
+def export_topic_pies(pies: dict, n_workers=None) -> list:
+    """
+    Save many topic pies at once, sharing a single plotly.js bundle and skipping unchanged pies
+    :param pies: dict of format (genre, metric, successful, idx_topic): Figure object
+    :param n_workers: number of worker processes, defaults to the number of CPUs
+    :return: list of the written paths
+    """
+    return export_figures({pie_path(*key): fig for key, fig in pies.items()}, n_workers=n_workers)
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from base_imports import ProcessPoolExecutor, np, pd, sparse, stats
+from metadata_analysis import IndicatorMatrix, indicator_rank_correlation
+
+# Data shared by the resampling workers, set once per process by init_resampling_worker
+resampled_data = {}
+
+
+def init_resampling_worker(metric_values: np.ndarray, indicators_T: sparse.csr_matrix) -> None:
+    """
+    Store the data resampled by the batches of a worker process
+    :param metric_values: success metric of each movie, without NaNs
+    :param indicators_T: values x movies indicator matrix
+    """
+    order = np.argsort(metric_values, kind='stable')
+    tie_groups = np.concatenate([[0], np.cumsum(np.diff(metric_values[order]) != 0)])
+    resampled_data.update(metric_values=metric_values, indicators_T=indicators_T, order=order,
+                          tie_groups=tie_groups, group_starts=np.flatnonzero(np.diff(tie_groups, prepend=-1)),
+                          ranks=stats.rankdata(metric_values))
+
+
+def weighted_ranks(weights: np.ndarray) -> np.ndarray:
+    """
+    Average ranks of the metric in resamples where the i-th movie is drawn weights[:, i] times
+    :param weights: replicates x movies array of multiplicities
+    :return: replicates x movies array of ranks, ties sharing their average rank
+    """
+    order, tie_groups = resampled_data["order"], resampled_data["tie_groups"]
+    group_weights = np.add.reduceat(weights[:, order], resampled_data["group_starts"], axis=1)
+    group_ranks = np.cumsum(group_weights, axis=1) - group_weights + (group_weights + 1) / 2
+    ranks = np.empty(weights.shape)
+    ranks[:, order] = group_ranks[:, tie_groups]
+    return ranks
+
+
+def group_effects(weights: np.ndarray, metric_values: np.ndarray, ranks: np.ndarray) -> dict:
+    """
+    Effects of every value on the metric, for a batch of replicates at once
+    :param weights: replicates x movies array of multiplicities
+    :param metric_values: replicates x movies array of the metric
+    :param ranks: replicates x movies array of the ranks of the metric
+    :return: dict of replicates x values arrays: 'mean' of the metric among movies listing the value,
+             'mean difference' with the other movies and Spearman correlation 'rho'
+    """
+    indicators_T = resampled_data["indicators_T"]
+    nb_movies = weights.sum(axis=1)[:, None]
+    weighted_metric, weighted_ranks_ = weights * metric_values, weights * ranks
+
+    support = (indicators_T @ weights.T).T
+    sums = (indicators_T @ weighted_metric.T).T
+    rank_sums = (indicators_T @ weighted_ranks_.T).T
+    total = weighted_metric.sum(axis=1)[:, None]
+    rank_total = weighted_ranks_.sum(axis=1)[:, None]
+    rank_std = np.sqrt((weights * ranks ** 2).sum(axis=1)[:, None] / nb_movies - (rank_total / nb_movies) ** 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / support
+        mean_difference = mean - (total - sums) / (nb_movies - support)
+    return {"mean": mean, "mean difference": mean_difference,
+            "rho": indicator_rank_correlation(rank_sums, support, rank_total, rank_std, nb_movies)}
+
+
+def bootstrap_batch(seed: np.random.SeedSequence, batch_size: int) -> dict:
+    """
+    Effects of every value on batch_size bootstrap resamples of the movies
+    :param seed: seed of the batch
+    :param batch_size: number of replicates
+    :return: dict of replicates x values arrays, as group_effects
+    """
+    metric_values = resampled_data["metric_values"]
+    nb_movies = len(metric_values)
+    draws = np.random.default_rng(seed).integers(0, nb_movies, size=(batch_size, nb_movies))
+    weights = np.zeros((batch_size, nb_movies))
+    np.add.at(weights, (np.arange(batch_size)[:, None], draws), 1)
+    return group_effects(weights, metric_values[None, :], weighted_ranks(weights))
+
+
+def permutation_batch(seed: np.random.SeedSequence, batch_size: int) -> dict:
+    """
+    Effects of every value on batch_size random permutations of the metric
+    :param seed: seed of the batch
+    :param batch_size: number of replicates
+    :return: dict of replicates x values arrays, as group_effects
+    """
+    metric_values, ranks = resampled_data["metric_values"], resampled_data["ranks"]
+    permutations = np.random.default_rng(seed).permuted(np.tile(np.arange(len(metric_values)), (batch_size, 1)),
+                                                        axis=1)
+    return group_effects(np.ones(permutations.shape), metric_values[permutations], ranks[permutations])
+
+
+def run_batches(batch_function, df: pd.DataFrame, success_metric: str, indicators: IndicatorMatrix,
+                n_replicates: int, batch_size: int, n_workers, seed: int) -> tuple[dict, dict]:
+    """
+    Compute the observed effects and those of n_replicates resamples, spreading the batches over a process pool.
+    Every batch has its own seed spawned from seed, so results do not depend on the number of workers.
+    :param batch_function: bootstrap_batch or permutation_batch
+    :param df: data, movies without metric are dropped
+    :param success_metric: str, name of column in df
+    :param indicators: indicator matrix of the rows of df
+    :param n_replicates: number of resamples, ValueError if less than 1
+    :param batch_size: number of resamples per batch
+    :param n_workers: number of worker processes, 0 to run in the current process
+    :param seed: int
+    :return: tuple of observed effects (dict of values arrays) and resampled effects (dict of replicates x values)
+    """
+    if n_replicates < 1 or batch_size < 1:
+        raise ValueError(f"Number of resamples and batch size must be at least 1, got {n_replicates} and "
+                         f"{batch_size}")
+    metric_values = df[success_metric].to_numpy(dtype=np.float64)
+    has_metric = ~np.isnan(metric_values)
+    initargs = (metric_values[has_metric], indicators.matrix[has_metric].T.tocsr().astype(np.float64))
+
+    nb_batches = -(-n_replicates // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(nb_batches)
+    sizes = [batch_size] * (nb_batches - 1) + [n_replicates - batch_size * (nb_batches - 1)]
+
+    init_resampling_worker(*initargs)
+    observed = group_effects(np.ones((1, has_metric.sum())), initargs[0][None, :], resampled_data["ranks"][None, :])
+    if n_workers == 0:
+        batches = list(map(batch_function, seeds, sizes))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_resampling_worker,
+                                 initargs=initargs) as executor:
+            batches = list(executor.map(batch_function, seeds, sizes))
+
+    resampled = {statistic: np.concatenate([batch[statistic] for batch in batches]) for statistic in observed}
+    return {statistic: values[0] for statistic, values in observed.items()}, resampled
+
+
+def bootstrap_effects(df: pd.DataFrame, success_metric: str, indicators: IndicatorMatrix, n_replicates=10000,
+                      confidence=0.95, batch_size=64, n_workers=None, seed=42) -> pd.DataFrame:
+    """
+    Bootstrap percentile confidence intervals of the effects of every value on a success metric:
+    mean of the metric among movies listing the value, difference with the mean of the other movies,
+    and Spearman correlation.
+    :param df: data, movies without metric are dropped
+    :param success_metric: str, name of column in df
+    :param indicators: indicator matrix of the rows of df, e.g. restricted to the frequent values
+    :param n_replicates: number of bootstrap resamples
+    :param confidence: level of the intervals
+    :param batch_size: number of resamples drawn at once by a worker
+    :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to run in the current process
+    :param seed: int, for reproducibility
+    :return: dataframe indexed by value with each statistic and its '<statistic> low' and '<statistic> high' bounds
+    """
+    observed, resampled = run_batches(bootstrap_batch, df, success_metric, indicators, n_replicates, batch_size,
+                                      n_workers, seed)
+    alpha = (1 - confidence) / 2
+    table = pd.DataFrame(index=pd.Index(indicators.values, name=indicators.prefix))
+    for statistic in observed:
+        table[statistic] = observed[statistic]
+        table[f"{statistic} low"], table[f"{statistic} high"] = \
+            np.nanquantile(resampled[statistic], [alpha, 1 - alpha], axis=0)
+    return table
+
+
+def permutation_effects(df: pd.DataFrame, success_metric: str, indicators: IndicatorMatrix, n_permutations=10000,
+                        batch_size=64, n_workers=None, seed=42) -> pd.DataFrame:
+    """
+    Two-sided permutation tests of the effects of every value on a success metric: the metric is shuffled
+    among movies and the mean difference and Spearman correlation are compared to the observed ones.
+    :param df: data, movies without metric are dropped
+    :param success_metric: str, name of column in df
+    :param indicators: indicator matrix of the rows of df, e.g. restricted to the frequent values
+    :param n_permutations: number of permutations
+    :param batch_size: number of permutations drawn at once by a worker
+    :param n_workers: number of worker processes, defaults to the number of CPUs, 0 to run in the current process
+    :param seed: int, for reproducibility
+    :return: dataframe indexed by value with 'mean difference' and 'rho' and their permutation p-values,
+             NaN where the observed statistic is NaN
+    """
+    observed, resampled = run_batches(permutation_batch, df, success_metric, indicators, n_permutations,
+                                      batch_size, n_workers, seed)
+    table = pd.DataFrame(index=pd.Index(indicators.values, name=indicators.prefix))
+    for statistic in ["mean difference", "rho"]:
+        as_extreme = np.abs(resampled[statistic]) >= np.abs(observed[statistic]) * (1 - 1e-12)
+        table[statistic] = observed[statistic]
+        pvalues = (1 + as_extreme.sum(axis=0)) / (1 + n_permutations)
+        # No test for values whose statistic is undefined, e.g. listed by none or all of the movies
+        table[f"{statistic} pvalue"] = np.where(np.isnan(observed[statistic]), np.nan, pvalues)
+    return table
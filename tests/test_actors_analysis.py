@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actors_analysis import ActorRegistry, build_adjacency_matrix  # noqa: E402
+
+
+def characters() -> pd.DataFrame:
+    films = [(1, 2e6, 6.0, "abc"), (2, 5e6, 7.0, "cd"), (3, 7e6, 8.0, "ab"), (4, 1e6, 5.0, "bd")]
+    rows = [(film, f"/m/{actor}", f"Actor {actor}", revenue, rating)
+            for film, revenue, rating, actors in films for actor in actors]
+    return pd.DataFrame(rows, columns=["Wikipedia movie ID", "Freebase actor ID", "Actor name",
+                                       "Movie box office revenue", "averageRating"])
+
+
+def test_build_adjacency_matrix_with_partial_registry():
+    char_df = characters()
+    # The registry only knows the actors of films 3 and 4: film 2 loses all its actors
+    registry = ActorRegistry(char_df[char_df["Wikipedia movie ID"] >= 3])
+    codes = dict(zip(registry.ids(np.arange(len(registry))), range(len(registry))))
+
+    for weight_on_revenue, expected in [(True, {("a", "b"): 9., ("b", "d"): 1.}),
+                                        (False, {("a", "b"): 14., ("b", "d"): 5.})]:
+        adjacency_matrix = build_adjacency_matrix(char_df, registry, weight_on_revenue)
+        assert adjacency_matrix.shape == (3, 3)
+        assert adjacency_matrix.nnz == len(expected)
+        for (first, second), weight in expected.items():
+            first, second = sorted([codes[f"/m/{first}"], codes[f"/m/{second}"]])
+            assert adjacency_matrix[first, second] == weight
+
+
+def test_build_adjacency_matrix_matches_full_registry():
+    char_df = characters()
+    full = build_adjacency_matrix(char_df, ActorRegistry(char_df)).toarray()
+    registry = ActorRegistry(char_df)
+    partial_registry = ActorRegistry(char_df[char_df["Freebase actor ID"] != "/m/c"])
+    partial = build_adjacency_matrix(char_df, partial_registry).toarray()
+
+    kept = registry.codes(partial_registry.ids(np.arange(len(partial_registry))))
+    restricted = (full + full.T)[np.ix_(kept, kept)]
+    np.testing.assert_allclose(partial + partial.T, restricted)
+
+
+def imdb_frames() -> tuple[pd.DataFrame, pd.DataFrame]:
+    movies = pd.DataFrame({"tconst": ["tt1", "tt2", "tt3", "tt3", "tt4"],
+                           "primaryTitle": ["Alpha", "Beta", "Gamma", "Gamma", "Delta"],
+                           "Movie box office revenue": [5e6, np.nan, 2e6, 9e6, 1e6]})
+    actors = pd.DataFrame({"knownForTitles": ["tt1,tt2,tt3", "tt4,tt9", "tt9", "tt3,tt1,tt4,tt2"]},
+                          index=[7, 8, 9, 10])
+    return actors, movies
+
+
+def test_known_for_max_revenue_matches_get_max():
+    from actors_analysis import get_max, known_for_max_revenue, title_revenue_index
+
+    actors, movies = imdb_frames()
+    titles = pd.DataFrame({"knownForTitles": ["Alpha,Beta,Gamma", "Delta,Omega", "Omega", "Gamma*,Alpha"]},
+                          index=actors.index)
+    revenues = title_revenue_index(movies)
+    assert revenues.to_dict() == {"Alpha": 5e6, "Delta": 1e6, "Gamma": 9e6}
+    expected = [get_max(row, movies) for row in titles["knownForTitles"]]
+    assert expected == [9e6, 1e6, 0, 5e6]
+    assert known_for_max_revenue(titles, revenues).tolist() == expected
+    assert known_for_max_revenue(titles, movies).index.tolist() == [7, 8, 9, 10]
+
+
+def test_resolve_known_titles():
+    from actors_analysis import resolve_known_titles
+
+    actors, movies = imdb_frames()
+    names = movies[["tconst", "primaryTitle"]]
+    wide = resolve_known_titles(actors, names, nb_titles=2)
+    assert wide.index.tolist() == [7, 10]
+    assert wide[["knownForTitles0", "knownForTitles1"]].values.tolist() == [["Alpha", "Beta"], ["Gamma", "Alpha"]]
+
+    partial = resolve_known_titles(actors, names, nb_titles=2, keep_partial=True)
+    assert partial.index.tolist() == [7, 8, 10]
+    assert partial.loc[8, "knownForTitles0"] == "Delta" and pd.isna(partial.loc[8, "knownForTitles1"])
+
+    long = resolve_known_titles(actors, names, nb_titles=3, wide=False)
+    assert long["primaryTitle"].tolist() == ["Alpha", "Beta", "Gamma", "Gamma", "Alpha", "Delta"]
+    assert long["position"].tolist() == [0, 1, 2, 0, 1, 2]
+
+
+def test_save_and_load_graph(tmp_path):
+    from actors_analysis import load_graph, save_graph, write_graph_csv
+
+    char_df = characters()
+    registry = ActorRegistry(char_df)
+    adjacency_matrix = build_adjacency_matrix(char_df, registry)
+    save_graph(adjacency_matrix, registry, str(tmp_path / "graph"))
+
+    for mmap in [True, False]:
+        loaded, loaded_registry = load_graph(str(tmp_path / "graph"), mmap=mmap)
+        np.testing.assert_array_equal(loaded.toarray(), adjacency_matrix.toarray())
+        assert loaded_registry.actor_ids.tolist() == registry.actor_ids.tolist()
+        assert loaded_registry.actor_names.tolist() == registry.actor_names.tolist()
+    assert isinstance(np.load(str(tmp_path / "graph" / "indices.npy"), mmap_mode='r'), np.memmap)
+
+    assert write_graph_csv(adjacency_matrix, registry, str(tmp_path / "graph.csv"), chunk_size=2) == \
+        adjacency_matrix.nnz
+    edges = pd.read_csv(tmp_path / "graph.csv")
+    assert edges.columns.tolist() == ["Source", "Target", "Weight"]
+    weights = {tuple(sorted(pair)): weight for *pair, weight in edges.itertuples(index=False)}
+    assert weights == {("/m/a", "/m/b"): 9., ("/m/a", "/m/c"): 2., ("/m/b", "/m/c"): 2., ("/m/c", "/m/d"): 5.,
+                       ("/m/b", "/m/d"): 1.}
+    nodes = pd.read_csv(tmp_path / "graph_nodes.csv")
+    assert sorted(nodes["Label"]) == ["Actor a", "Actor b", "Actor c", "Actor d"]
+
+
+def test_create_graph(tmp_path, monkeypatch):
+    import actors_analysis
+
+    monkeypatch.setattr(actors_analysis, "graphs_path", str(tmp_path) + "/")
+    directory = actors_analysis.create_graph(characters(), "Drama", weight_on_revenue=False, gephi_csv=True)
+    assert directory == str(tmp_path) + "/graph_Drama_rating"
+    adjacency_matrix, registry = actors_analysis.load_graph(directory)
+    assert len(registry) == 4 and adjacency_matrix.nnz == 5
+    assert os.path.isfile(directory + ".csv") and os.path.isfile(directory + "_nodes.csv")
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base_imports import LazyAttribute, LazyModule  # noqa: E402
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_module_imports_on_first_access():
+    module = LazyModule("json")
+    assert "loaded" not in repr(module)
+    assert module.loads("[1, 2]") == [1, 2]
+    assert "(loaded)" in repr(module)
+    assert "dumps" in dir(module)
+
+
+def test_lazy_attribute_behaves_like_the_attribute():
+    Fraction = LazyAttribute("fractions", "Fraction")
+    half = Fraction(1, 2)
+    assert half == 0.5
+    assert isinstance(half, Fraction)
+    assert not isinstance(0.5, Fraction)
+    assert Fraction.from_float(0.25) == Fraction(1, 4)
+
+
+def test_analysis_modules_do_not_import_heavy_dependencies():
+    heavy = ["sklearn", "matplotlib", "seaborn", "plotly", "statsmodels", "nltk", "bs4", "scipy.stats"]
+    statement = ("import sys, actors_analysis, metadata_analysis, plots_analysis, resampling; "
+                 f"print([name for name in {heavy!r} if name in sys.modules])")
+    result = subprocess.run([sys.executable, "-c", statement], cwd=repository, check=True, capture_output=True,
+                            text=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+sys.path.insert(0, os.path.join(repository, "benchmarks"))
+
+import pandas as pd  # noqa: E402
+
+from synthetic_data import generate_characters, generate_lemmas, generate_metadata  # noqa: E402
+
+
+def test_synthetic_data_is_reproducible():
+    metadata = generate_metadata(300, seed=1)
+    assert len(metadata) == 300 and metadata["Wikipedia movie ID"].is_unique
+    pd.testing.assert_frame_equal(metadata, generate_metadata(300, seed=1))
+    assert not metadata.equals(generate_metadata(300, seed=2))
+
+    characters = generate_characters(metadata, seed=1)
+    pd.testing.assert_frame_equal(characters, generate_characters(metadata, seed=1))
+    assert characters["Wikipedia movie ID"].isin(metadata["Wikipedia movie ID"]).all()
+    assert generate_lemmas(50, seed=1) == generate_lemmas(50, seed=1)
+
+
+def test_hot_paths_benchmark_and_comparison(tmp_path):
+    script = os.path.join(repository, "benchmarks", "bench_hot_paths.py")
+    first, second = str(tmp_path / "first.json"), str(tmp_path / "second.json")
+    arguments = [sys.executable, script, "--scales", "200", "--repeat", "1", "--max-files", "3",
+                 "--benchmarks", "separate_ids_from_list_data", "create_graph", "get_important_lemmas_batch"]
+    subprocess.run(arguments + ["--output", first], cwd=repository, check=True, capture_output=True)
+    with open(first) as file:
+        run = json.load(file)
+    assert [result["benchmark"] for result in run["results"]] == ["separate_ids_from_list_data", "create_graph",
+                                                                  "get_important_lemmas_batch"]
+    assert all(result["seconds"] > 0 and result["items"] > 0 for result in run["results"])
+
+    # A previous run 1000 times faster makes every benchmark a regression
+    for result in run["results"]:
+        result["seconds"] /= 1000
+    with open(first, "w") as file:
+        json.dump(run, file)
+    compared = subprocess.run(arguments + ["--output", second, "--compare", first], cwd=repository,
+                              capture_output=True, text=True)
+    assert compared.returncode == 1
+    assert compared.stdout.count("REGRESSION") == 3
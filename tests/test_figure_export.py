@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plotly.graph_objects as go  # noqa: E402
+import plotly.io as pio  # noqa: E402
+
+from figure_export import export_figures, plotlyjs_file  # noqa: E402
+
+
+def figures(directory, nb_figures=3) -> dict:
+    return {os.path.join(directory, f"figure{i}.html"): go.Figure(go.Bar(x=["a", "b"], y=[i, i + 1]))
+            for i in range(nb_figures)}
+
+
+def test_export_shares_the_plotlyjs_bundle(tmp_path):
+    written = export_figures(figures(str(tmp_path)), n_workers=0)
+    assert sorted(written) == sorted(figures(str(tmp_path)))
+    assert os.path.isfile(tmp_path / plotlyjs_file)
+    html = (tmp_path / "figure0.html").read_text(encoding="utf-8")
+    assert f'src="{plotlyjs_file}"' in html
+    assert os.path.getsize(tmp_path / "figure0.html") < os.path.getsize(tmp_path / plotlyjs_file) / 10
+
+
+def test_only_changed_figures_are_rendered_again(tmp_path, capsys):
+    export_figures(figures(str(tmp_path)), n_workers=2)
+    assert "Exported 3 figures, 0 unchanged" in capsys.readouterr().out
+    first = (tmp_path / "figure1.html").read_text(encoding="utf-8")
+
+    changed = figures(str(tmp_path))
+    changed[str(tmp_path / "figure2.html")].update_layout(title="Changed")
+    assert export_figures(changed, n_workers=0) == [str(tmp_path / "figure2.html")]
+    assert "Exported 1 figures, 2 unchanged" in capsys.readouterr().out
+    # Rendering is deterministic
+    assert export_figures(figures(str(tmp_path)), n_workers=0, force=True)
+    assert (tmp_path / "figure1.html").read_text(encoding="utf-8") == first
+
+    os.remove(tmp_path / "figure0.html")
+    assert export_figures(figures(str(tmp_path)), n_workers=0) == [str(tmp_path / "figure0.html")]
+
+
+def test_json_export(tmp_path):
+    path = str(tmp_path / "figure.json")
+    export_figures({path: go.Figure(go.Bar(x=["a"], y=[1]))}, fmt="json")
+    assert tuple(pio.read_json(path).data[0].y) == (1,)
+    assert not os.path.isfile(tmp_path / plotlyjs_file)
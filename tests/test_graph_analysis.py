@@ -0,0 +1,105 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+from scipy import sparse  # noqa: E402
+
+from graph_analysis import ActorGraph, community_indicators, modularity, movie_graph_features  # noqa: E402
+
+
+@pytest.fixture
+def two_cliques() -> ActorGraph:
+    """
+    Two cliques of 5 actors joined by one light edge, and an actor without edge
+    """
+    dense = np.zeros((11, 11))
+    for clique in [range(5), range(5, 10)]:
+        for i in clique:
+            for j in clique:
+                dense[i, j] = 0 if i == j else 1 + (i + j) % 3
+    dense[4, 5] = dense[5, 4] = 0.5
+    return ActorGraph(sparse.csr_matrix(dense), [f"/m/{i}" for i in range(11)])
+
+
+def test_degrees_components_and_pagerank(two_cliques):
+    dense = two_cliques.adjacency.toarray()
+    assert two_cliques.degrees().tolist() == [4, 4, 4, 4, 5, 5, 4, 4, 4, 4, 0]
+    assert np.allclose(two_cliques.weighted_degrees(), dense.sum(axis=1))
+    components = two_cliques.connected_components()
+    assert len(set(components[:10])) == 1 and components[10] != components[0]
+
+    # Dense power iteration, the isolated node jumping uniformly
+    transition = np.where(dense.sum(axis=1, keepdims=True) > 0, dense / np.maximum(dense.sum(axis=1, keepdims=True),
+                                                                                   1e-300), 1 / 11)
+    ranks = np.full(11, 1 / 11)
+    for _ in range(1000):
+        ranks = 0.85 * transition.T @ ranks + 0.15 / 11
+    pagerank = two_cliques.pagerank()
+    assert pagerank.sum() == pytest.approx(1)
+    assert np.allclose(pagerank, ranks / ranks.sum())
+
+
+def test_modularity_matches_definition(two_cliques):
+    dense = two_cliques.adjacency.toarray()
+    communities = np.array([0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 3])
+    weights, total = dense.sum(axis=1), dense.sum()
+    same = communities[:, None] == communities[None, :]
+    for resolution in [0.5, 1, 2]:
+        expected = ((dense - resolution * np.outer(weights, weights) / total) * same).sum() / total
+        assert two_cliques.modularity(communities, resolution) == pytest.approx(expected)
+    assert modularity(two_cliques.adjacency, np.zeros(11, dtype=int)) == pytest.approx(0)
+
+
+def test_louvain_and_spectral_clusters_find_the_cliques(two_cliques):
+    communities = two_cliques.louvain()
+    assert len(set(communities[:5])) == 1 and len(set(communities[5:10])) == 1
+    assert communities[0] != communities[5] and communities[10] == 2
+    assert two_cliques.modularity(communities) > 0.4
+    assert (two_cliques.louvain(seed=0) == communities).all()
+    # A graph without edge keeps one community per node
+    assert (ActorGraph(sparse.csr_matrix((3, 3)), list("abc")).louvain() == [0, 1, 2]).all()
+
+    clusters = two_cliques.spectral_clustering(n_clusters=2)
+    assert clusters[10] == -1
+    assert len(set(clusters[:5])) == 1 and len(set(clusters[5:10])) == 1 and clusters[0] != clusters[5]
+
+    features = two_cliques.node_features(n_clusters=2)
+    assert list(features.index) == list(two_cliques.node_ids)
+    assert (features['community'].to_numpy() == communities).all()
+
+
+def test_from_csv(tmp_path):
+    path = str(tmp_path / "edges.csv")
+    pd.DataFrame({'Source': ["/m/a", "/m/b", "/m/a"], 'Target': ["/m/b", "/m/c", "/m/b"],
+                  'Weight': [1.5, 2., 0.1]}).to_csv(path, index=False)
+    graph = ActorGraph.from_csv(path)
+    assert list(graph.node_ids) == ["/m/a", "/m/b", "/m/c"] and list(graph.labels) == list(graph.node_ids)
+    assert np.allclose(graph.adjacency.toarray(), [[0, 1.6, 0], [1.6, 0, 2], [0, 2, 0]])
+
+    pd.DataFrame({'Id': ["/m/a", "/m/c"], 'Label': ["Actor A", "Actor C"]}).to_csv(tmp_path / "edges_nodes.csv",
+                                                                                 index=False)
+    assert list(ActorGraph.from_csv(path).labels) == ["Actor A", "/m/b", "Actor C"]
+
+
+def test_movie_features_and_community_indicators(two_cliques):
+    node_features = two_cliques.node_features(spectral=False)
+    char_df = pd.DataFrame({'Wikipedia movie ID': [1, 1, 1, 2, 2, 3, 3],
+                            'Freebase actor ID': ["/m/0", "/m/1", "/m/5", "/m/6", "/m/6", "/m/10", None]})
+    movies = pd.DataFrame({'Wikipedia movie ID': [3, 2, 1, 4]}, index=list("wxyz"))
+
+    features = movie_graph_features(char_df, node_features)
+    assert features['actors in graph'].to_dict() == {1: 3, 2: 1, 3: 1}
+    assert features['actor communities'].to_dict() == {1: 2, 2: 1, 3: 1}
+    assert features.loc[1, 'max actor pagerank'] == node_features['pagerank'][["/m/0", "/m/1", "/m/5"]].max()
+
+    indicators = community_indicators(char_df, movies, node_features)
+    assert list(indicators.index) == list("wxyz") and len(indicators.values) == 3
+    dense = pd.DataFrame(indicators.matrix.toarray(), index=list("wxyz"), columns=indicators.values)
+    community = node_features['community']
+    assert dense.loc["y"].sum() == 2 and dense.loc["y", community["/m/0"]] == 1
+    assert dense.loc["x"].sum() == 1 and dense.loc["z"].sum() == 0
+    assert community_indicators(char_df, movies, node_features, nb_clusters=1).matrix.shape == (4, 1)
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import imdb_loading  # noqa: E402
+
+title_basics = """tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\truntimeMinutes\tgenres
+tt0000001\tshort\tCarmencita\tCarmencita\t0\t1894\t\\N\t1\tDocumentary,Short
+tt0000002\tmovie\tLe clown et ses chiens\tLe clown et ses chiens\t0\t1892\t\\N\t5\tAnimation,Short
+tt0000003\tmovie\tMalformed "row\tMalformed row\t1981\tRomance\t\\N\t12.5\t\\N
+tt0000004\tmovie\tFuture\tFuture\t1\t40000\t\\N\t90\tDrama
+"""
+
+
+def write_title_basics(tmp_path, monkeypatch):
+    monkeypatch.setattr(imdb_loading, "data_path", str(tmp_path) + "/")
+    monkeypatch.setattr(imdb_loading, "cache_path", str(tmp_path) + "/cache/")
+    with open(tmp_path / "imdb_title_basics.tsv", "w", encoding="utf-8") as file:
+        file.write(title_basics)
+
+
+def test_cache_round_trip(tmp_path, monkeypatch):
+    write_title_basics(tmp_path, monkeypatch)
+    df = imdb_loading.load_imdb("imdb_title_basics")
+    assert os.path.isfile(imdb_loading.imdb_cache_path("imdb_title_basics"))
+
+    assert df["tconst"].tolist() == ["tt0000001", "tt0000002", "tt0000003", "tt0000004"]
+    assert df["primaryTitle"].iloc[2] == 'Malformed "row'
+    assert isinstance(df["titleType"].dtype, pd.CategoricalDtype)
+    assert df["startYear"].dtype == pd.Int16Dtype()
+    assert df["startYear"].iloc[:2].tolist() == [1894, 1892]
+    assert df["endYear"].isna().all()
+    assert df["genres"].iloc[0] == "Documentary,Short"
+
+
+def test_values_out_of_the_column_range_are_missing(tmp_path, monkeypatch):
+    write_title_basics(tmp_path, monkeypatch)
+    df = imdb_loading.load_imdb("imdb_title_basics")
+    # isAdult is an int8, startYear an int16 and runtimeMinutes an integer
+    assert df["isAdult"].iloc[[0, 3]].tolist() == [0, 1]
+    assert pd.isna(df["isAdult"].iloc[2])
+    assert pd.isna(df["startYear"].iloc[2]) and pd.isna(df["startYear"].iloc[3])
+    assert pd.isna(df["runtimeMinutes"].iloc[2])
+    assert df["runtimeMinutes"].iloc[3] == 90
+
+
+def test_filters_are_pushed_down(tmp_path, monkeypatch):
+    write_title_basics(tmp_path, monkeypatch)
+    movies = imdb_loading.load_imdb_movies(columns=["tconst", "titleType"])
+    assert movies.columns.tolist() == ["tconst", "titleType"]
+    assert movies["tconst"].tolist() == ["tt0000002", "tt0000003", "tt0000004"]
@@ -0,0 +1,297 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metadata_analysis as ma  # noqa: E402
+
+
+def genres_df() -> pd.DataFrame:
+    # Legacy value lists: the baseline parser gave [None] for '{}' rows
+    return pd.DataFrame({"Movie genres: values": [["a", "c"], [None], ["b", "a", "a"], [], ["d"]]},
+                        index=[10, 11, 12, 13, 14])
+
+
+def test_indicator_matrix_of_value_lists():
+    df = genres_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre")
+    assert sorted(indicators.values) == ["a", "b", "c", "d"]
+    dense = indicators.to_dataframe(["a", "b", "c", "d"])
+    assert dense.index.tolist() == df.index.tolist()
+    assert dense.columns.tolist() == ["genre: a", "genre: b", "genre: c", "genre: d"]
+    np.testing.assert_array_equal(dense.to_numpy(), [[1, 0, 1, 0], [0, 0, 0, 0], [1, 1, 0, 0], [0, 0, 0, 0],
+                                                     [0, 0, 0, 1]])
+
+
+def test_indicator_matrix_with_all_values():
+    df = genres_df()
+    # 'd' is left out, 'e' is listed by no movie, missing values are not indicated
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b", "c", "e"])
+    assert indicators.values.tolist() == ["a", "b", "c", "e"]
+    np.testing.assert_array_equal(indicators.matrix.toarray(), [[1, 0, 1, 0], [0, 0, 0, 0], [1, 1, 0, 0],
+                                                                [0, 0, 0, 0], [0, 0, 0, 0]])
+    np.testing.assert_array_equal(indicators.counts(), [2, 1, 1, 0])
+    assert indicators.frequencies()["a"] == pytest.approx(0.4)
+
+
+def test_indicator_matrix_queries():
+    indicators = ma.build_indicator_matrix(genres_df(), "Movie genres", "genre", all_values=["a", "b", "c", "d"])
+    assert "a" in indicators and "z" not in indicators
+    np.testing.assert_array_equal(indicators.column("a"), [1, 0, 1, 0, 0])
+    codes, rows = indicators.nonzero(["c", "a"])
+    np.testing.assert_array_equal(codes, [0, 1, 1])
+    np.testing.assert_array_equal(rows, [0, 0, 2])
+    selected = indicators.select(["b", "a"])
+    assert selected.values.tolist() == ["b", "a"]
+    np.testing.assert_array_equal(selected.matrix.toarray()[2], [1, 1])
+    with pytest.raises(KeyError):
+        indicators.positions(["a", "z"])
+
+
+def test_append_indicator_columns_matches_the_matrix():
+    df = genres_df()
+    extended = ma.append_indicator_columns(df, {"a", "b", "c"}, "Movie genres", "genre")
+    assert extended["genre: a"].tolist() == [1, 0, 1, 0, 0]
+    assert extended["genre: c"].tolist() == [1, 0, 0, 0, 0]
+    assert "genre: None" not in extended
+
+
+def pairs_column() -> pd.Series:
+    return pd.Series(['{"/m/01": "Drama", "/m/02": "Comedy"}', "{}", None, '{"/m/03": null}',
+                      '{"/m/02": "Comedy"}'], index=[5, 6, 7, 8, 9])
+
+
+def test_freebase_pairs_of_a_json_column():
+    pairs = ma.FreebasePairs.from_column(pairs_column())
+    assert len(pairs) == 5
+    np.testing.assert_array_equal(pairs.lengths(), [2, 0, 0, 1, 1])
+    np.testing.assert_array_equal(pairs.rows(), [0, 0, 3, 4])
+    assert pairs.id_lists() == [["/m/01", "/m/02"], [], [], ["/m/03"], ["/m/02"]]
+    # JSON nulls are decoded as None, not as another value
+    assert pairs.value_lists() == [["Drama", "Comedy"], [], [], [None], ["Comedy"]]
+
+
+def test_freebase_pairs_fall_back_on_malformed_rows():
+    column = pd.Series(['{"/m/01": "Drama"}', '{"/m/04": "Rock "n" roll"}'])
+    pairs = ma.FreebasePairs.from_column(column)
+    assert pairs.id_lists()[0] == ["/m/01"]
+    assert pairs.value_lists()[0] == ["Drama"]
+    assert pairs.id_lists()[1] == ["/m/04"]
+
+
+def test_append_processed_columns_and_indicators_from_pairs():
+    df = pd.DataFrame({"Movie genres": pairs_column()})
+    pairs = ma.append_processed_columns(df, "Movie genres")
+    assert df["Movie genres: values"].tolist() == [["Drama", "Comedy"], [], [], [None], ["Comedy"]]
+    assert df["Movie genres: Freebase IDs"].tolist()[0] == ["/m/01", "/m/02"]
+
+    from_pairs = ma.build_indicator_matrix(df, "Movie genres", "genre", ["Comedy", "Drama"], pairs=pairs)
+    from_lists = ma.build_indicator_matrix(df, "Movie genres", "genre", ["Comedy", "Drama"])
+    np.testing.assert_array_equal(from_pairs.matrix.toarray(), [[1, 1], [0, 0], [0, 0], [0, 0], [1, 0]])
+    np.testing.assert_array_equal(from_pairs.matrix.toarray(), from_lists.matrix.toarray())
+    assert from_pairs.index.tolist() == [5, 6, 7, 8, 9]
+
+
+def metric_df() -> pd.DataFrame:
+    rng = np.random.default_rng(2)
+    nb_movies = 200
+    values = ["a", "b", "c", "d"]
+    lists = [list(rng.choice(values, rng.integers(0, 4), replace=False, p=[0.4, 0.3, 0.2, 0.1]))
+             for _ in range(nb_movies)]
+    df = pd.DataFrame({"Movie genres: values": lists, "rating": rng.normal(6, 1, nb_movies),
+                       "revenue": np.exp(rng.normal(16, 1, nb_movies))})
+    df.loc[df.index[::7], "rating"] = np.nan
+    return pd.concat([df, ma.build_indicator_matrix(df, "Movie genres", "genre", values).to_dataframe()], axis=1)
+
+
+def test_frequency_table_matches_pandas():
+    df = metric_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", ["a", "b", "c", "d"])
+    from_indicators = ma.frequency_table(df, ["a", "b", "c", "d"], "genre", ["rating"], indicators)
+    from_columns = ma.frequency_table(df, ["a", "b", "c", "d"], "genre", ["rating"])
+    pd.testing.assert_frame_equal(from_indicators, from_columns)
+    for val in ["a", "b", "c", "d"]:
+        listed = df[df[f"genre: {val}"] == 1]
+        assert from_columns.loc[val, "count"] == len(listed)
+        assert from_columns.loc[val, "share"] == pytest.approx(len(listed) / len(df))
+        assert from_columns.loc[val, "mean rating"] == pytest.approx(listed["rating"].mean())
+        assert from_columns.loc[val, "median rating"] == pytest.approx(listed["rating"].median())
+
+    assert ma.retrieve_n_most_frequent(df, 2, ["d", "c", "b", "a"], "genre") == ["a", "b"]
+    assert ma.retrieve_frequent(df, ["a", "b", "c", "d"], "genre", 0.2) == \
+        [val for val in "abcd" if df[f"genre: {val}"].mean() > 0.2]
+    ranked = ma.rank_values(df, ["a", "b", "c", "d"], "genre", "median rating", metrics=["rating"])
+    assert ranked["median rating"].is_monotonic_decreasing
+
+
+def test_frequency_table_cache_follows_changes():
+    df = metric_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", ["a", "b", "c", "d"])
+    table = ma.frequency_table(df, ["a", "b"], "genre", ["rating"], indicators)
+    assert ma.frequency_table(df, ["a", "b"], "genre", ["rating"], indicators) is table
+    df["rating"] = df["rating"] + 1
+    updated = ma.frequency_table(df, ["a", "b"], "genre", ["rating"], indicators)
+    np.testing.assert_allclose(updated["mean rating"], table["mean rating"] + 1)
+
+    # Indicator columns of the dataframe are read again at every call
+    assert ma.retrieve_n_most_frequent(df, 1, ["a", "b", "c", "d"], "genre") == ["a"]
+    df["genre: d"] = 1
+    assert ma.retrieve_n_most_frequent(df, 1, ["a", "b", "c", "d"], "genre") == ["d"]
+
+
+def test_spearman_correlations_match_scipy():
+    from scipy import stats
+
+    df = metric_df()
+    indicators = ma.IndicatorMatrix.from_columns(df, ["a", "b", "c", "d"], "genre")
+    table = ma.spearman_correlations(df, ["rating", "revenue"], indicators).set_index(["metric", "value"])
+    for metric in ["rating", "revenue"]:
+        rated = df.dropna(subset=[metric])
+        for val in ["a", "b", "c", "d"]:
+            expected = stats.spearmanr(rated[f"genre: {val}"], rated[metric])
+            assert table.loc[(metric, val), "rho"] == pytest.approx(expected.statistic)
+            assert table.loc[(metric, val), "pvalue"] == pytest.approx(expected.pvalue)
+            assert table.loc[(metric, val), "support"] == rated[f"genre: {val}"].sum()
+
+    propagated = ma.spearman_correlations(df, ["rating"], indicators, nan_policy='propagate')
+    assert propagated["rho"].isna().all()
+
+    pairs = ma.spearman_correlations(df, ["revenue"], indicators, pairwise=True)
+    for _, row in pairs.iterrows():
+        both = df[f"genre: {row['value']}"] * df[f"genre: {row['other value']}"]
+        assert row["support"] == both.sum()
+        assert row["rho"] == pytest.approx(stats.spearmanr(both, df["revenue"]).statistic)
+
+
+def test_adjust_pvalues_and_correlated_metadata():
+    pvalues = np.array([0.01, np.nan, 0.04, 0.03, 0.5])
+    np.testing.assert_allclose(ma.adjust_pvalues(pvalues, 'bonferroni'), [0.04, np.nan, 0.16, 0.12, 1.])
+    np.testing.assert_allclose(ma.adjust_pvalues(pvalues, 'fdr_bh'), [0.04, np.nan, 0.04 * 4 / 3, 0.04 * 4 / 3, 0.5])
+    with pytest.raises(ValueError):
+        ma.adjust_pvalues(pvalues, 'holm')
+
+    df = metric_df()
+    df["revenue"] += 1e7 * df["genre: a"]
+    correlated = ma.find_correlated_metadata(df, ["a", "b", "c", "d"], "revenue", "genre")
+    assert "a" in correlated
+    indicators = ma.IndicatorMatrix.from_columns(df, ["a", "b", "c", "d"], "genre")
+    assert ma.find_correlated_metadata(df, ["a", "b", "c", "d"], "revenue", "genre", indicators=indicators) == \
+        correlated
+
+
+def test_fast_linear_reg_matches_ols():
+    df = metric_df()
+    df["log revenue"] = np.log(df["revenue"])
+    values = ["a", "b", "c", "d"]
+    indicators = ma.IndicatorMatrix.from_columns(df, values, "genre")
+    results = ma.fast_linear_reg(df, ["rating", "log revenue"], "genre", values)
+    from_indicators = ma.fast_linear_reg(df, ["rating", "log revenue"], "genre", values, indicators)
+    for metric in ["rating", "log revenue"]:
+        pd.testing.assert_frame_equal(results[metric], from_indicators[metric])
+        rated = df.dropna(subset=[metric])
+        design = np.column_stack([np.ones(len(rated))] + [rated[f"genre: {val}"] for val in values])
+        coefs, _, _, _ = np.linalg.lstsq(design, rated[metric].to_numpy(), rcond=None)
+        assert results[metric].index.tolist() == ["Mean"] + values
+        np.testing.assert_allclose(results[metric]["coef"], coefs)
+
+    # Same estimates as the formula-based regression
+    ols = ma.linear_reg(df, "rating", "genre", values)
+    np.testing.assert_allclose(results["rating"]["coef"], ols.params.to_numpy())
+    np.testing.assert_allclose(results["rating"]["std err"], ols.bse.to_numpy())
+    np.testing.assert_allclose(results["rating"]["pvalue"], ols.pvalues.to_numpy())
+
+
+def test_fast_linear_reg_drops_constant_features():
+    df = metric_df()
+    df["genre: e"] = 0
+    results = ma.fast_linear_reg(df, ["revenue"], "genre", ["a", "e"])
+    assert results["revenue"].index.tolist() == ["Mean", "a"]
+
+
+def histogram_df() -> pd.DataFrame:
+    return pd.DataFrame({"Movie genres: values": [["a"], ["a", "b"], ["b"], ["a"], []],
+                         "revenue": [10., 1000., np.nan, 100., 5.],
+                         "rating": [5., 5., 5., np.nan, 8.]})
+
+
+def test_metadata_histograms_share_edges():
+    df = histogram_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b"])
+    edges, counts = ma.metadata_histograms(df, "genre", ["a", "b"], "revenue", bins=2, indicators=indicators)
+    np.testing.assert_allclose(edges, [10., 100., 1000.])
+    np.testing.assert_array_equal(counts, [[1, 2], [0, 1]])
+    for val, row in zip(["a", "b"], counts):
+        values = df["revenue"][indicators.column(val) == 1].dropna()
+        np.testing.assert_array_equal(row, np.histogram(np.log10(values), np.log10(edges))[0])
+
+
+def test_metadata_histograms_degenerate_ranges():
+    df = histogram_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b"])
+    # A single rating: range padded as in np.histogram
+    edges, counts = ma.metadata_histograms(df, "genre", ["a", "b"], "rating", bins=4, log_scale=False,
+                                           indicators=indicators)
+    np.testing.assert_allclose(edges, np.histogram([5.], 4)[1])
+    np.testing.assert_array_equal(counts.sum(axis=1), [2, 2])
+    assert np.all(np.diff(edges) > 0)
+    # No usable metric: default edges and zero counts
+    df["revenue"] = np.nan
+    edges, counts = ma.metadata_histograms(df, "genre", ["a", "b"], "revenue", bins=3, indicators=indicators)
+    assert len(edges) == 4 and not counts.any()
+
+
+def cube_df() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    nb_movies = 400
+    genres = [["a", "b"][:rng.integers(0, 3)] if rng.random() < 0.5 else ["b"] for _ in range(nb_movies)]
+    df = pd.DataFrame({"Movie release year": rng.integers(1990, 2000, nb_movies).astype(float),
+                       "averageRating": rng.normal(6, 1, nb_movies).round(1),
+                       "constant": np.full(nb_movies, 7.),
+                       "Movie genres: values": genres})
+    df.loc[df.index[::17], "averageRating"] = np.nan
+    df.loc[df.index[::23], "Movie release year"] = np.nan
+    return df
+
+
+def test_year_value_cube_matches_groupby():
+    df = cube_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b"])
+    cube = ma.YearValueCube(df, indicators, ["averageRating"])
+    exploded = df.explode("Movie genres: values")
+    for val in ["a", "b"]:
+        movies = exploded[exploded["Movie genres: values"] == val]
+        expected = movies.groupby("Movie release year")["averageRating"].agg(["count", "mean", "std"])
+        for stat in ["count", "mean", "std"]:
+            result = cube.frame("averageRating", stat, vals=[val])[val]
+            np.testing.assert_allclose(result.to_numpy(), expected[stat].to_numpy())
+    all_movies = df.groupby("Movie release year")["averageRating"].mean()
+    np.testing.assert_allclose(cube.frame("averageRating", vals=["All"])["All"].to_numpy(), all_movies.to_numpy())
+
+    rolling = cube.rolling("averageRating", 3, "sum", vals=["b"], start=1995)["b"]
+    sums = exploded[exploded["Movie genres: values"] == "b"].groupby("Movie release year")["averageRating"].sum()
+    assert rolling.index.tolist() == list(range(1995, 2000))
+    assert rolling[1997] == pytest.approx(sums.loc[1995:1997].sum())
+
+    median = cube.summary("averageRating")["quantile 0.5"]["All"]
+    assert median == pytest.approx(df["averageRating"].median(), abs=0.1)
+
+
+def test_year_value_cube_errors_and_constant_metric():
+    df = cube_df()
+    indicators = ma.build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b"])
+    cube = ma.YearValueCube(df, indicators, ["averageRating", "constant"])
+    with pytest.raises(KeyError):
+        cube.frame("averageRating", vals=["Dramma"])
+    with pytest.raises(KeyError):
+        cube.rolling("averageRating", 2, vals=["Dramma"])
+    with pytest.raises(ValueError):
+        cube.rolling("averageRating", 0)
+
+    assert (cube.frame("constant", "mean")["All"] == 7).all()
+    np.testing.assert_allclose(cube.frame("constant", 0.5)["b"], 7)
+    rolling = cube.rolling("constant", 1, "count")
+    np.testing.assert_array_equal(rolling.to_numpy(), cube.frame("constant", "count").to_numpy())
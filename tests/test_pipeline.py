@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import Pipeline, canonical_repr  # noqa: E402
+
+
+def make_movies(nb_movies: int) -> pd.DataFrame:
+    return pd.DataFrame({"id": range(nb_movies), "genres": [["a", "b"][:i % 3] for i in range(nb_movies)]})
+
+
+def count_genres(movies: pd.DataFrame, genre: str) -> int:
+    return int(movies["genres"].map(lambda genres: genre in genres).sum())
+
+
+def add_double(movies: pd.DataFrame) -> None:
+    movies["double"] = movies["id"] * 2
+
+
+def read_file(path: str) -> str:
+    with open(path) as file:
+        return file.read()
+
+
+def fail(movies: pd.DataFrame):
+    raise ValueError("Failing stage")
+
+
+def build_pipeline(cache_dir, nb_movies=10) -> Pipeline:
+    pipeline = Pipeline(str(cache_dir))
+    pipeline.add("movies", make_movies, params=dict(nb_movies=nb_movies))
+    pipeline.add("doubled", add_double, inputs=["movies"], in_place=True)
+    for genre in ["a", "b"]:
+        pipeline.add(f"count {genre}", count_genres, inputs=["doubled"], params=dict(genre=genre))
+    return pipeline
+
+
+def test_canonical_repr_does_not_depend_on_order():
+    assert canonical_repr({"b": {2, 1}, "a": [1, (2, 3)]}) == canonical_repr({"a": [1, (2, 3)], "b": {1, 2}})
+    assert canonical_repr(pd.Series([1, 2])) == canonical_repr(pd.Series([1, 2]))
+    assert canonical_repr(pd.Series([1, 2])) != canonical_repr(pd.Series([1, 3]))
+
+
+def test_keys_follow_parameters_and_inputs(tmp_path):
+    keys = build_pipeline(tmp_path).keys()
+    assert keys == build_pipeline(tmp_path).keys()
+    changed = build_pipeline(tmp_path, nb_movies=11).keys()
+    assert all(changed[name] != keys[name] for name in keys)
+
+    pipeline = build_pipeline(tmp_path)
+    pipeline.add("count b", count_genres, inputs=["doubled"], params=dict(genre="c"))
+    changed = pipeline.keys()
+    assert [name for name in keys if changed[name] != keys[name]] == ["count b"]
+
+
+def test_keys_follow_read_files(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("first")
+    pipeline = Pipeline(str(tmp_path / "cache"))
+    pipeline.add("text", read_file, params=dict(path=str(path)), files=[str(path)])
+    key = pipeline.keys()["text"]
+    assert pipeline.load("text") == "first"
+    path.write_text("second version")
+    assert pipeline.keys()["text"] != key
+    assert pipeline.load("text") == "second version"
+
+
+@pytest.mark.parametrize("n_workers", [0, 2])
+def test_run_caches_outputs(tmp_path, capsys, n_workers):
+    outputs = build_pipeline(tmp_path).run(n_workers=n_workers)
+    assert "0 stages cached, 4 to run" in capsys.readouterr().out
+    assert outputs["count a"] == 6 and outputs["count b"] == 3
+    assert outputs["doubled"]["double"].tolist() == list(range(0, 20, 2))
+    assert outputs["doubled"]["genres"].tolist()[:3] == [[], ["a"], ["a", "b"]]
+
+    cached = build_pipeline(tmp_path).run(["count a"], n_workers=n_workers)
+    assert "3 stages cached, 0 to run" in capsys.readouterr().out
+    assert cached == {"count a": 6}
+
+    pipeline = build_pipeline(tmp_path)
+    pipeline.add("count b", count_genres, inputs=["doubled"], params=dict(genre="c"))
+    assert pipeline.run(n_workers=n_workers)["count b"] == 0
+    assert "3 stages cached, 1 to run" in capsys.readouterr().out
+    assert pipeline.prune() == 1
+
+
+def test_failing_stage(tmp_path):
+    pipeline = build_pipeline(tmp_path)
+    pipeline.add("fail", fail, inputs=["movies"])
+    with pytest.raises(ValueError):
+        pipeline.add("orphan", fail, inputs=["missing"])
+    with pytest.raises(RuntimeError, match="Stage fail failed"):
+        pipeline.run(n_workers=2)
@@ -0,0 +1,170 @@
+import gzip
+import os
+import sys
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plots_analysis  # noqa: E402
+from plots_analysis import LemmaCorpus  # noqa: E402
+
+
+def corenlp_xml(tokens) -> str:
+    xml_tokens = "".join(f"<token><word>{lemma.title()}</word><lemma>{lemma}</lemma><POS>{pos}</POS></token>"
+                         for lemma, pos in tokens)
+    return f"<root><document><sentences><sentence><tokens>{xml_tokens}</tokens></sentence></sentences></document>" \
+        "</root>"
+
+
+def write_corenlp_files(directory, monkeypatch):
+    monkeypatch.setattr(plots_analysis, "subpath", str(directory) + "/")
+    files = {1: [("the", "DT"), ("soldier", "NN"), ("fight", "VBZ"), ("bravely", "RB"), ("red", "JJ")],
+             2: [("she", "PRP"), ("love", "VBZ"), ("Paris", "NNP")]}
+    for wiki_id, tokens in files.items():
+        with gzip.open(directory / f"{wiki_id}.xml.gz", "wt", encoding="utf-8") as file:
+            file.write(corenlp_xml(tokens))
+
+
+def test_important_lemmas_batch(tmp_path, monkeypatch, capsys):
+    write_corenlp_files(tmp_path, monkeypatch)
+    cache_file = str(tmp_path / "cache" / "lemmas.pkl")
+    expected = {1: ["soldier", "fight", "bravely"], 2: ["love", "Paris"], 3: []}
+
+    assert plots_analysis.get_important_lemmas(1) == expected[1]
+    assert plots_analysis.get_important_lemmas_batch([1, 2, 3], n_workers=0, cache_file=cache_file) == expected
+    assert "1 missing files, 0 cached, 2 parsed" in capsys.readouterr().out
+    assert plots_analysis.get_important_lemmas_batch([1, 2, 3], n_workers=0, cache_file=cache_file) == expected
+    assert "1 missing files, 2 cached, 0 parsed" in capsys.readouterr().out
+    assert plots_analysis.get_important_lemmas_batch([2, 1], n_workers=2, cache_file=None, verbose=False) == \
+        {2: expected[2], 1: expected[1]}
+
+
+lemmas = [["war", "soldier", "war", "love"], [], ["love", "city"], ["soldier", "city", "city", "war"]]
+movie_ids = [10, 20, 30, 40]
+
+
+def corpus() -> LemmaCorpus:
+    return LemmaCorpus.from_lemmas(movie_ids, lemmas)
+
+
+def expected_counts(lemma_lists, vocabulary) -> np.ndarray:
+    counts = np.zeros((len(lemma_lists), len(vocabulary)))
+    for row, movie_lemmas in enumerate(lemma_lists):
+        for lemma in movie_lemmas:
+            counts[row, list(vocabulary).index(lemma)] += 1
+    return counts
+
+
+def test_round_trip_and_subset(tmp_path):
+    lemma_corpus = corpus()
+    assert lemma_corpus.to_lemma_lists() == lemmas
+    subset = lemma_corpus.subset([40, 99, 10])
+    assert subset.ids().tolist() == [40, 10]
+    assert subset.to_lemma_lists() == [lemmas[3], lemmas[0]]
+
+    subset.save(str(tmp_path))
+    loaded = LemmaCorpus.load(str(tmp_path))
+    assert loaded.ids().tolist() == [40, 10]
+    assert loaded.to_lemma_lists() == [lemmas[3], lemmas[0]]
+
+
+def test_count_matrix_leaves_corpus_unchanged():
+    lemma_corpus = corpus()
+    token_ids, offsets = lemma_corpus.token_ids.copy(), lemma_corpus.offsets.copy()
+    counts = lemma_corpus.count_matrix()
+    np.testing.assert_array_equal(counts.toarray(), expected_counts(lemmas, lemma_corpus.vocabulary))
+    np.testing.assert_array_equal(lemma_corpus.token_ids, token_ids)
+    np.testing.assert_array_equal(lemma_corpus.offsets, offsets)
+    assert lemma_corpus.to_lemma_lists() == lemmas
+
+    subset = lemma_corpus.subset([30, 10])
+    np.testing.assert_array_equal(subset.count_matrix().toarray(),
+                                  expected_counts([lemmas[2], lemmas[0]], lemma_corpus.vocabulary))
+
+
+def test_count_matrix_of_memory_mapped_corpus(tmp_path):
+    corpus().save(str(tmp_path))
+    loaded = LemmaCorpus.load(str(tmp_path), mmap=True)
+    counts = loaded.count_matrix()
+    np.testing.assert_array_equal(counts.toarray(), expected_counts(lemmas, loaded.vocabulary))
+    assert loaded.to_lemma_lists() == lemmas
+
+
+def test_term_topic_matrix_of_sparse_tfidf():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    rng = np.random.default_rng(5)
+    vocabulary = [f"lemma{code}" for code in range(30)]
+    plot_lemmas = [list(rng.choice(vocabulary, 12)) for _ in range(25)]
+    df = pd.DataFrame({"Wikipedia movie ID": np.arange(25), "important_lemmas": plot_lemmas})
+
+    term_topic_matrix, singular_values = plots_analysis.get_term_topic_matrix(df, nbr_topics=3, algorithm='arpack')
+    dense = TfidfVectorizer(tokenizer=lambda x: x, lowercase=False, token_pattern=None).fit_transform(plot_lemmas)
+    np.testing.assert_allclose(singular_values, np.linalg.svd(dense.toarray(), compute_uv=False)[:3])
+    assert term_topic_matrix.shape == (len(set(chain.from_iterable(plot_lemmas))), 3)
+    assert term_topic_matrix.columns.tolist() == ["topic 0", "topic 1", "topic 2"]
+
+    corpus_matrix, corpus_values = plots_analysis.get_term_topic_matrix(
+        LemmaCorpus.from_lemmas(df["Wikipedia movie ID"], plot_lemmas), nbr_topics=3, algorithm='arpack')
+    np.testing.assert_allclose(corpus_values, singular_values)
+    np.testing.assert_allclose(np.abs(corpus_matrix.loc[term_topic_matrix.index].to_numpy()),
+                               np.abs(term_topic_matrix.to_numpy()), atol=1e-10)
+
+
+def test_segments_term_topic_matrices():
+    rng = np.random.default_rng(0)
+    vocabulary = [f"lemma{code}" for code in range(40)]
+    df = pd.DataFrame({"Wikipedia movie ID": np.arange(60) * 10,
+                       "important_lemmas": [list(rng.choice(vocabulary, 15)) for _ in range(60)]})
+    segments = {("a", "rating", "succ"): df.iloc[:30], ("a", "rating", "fail"): df["Wikipedia movie ID"][25:55],
+                ("b", "rating", "succ"): [0, 10, 20, 30, 40, 999]}
+    in_process = plots_analysis.get_segments_term_topic_matrices(df, segments, nbr_topics=2, m_words=3, n_workers=0)
+    in_pool = plots_analysis.get_segments_term_topic_matrices(df, segments, nbr_topics=2, m_words=3, n_workers=2)
+    assert list(in_process) == list(segments)
+    for key, (term_topic_matrix, singular_values, top_words) in in_process.items():
+        pd.testing.assert_frame_equal(term_topic_matrix, in_pool[key][0])
+        np.testing.assert_allclose(singular_values, in_pool[key][1])
+        assert term_topic_matrix.shape[1] == 2 and len(top_words) == 2 and len(top_words[0]) == 3
+        assert singular_values[0] >= singular_values[1]
+    # Terms of a segment are those used by its movies
+    segment_terms = set(chain.from_iterable(df["important_lemmas"].iloc[:5]))
+    assert set(in_process[("b", "rating", "succ")][0].index) == segment_terms
+
+
+def segmentation_df() -> pd.DataFrame:
+    rng = np.random.default_rng(3)
+    nb_movies = 150
+    df = pd.DataFrame({"Wikipedia movie ID": np.arange(nb_movies), "rating": rng.normal(6, 1, nb_movies).round(1)})
+    for val, share in [("a", 0.5), ("b", 0.2), ("c", 0.)]:
+        df[f"genre: {val}"] = (rng.random(nb_movies) < share).astype(int)
+    df.loc[df.index[::9], "rating"] = np.nan
+    return df
+
+
+def test_grouped_quantiles_match_pandas():
+    from metadata_analysis import grouped_quantiles
+
+    rng = np.random.default_rng(4)
+    codes = rng.integers(0, 4, 100)
+    values = rng.normal(size=100)
+    values[::11] = np.nan
+    for q in [0., 0.1, 0.5, 0.9, 1.]:
+        expected = pd.Series(values).groupby(codes).quantile(q).reindex(range(5))
+        np.testing.assert_allclose(grouped_quantiles(codes, values, 5, q), expected.to_numpy())
+
+
+def test_find_more_or_less_successful_matches_brute_force():
+    df = segmentation_df()
+    segments = plots_analysis.find_more_or_less_successful_wrt(df, "rating", ["a", "b", "c"], "genre", 0.1, 0.9)
+    for val in ["a", "b", "c"]:
+        listed = df[df[f"genre: {val}"] == 1]
+        low, high = listed["rating"].quantile(0.1), listed["rating"].quantile(0.9)
+        less, more = segments[val]
+        assert df.index[less].tolist() == listed.index[listed["rating"] <= low].tolist()
+        assert df.index[more].tolist() == listed.index[listed["rating"] >= high].tolist()
+
+    as_dataframes = plots_analysis.find_more_or_less_successful_wrt(df, "rating", ["b"], "genre", as_dataframes=True)
+    pd.testing.assert_frame_equal(as_dataframes["b"][1], df.iloc[segments["b"][1]])
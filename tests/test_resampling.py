@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_analysis import build_indicator_matrix  # noqa: E402
+from resampling import bootstrap_effects, permutation_effects  # noqa: E402
+
+
+def effects_data():
+    rng = np.random.default_rng(1)
+    nb_movies = 300
+    genres = [list(rng.choice(["a", "b", "c"], rng.integers(0, 3), replace=False)) for _ in range(nb_movies)]
+    df = pd.DataFrame({"Movie genres: values": genres, "rating": rng.normal(6, 1, nb_movies)})
+    df["rating"] += 0.8 * df["Movie genres: values"].map(lambda values: "a" in values)
+    # The only movies listing 'd' have no rating
+    df.loc[[0, 1], "Movie genres: values"] = pd.Series([["d"], ["d"]], index=[0, 1])
+    df.loc[[0, 1], "rating"] = np.nan
+    return df, build_indicator_matrix(df, "Movie genres", "genre", all_values=["a", "b", "c", "d"])
+
+
+def test_observed_effects_match_brute_force():
+    df, indicators = effects_data()
+    table = permutation_effects(df, "rating", indicators, n_permutations=50, n_workers=0)
+    rated = df.dropna(subset=["rating"])
+    for val in ["a", "b", "c"]:
+        listed = rated["Movie genres: values"].map(lambda values: val in values).to_numpy()
+        rho = stats.spearmanr(listed, rated["rating"]).statistic
+        difference = rated["rating"][listed].mean() - rated["rating"][~listed].mean()
+        assert table.loc[val, "rho"] == pytest.approx(rho)
+        assert table.loc[val, "mean difference"] == pytest.approx(difference)
+    assert table.loc["a", "rho pvalue"] == pytest.approx(1 / 51)
+    assert table.loc["a", "mean difference pvalue"] == pytest.approx(1 / 51)
+
+
+def test_undefined_statistics_have_no_pvalue():
+    df, indicators = effects_data()
+    table = permutation_effects(df, "rating", indicators, n_permutations=50, n_workers=0)
+    assert np.isnan(table.loc["d", "rho"]) and np.isnan(table.loc["d", "rho pvalue"])
+    assert np.isnan(table.loc["d", "mean difference pvalue"])
+    assert table[["rho pvalue", "mean difference pvalue"]].loc[["a", "b", "c"]].notna().all().all()
+
+
+def test_bootstrap_intervals_do_not_depend_on_workers():
+    df, indicators = effects_data()
+    in_process = bootstrap_effects(df, "rating", indicators, n_replicates=200, batch_size=32, n_workers=0)
+    in_pool = bootstrap_effects(df, "rating", indicators, n_replicates=200, batch_size=32, n_workers=2)
+    pd.testing.assert_frame_equal(in_process, in_pool)
+    assert (in_process.loc[["a", "b", "c"], "rho low"] <= in_process.loc[["a", "b", "c"], "rho"]).all()
+    assert (in_process.loc[["a", "b", "c"], "rho high"] >= in_process.loc[["a", "b", "c"], "rho"]).all()
+    assert in_process.loc["a", "mean difference low"] > 0
+
+
+def test_at_least_one_resample():
+    df, indicators = effects_data()
+    with pytest.raises(ValueError):
+        bootstrap_effects(df, "rating", indicators, n_replicates=0, n_workers=0)
+    with pytest.raises(ValueError):
+        permutation_effects(df, "rating", indicators, n_permutations=0, n_workers=0)
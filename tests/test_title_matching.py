@@ -0,0 +1,77 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from title_matching import adjust_for_inflation, fill_box_office_revenue, match_imdb_titles, match_titles, \
+    normalize_titles, trigram_signatures, trigram_similarity  # noqa: E402
+
+
+def test_normalize_titles():
+    titles = pd.Series(["The Matrix", "Matrix, The", "Amélie (2001)", "Rocky II", "Fast & Furious",
+                        "Star Wars: Episode IV - A New Hope", "Kill Bill: Vol. 1", None], index=list("abcdefgh"))
+    normalized = normalize_titles(titles)
+    assert list(normalized.index) == list("abcdefgh")
+    assert list(normalized["title"]) == ["matrix", "matrix", "amelie", "rocky 2", "fast and furious",
+                                         "star wars episode 4 a new hope", "kill bill vol 1", ""]
+    assert list(normalized["main title"]) == ["matrix", "matrix", "amelie", "rocky 2", "fast and furious",
+                                              "star wars", "kill bill", ""]
+
+
+def test_trigram_signatures_estimate_similarity():
+    titles = np.array(["matrix", "matrix", "the matrix reloaded", "", "casablanca"])
+    signatures = trigram_signatures(titles, nb_hashes=64)
+    assert (signatures[0] == signatures[1]).all()
+    assert (signatures[3] == -1).all()
+    similarity = trigram_similarity(titles[[0, 0]], titles[[2, 4]])
+    estimated = (signatures[0] == signatures[[2, 4]]).mean(axis=1)
+    assert similarity[1] == 0 and estimated[1] == 0
+    assert abs(estimated[0] - similarity[0]) < 0.2
+
+
+def test_match_titles():
+    left = pd.Series(["The Matrix", "Rocky II", "Casablanca", "Unknown film", "Star Wars"], index=[10, 11, 12, 13, 14])
+    left_years = pd.Series([1999, 1979, 1942, 2000, np.nan], index=left.index)
+    right = pd.DataFrame({"primary": ["Matrix", "Rocky 2", "Casablanka", "Star Wars", "Matrix"],
+                          "original": ["The Matrix", "Rocky II", "Casablanca", "Star Wars", "Matrix"]},
+                         index=["m", "r", "c", "s", "m2"])
+    right_years = pd.Series([1999, 1980, 1942, 1977, 2021], index=right.index)
+    matches = match_titles(left, left_years, right, right_years)
+    assert list(matches["left"]) == [10, 11, 12]
+    assert list(matches["right"]) == ["m", "r", "c"]
+    assert np.allclose(matches["confidence"], [1, 0.95, 1])
+
+    # Only the primary titles: the misspelt title is matched on its trigrams
+    matches = match_titles(left, left_years, right["primary"], right_years, min_confidence=0.5)
+    assert matches.set_index("left")["method"].to_dict() == {10: "title", 11: "title", 12: "trigrams"}
+    assert 0.5 <= matches["confidence"].iloc[2] < 1
+
+    # Without one-to-one matching, several left movies may match the same right movie
+    twice = pd.Series(["Matrix", "The Matrix"], index=[0, 1])
+    assert len(match_titles(twice, pd.Series([1999, 1999]), right, right_years)) == 1
+    assert len(match_titles(twice, pd.Series([1999, 1999]), right, right_years, one_to_one=False)) == 2
+
+
+def test_match_imdb_titles_and_fill_box_office():
+    movies = pd.DataFrame({"Movie name": ["The Matrix", "Casablanca", "Unknown film"],
+                           "Movie release year": [1999, 1942, 2000],
+                           "Movie box office revenue": [np.nan, 1e6, np.nan]}, index=[5, 6, 7])
+    imdb = pd.DataFrame({"tconst": ["tt1", "tt2"], "primaryTitle": ["Casablanca", "The Matrix"],
+                         "originalTitle": ["Casablanca", "The Matrix"], "startYear": [1942, 1999]})
+    joined = match_imdb_titles(movies, imdb)
+    assert list(joined.index) == [5, 6, 7]
+    assert joined["tconst"].tolist()[:2] == ["tt2", "tt1"] and pd.isna(joined.loc[7, "tconst"])
+    assert joined["IMDb match confidence"].tolist()[:2] == [1, 1]
+
+    boxoffice = pd.DataFrame({"title": ["Matrix, The", "Casablanca"], "year": [1999, 1942],
+                              "lifetime_gross": [2e8, 5e6]})
+    cpi = pd.Series([100., 200.], index=pd.Index([1999, 2020], name="year"))
+    filled = fill_box_office_revenue(movies, boxoffice)
+    assert filled["Movie box office revenue"].tolist()[:2] == [2e8, 1e6]
+    assert filled.loc[5, "Box office match confidence"] == 1 and pd.isna(filled.loc[6, "Box office match confidence"])
+    assert movies["Movie box office revenue"].isna().sum() == 2
+    adjusted = adjust_for_inflation(filled["Movie box office revenue"], filled["Movie release year"], cpi=cpi)
+    assert adjusted[5] == 4e8 and np.isnan(adjusted[6])
@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+from base_imports import np, pd, LazyModule
+
+pa = LazyModule("pyarrow")
+
+inflation_path = "data/inflation_yearly_usa.csv"
+
+roman_numerals = {"ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9",
+                  "x": "10", "xi": "11", "xii": "12"}
+
+# Confidence of a match on the normalized title, and on the main title only (title without its subtitle).
+# Other candidates are scored by the Jaccard similarity of the character trigrams of their titles.
+title_confidence = 1.0
+main_title_confidence = 0.9
+# Confidence lost per year of difference between the release years
+year_penalty = 0.05
+
+# Blocking keys, from the most to the least specific
+blocking_methods = ["title", "main title", "trigrams"]
+
+# Mersenne prime modulo of the min-hash functions
+minhash_prime = (1 << 31) - 1
+
+
+def words_of_titles(titles: pd.Series) -> pd.Series:
+    """
+    :param titles: Series of lowercase ascii titles
+    :return: the words of the titles separated by single spaces, without leading article,
+             roman numerals being replaced by numbers
+    """
+    words = titles.str.replace(r"[^a-z0-9]+", " ", regex=True).str.strip()
+    words = words.str.replace(r"^(?:the|a|an)\s+", "", regex=True)
+    has_numeral = words.str.contains(r"\b(?:" + "|".join(roman_numerals) + r")\b", regex=True).to_numpy()
+    numerals = words[has_numeral]
+    for numeral, number in roman_numerals.items():
+        numerals = numerals.str.replace(rf"\b{numeral}\b", number, regex=True)
+    words[has_numeral] = numerals
+    return words
+
+
+def normalize_titles(titles: pd.Series) -> pd.DataFrame:
+    """
+    Normalize titles so that variants of the same title compare equal: accents, case, punctuation,
+    leading or trailing articles, '&', roman numerals and trailing years in parentheses are normalized.
+    :param titles: Series of titles
+    :return: dataframe with the same index and columns 'title', the normalized title,
+             and 'main title', the normalized title without its subtitle or episode number
+    """
+    codes, uniques = pd.factorize(titles.fillna("").astype(str))
+    unique_titles = pd.Series(uniques, dtype="str").str.normalize("NFKD").str.lower()
+    unique_titles = unique_titles.str.replace(r"[^\x00-\x7f]", "", regex=True)
+    unique_titles = unique_titles.str.replace(r"\s*\(\d{4}\)\s*$", "", regex=True)
+    unique_titles = unique_titles.str.replace(r",\s*(?:the|a|an)\s*$", "", regex=True)
+    unique_titles = unique_titles.str.replace("&", " and ", regex=False).str.replace(r"['`]", "", regex=True)
+
+    has_subtitle = unique_titles.str.contains(r":|\s-\s|\(", regex=True).to_numpy()
+    main_titles = unique_titles[has_subtitle].str.replace(r"(?::|\s-\s|\().*$", "", regex=True)
+    normalized = pd.DataFrame({"title": words_of_titles(unique_titles)})
+    normalized["main title"] = normalized["title"]
+    normalized.loc[has_subtitle, "main title"] = words_of_titles(main_titles)
+
+    has_episode = normalized["main title"].str.contains(r"\b(?:episode|part|chapter|vol|volume)\s+\d+$",
+                                                        regex=True).to_numpy()
+    normalized.loc[has_episode, "main title"] = normalized.loc[has_episode, "main title"].str.replace(
+        r"\s*\b(?:episode|part|chapter|vol|volume)\s+\d+$", "", regex=True)
+    return normalized.iloc[codes].set_axis(titles.index)
+
+
+def trigram_signatures(titles: np.ndarray, nb_hashes=6, seed=0) -> np.ndarray:
+    """
+    Min-hash signatures of the sets of character trigrams of titles, computed over all titles at once:
+    titles with similar trigrams are likely to share signature values.
+    :param titles: array of normalized (ascii) titles
+    :param nb_hashes: number of hash functions
+    :param seed: int, seed of the hash functions
+    :return: titles x nb_hashes int64 array, -1 for titles without trigrams
+    """
+    codes, titles = pd.factorize(titles)
+    padded = pa.array(" " + pd.Series(titles, dtype="str") + " ", type=pa.large_string())
+    _, offsets, data = padded.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[padded.offset:padded.offset + len(padded) + 1]
+    chars = np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]].astype(np.int64)
+    offsets = offsets - offsets[0]
+    title_of_char = np.repeat(np.arange(len(titles)), np.diff(offsets))
+    valid = title_of_char[:-2] == title_of_char[2:]
+    trigrams = ((chars[:-2] << 16) | (chars[1:-1] << 8) | chars[2:])[valid]
+    title_of_trigram = title_of_char[:-2][valid]
+
+    signatures = np.full((len(titles), nb_hashes), -1, dtype=np.int64)
+    if len(trigrams) == 0:
+        return signatures[codes]
+    starts = np.flatnonzero(np.diff(title_of_trigram, prepend=-1))
+    rng = np.random.default_rng(seed)
+    coefficients = rng.integers(1, minhash_prime, size=nb_hashes)
+    offsets = rng.integers(0, minhash_prime, size=nb_hashes)
+    for n in range(nb_hashes):
+        hashes = (coefficients[n] * trigrams + offsets[n]) % minhash_prime
+        signatures[title_of_trigram[starts], n] = np.minimum.reduceat(hashes, starts)
+    return signatures[codes]
+
+
+def trigram_similarity(titles_a: np.ndarray, titles_b: np.ndarray) -> np.ndarray:
+    """
+    :param titles_a: array of normalized titles
+    :param titles_b: array of normalized titles, same length
+    :return: Jaccard similarity of the sets of character trigrams of each pair of titles
+    """
+    trigram_sets = {}
+
+    def trigrams(title):
+        if title not in trigram_sets:
+            padded = f" {title} "
+            trigram_sets[title] = {padded[i:i + 3] for i in range(len(padded) - 2)}
+        return trigram_sets[title]
+
+    similarities = np.empty(len(titles_a))
+    for i, (title_a, title_b) in enumerate(zip(titles_a, titles_b)):
+        set_a, set_b = trigrams(title_a), trigrams(title_b)
+        union = len(set_a | set_b)
+        similarities[i] = len(set_a & set_b) / union if union else 0.
+    return similarities
+
+
+def blocking_keys(normalized: pd.DataFrame, years: np.ndarray, nb_hashes: int, rows_per_band: int) -> pd.DataFrame:
+    """
+    Blocking keys of titles: the normalized title, the main title and bands of the trigram signature,
+    all hashed to 64-bit integers so that candidates are found by integer hash joins
+    :param normalized: output of normalize_titles
+    :param years: release year of each title
+    :param nb_hashes: number of min-hash functions
+    :param rows_per_band: number of min-hash values per band
+    :return: dataframe with columns 'position' (of the title), 'method' (index in blocking_methods),
+             'key' and 'year'
+    """
+    positions = np.arange(len(normalized))
+    keys = []
+    for method, col in enumerate(["title", "main title"]):
+        titles = normalized[col].to_numpy()
+        non_empty = normalized[col].to_numpy(dtype=bool)
+        keys.append(pd.DataFrame({"position": positions[non_empty], "method": method,
+                                  "key": pd.util.hash_array(titles[non_empty]), "year": years[non_empty]}))
+
+    signatures = trigram_signatures(normalized["title"].to_numpy(), nb_hashes)
+    has_signature = signatures[:, 0] >= 0
+    signatures = signatures.astype(np.uint64)
+    for band in range(nb_hashes // rows_per_band):
+        band_key = np.full(len(signatures), band, dtype=np.uint64)
+        for n in range(band * rows_per_band, (band + 1) * rows_per_band):
+            band_key = band_key * np.uint64(minhash_prime) ^ signatures[:, n]
+        keys.append(pd.DataFrame({"position": positions[has_signature], "method": blocking_methods.index("trigrams"),
+                                  "key": band_key[has_signature], "year": years[has_signature]}))
+
+    keys = pd.concat(keys, ignore_index=True)
+    return keys[~np.isnan(keys["year"].to_numpy())]
+
+
+def match_titles(left_titles: pd.Series, left_years: pd.Series, right_titles: pd.Series | pd.DataFrame,
+                 right_years: pd.Series, year_tolerance=1, min_confidence=0.8, one_to_one=True, nb_hashes=6,
+                 rows_per_band=2, max_block_size=50) -> pd.DataFrame:
+    """
+    Match two lists of movies on their titles and release years. Candidates are generated by hash joins on
+    (release year +- year_tolerance, blocking key), the keys being the normalized title, the main title and bands
+    of a min-hash signature of the title trigrams, so only candidates sharing a block are scored instead of
+    all pairs. Movies without release year are not matched.
+    :param left_titles: Series of titles, with unique index
+    :param left_years: Series of release years, same index
+    :param right_titles: Series of titles with unique index, or dataframe of several title columns
+                         (e.g. 'primaryTitle' and 'originalTitle'), any of which may match
+    :param right_years: Series of release years, same index
+    :param year_tolerance: maximal difference between the release years of matched movies
+    :param min_confidence: matches with a lower confidence are dropped
+    :param one_to_one: if True, a right movie is matched at most once, to the left movie with the best confidence
+    :param nb_hashes: number of min-hash functions of the trigram signature
+    :param rows_per_band: number of min-hash values per blocking key, higher means fewer and closer candidates
+    :param max_block_size: trigram blocks with more right movies per year are ignored, as too unspecific
+    :return: dataframe with columns 'left' and 'right' (index labels of the matched movies), 'confidence'
+             in [0, 1] and 'method', the blocking key that produced the match
+    """
+    right_titles = right_titles.to_frame() if isinstance(right_titles, pd.Series) else right_titles
+    right_positions = np.tile(np.arange(len(right_titles)), right_titles.shape[1])
+    right_stacked = pd.concat([right_titles[col] for col in right_titles], ignore_index=True)
+    # Alternative titles equal to the first title, e.g. most IMDb original titles, add no candidates
+    distinct = ~pd.DataFrame({"position": right_positions, "title": right_stacked}).duplicated().to_numpy()
+    right_positions, right_stacked = right_positions[distinct], right_stacked[distinct].reset_index(drop=True)
+
+    left_normalized = normalize_titles(left_titles)
+    right_normalized = normalize_titles(right_stacked)
+    left_keys = blocking_keys(left_normalized, pd.to_numeric(left_years).to_numpy(dtype=np.float64),
+                              nb_hashes, rows_per_band)
+    right_keys = blocking_keys(right_normalized, pd.to_numeric(right_years).to_numpy(dtype=np.float64)[right_positions],
+                               nb_hashes, rows_per_band)
+    right_keys = right_keys.assign(position=right_positions[right_keys["position"]], stacked=right_keys["position"])
+    right_keys = right_keys.drop_duplicates(subset=["position", "method", "key"])
+
+    block_sizes = right_keys.groupby(["key", "year"])["position"].transform("size")
+    trigrams_method = blocking_methods.index("trigrams")
+    right_keys = right_keys[(right_keys["method"] != trigrams_method) | (block_sizes <= max_block_size)]
+
+    shifted = [left_keys.assign(year=left_keys["year"] + shift, shift=abs(shift))
+               for shift in range(-year_tolerance, year_tolerance + 1)]
+    candidates = pd.concat(shifted, ignore_index=True).merge(right_keys, on=["method", "key", "year"],
+                                                             suffixes=("", " right"))
+
+    # A pair found through several blocking keys is kept once, with the most specific key
+    candidates = candidates.sort_values("method", kind="stable").drop_duplicates(subset=["position", "position right"],
+                                                                                 ignore_index=True)
+
+    confidence = pd.Series(title_confidence, index=candidates.index)
+    confidence[candidates["method"] == blocking_methods.index("main title")] = main_title_confidence
+    same_title = left_normalized["title"].to_numpy()[candidates["position"]] \
+        == right_normalized["title"].to_numpy()[candidates["stacked"]]
+    scored = candidates["method"] == trigrams_method
+    confidence[scored] = trigram_similarity(left_normalized["title"].to_numpy()[candidates["position"][scored]],
+                                            right_normalized["title"].to_numpy()[candidates["stacked"][scored]])
+    confidence[same_title] = title_confidence
+    candidates["confidence"] = confidence.to_numpy() - year_penalty * candidates["shift"]
+
+    matches = candidates[candidates["confidence"] >= min_confidence]
+    matches = matches.sort_values(["confidence", "shift", "position", "position right"],
+                                  ascending=[False, True, True, True], kind="stable")
+    matches = matches.drop_duplicates(subset="position")
+    if one_to_one:
+        matches = matches.drop_duplicates(subset="position right")
+
+    matches = pd.DataFrame({"left": left_titles.index[matches["position"]],
+                            "right": right_titles.index[matches["position right"]],
+                            "confidence": matches["confidence"].to_numpy(),
+                            "method": np.array(blocking_methods)[matches["method"]]})
+    return matches.sort_values("left", ignore_index=True)
+
+
+def match_imdb_titles(movies: pd.DataFrame, imdb_movies: pd.DataFrame, title_col='Movie name',
+                      year_col='Movie release year', min_confidence=0.8, **match_kwargs) -> pd.DataFrame:
+    """
+    Join CMU movies with IMDb titles (e.g. load_imdb_movies) on their titles and release years
+    :param movies: CMU movies, with a release year column (see extract_release_year)
+    :param imdb_movies: IMDb titles with 'tconst', 'primaryTitle', 'originalTitle' and 'startYear' columns
+    :param title_col: column of the titles of the CMU movies
+    :param year_col: column of the release years of the CMU movies
+    :param min_confidence: matches with a lower confidence are dropped
+    :param match_kwargs: other parameters of match_titles
+    :return: movies with the columns of the matched IMDb title and the 'IMDb match confidence',
+             NaN for unmatched movies
+    """
+    imdb_movies = imdb_movies.reset_index(drop=True)
+    matches = match_titles(movies[title_col].reset_index(drop=True), movies[year_col].reset_index(drop=True),
+                           imdb_movies[["primaryTitle", "originalTitle"]], imdb_movies["startYear"],
+                           min_confidence=min_confidence, **match_kwargs)
+    matched = imdb_movies.iloc[matches["right"]].set_axis(movies.index[matches["left"]])
+    matched["IMDb match confidence"] = matches["confidence"].to_numpy()
+    return movies.join(matched.drop(columns=[col for col in matched if col in movies]))
+
+
+def load_cpi(path=inflation_path) -> pd.Series:
+    """
+    :param path: csv file with 'year' and 'cpi' columns
+    :return: consumer price index indexed by year
+    """
+    return pd.read_csv(path, index_col="year")["cpi"]
+
+
+def adjust_for_inflation(amounts: pd.Series, years: pd.Series, target_year: int = None,
+                         cpi: pd.Series = None) -> pd.Series:
+    """
+    Convert amounts of dollars of their year into dollars of a target year
+    :param amounts: Series of amounts
+    :param years: Series of the years of the amounts, same index
+    :param target_year: year of the converted dollars, the last year of the CPI table if None
+    :param cpi: consumer price index by year, see load_cpi
+    :return: Series of converted amounts, NaN for years absent from the CPI table
+    """
+    cpi = load_cpi() if cpi is None else cpi
+    target_year = cpi.index.max() if target_year is None else target_year
+    year_cpi = cpi.reindex(pd.to_numeric(years).to_numpy()).to_numpy()
+    return amounts * (cpi[target_year] / year_cpi)
+
+
+def fill_box_office_revenue(movies: pd.DataFrame, boxoffice: pd.DataFrame, title_col='Movie name',
+                            year_col='Movie release year', revenue_col='Movie box office revenue',
+                            min_confidence=0.8, adjust_inflation=False, target_year: int = None,
+                            **match_kwargs) -> pd.DataFrame:
+    """
+    Fill the missing revenues of movies with the lifetime gross of the matching movies of boxoffice.csv
+    :param movies: CMU movies, with a release year column (see extract_release_year)
+    :param boxoffice: dataframe with 'title', 'year' and 'lifetime_gross' columns
+    :param title_col: column of the titles of the movies
+    :param year_col: column of the release years of the movies
+    :param revenue_col: column of the revenues of the movies
+    :param min_confidence: matches with a lower confidence are dropped
+    :param adjust_inflation: if True, add a '<revenue_col> (inflation adjusted)' column in dollars of target_year
+    :param target_year: year of the adjusted dollars, the last year of the CPI table if None
+    :param match_kwargs: other parameters of match_titles
+    :return: copy of movies with filled revenues and the 'Box office match confidence' of the filled ones
+    """
+    movies = movies.copy()
+    missing = movies[movies[revenue_col].isna()]
+    boxoffice = boxoffice.reset_index(drop=True)
+    matches = match_titles(missing[title_col], missing[year_col], boxoffice["title"], boxoffice["year"],
+                           min_confidence=min_confidence, **match_kwargs)
+
+    movies.loc[matches["left"], revenue_col] = boxoffice["lifetime_gross"].to_numpy()[matches["right"]]
+    movies["Box office match confidence"] = pd.Series(matches["confidence"].to_numpy(), index=matches["left"])
+    print(f"Filled the revenue of {len(matches)} of {len(missing)} movies without revenue")
+
+    if adjust_inflation:
+        movies[f"{revenue_col} (inflation adjusted)"] = adjust_for_inflation(movies[revenue_col], movies[year_col],
+                                                                            target_year)
+    return movies